@@ -1,31 +1,62 @@
 import os
+import sys
 import json
+from functools import lru_cache
 
 from videoqa.download import download_video_yt_dlp
 from videoqa.frames import extract_base64_frames
-from videoqa.llms import OpenAI_LLM
+from videoqa.llms import OpenAI_LLM, Gemini_LLM, GeminiUploadManager
 from videoqa.prompts import PromptManager
 from videoqa.inspector import VideoProcessor, VideoInspector
 from videoqa.analysis import run_experiments, parse_final_inspection_json
 from videoqa.utils import format_text, save_experiment_statistics
+from videoqa.runner import ExperimentRunner, load_job_manifest
+from videoqa.hierarchy import CNAEHierarchy
+from videoqa.cnae import CNAEIndex, load_few_shot_cnaes
 
-def main():
-    # Exemplo de uso básico via script
-    youtube_url = "https://www.youtube.com/watch?v=SEU_VIDEO_ID"
-    download_dir = "./downloads"
-    video_filename = "meu_video.mp4"
+# generation_config padrão dos jobs com modelos Gemini
+GEMINI_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
 
-    print("Baixando vídeo...")
-    video_path = download_video_yt_dlp(youtube_url, download_dir, filename=video_filename)
-    print("Vídeo salvo em:", video_path)
-    
-    print("Extraindo frames...")
-    processor = VideoProcessor(video_path)
-    frames_list, metadata = processor.process_video()
-    print("Metadados:", metadata)
 
-    # Configura prompts
-    json_mask = """
+@lru_cache(maxsize=None)
+def few_shot_table():
+    return load_few_shot_cnaes()
+
+
+@lru_cache(maxsize=None)
+def cnae_index():
+    return CNAEIndex.from_csv()
+
+def build_prompt_manager(fill_descriptions=False, prefix_cache=False, use_few_shot=False):
+    """
+    Configura os prompts usados nos experimentos.
+    Com fill_descriptions=True a máscara JSON não pede as descrições da classe e da subclasse,
+    que são preenchidas a partir da tabela CNAE (CNAEHierarchy), economizando tokens de saída.
+    Com prefix_cache=True os prompts começam pelo prefixo estático (ver PromptManager).
+    use_few_shot: True inclui a tabela CNAE completa; "retrieval" inclui os CNAEs candidatos
+    recuperados pelo CNAEIndex (a tabela completa só no primeiro batch); False não inclui CNAEs.
+    """
+    if fill_descriptions:
+        json_mask = """
+    {
+      "cnae": "...",
+      "cnae_divisao": "...",
+      "cnae_divisao_descricao": "...",
+      "cnae_grupo": "...",
+      "cnae_grupo_descricao": "...",
+      "reasoning": "...",
+      "images": [
+        [frame_index, batch_sequence]
+      ]
+    }
+    """
+    else:
+        json_mask = """
     {
       "cnae": "...",
       "cnae_divisao": "...",
@@ -43,7 +74,7 @@ def main():
     }
     """
 
-    prompt_manager = PromptManager(
+    return PromptManager(
         dense_prompt=(
             "Você é um especialista em análise visual e deve descrever os frames..."
         ),
@@ -55,8 +86,57 @@ def main():
         ),
         rewrite_prompt=(
             "Você recebeu diversas respostas parciais: {inspections}. Consolidar em um só JSON..."
-        )
+        ),
+        few_shot_cnaes=few_shot_table() if use_few_shot else "",
+        cnae_index=cnae_index() if use_few_shot == "retrieval" else None,
+        prefix_cache=prefix_cache
+    )
+
+def build_llm(job):
+    """
+    Instancia o backend conforme o llmModel do job (modelos "gemini-*" no Gemini, os demais na OpenAI).
+    """
+    model = job.get("llmModel", "gpt-4")
+    if model.lower().startswith("gemini"):
+        return Gemini_LLM(api_key=os.getenv("GEMINI_API_KEY", "SUA_CHAVE_AQUI"), llmmodel=model,
+                          config=GEMINI_CONFIG)
+    return OpenAI_LLM(api_key=os.getenv("OPENAI_API_KEY", "SUA_CHAVE_AQUI"), model=model)
+
+def run_manifest(manifest_path):
+    """
+    Executa todos os jobs de um manifesto (CSV/JSONL) em paralelo, retomando de onde parou.
+    """
+    jobs = load_job_manifest(manifest_path)
+    # O pipeline C envia o vídeo completo ao Gemini, o que exige o gerenciador de uploads
+    needs_upload = any(job.get("pipeline", "A").upper() == "C" for job in jobs)
+    runner = ExperimentRunner(
+        llm_factory=build_llm,
+        prompt_manager_factory=lambda job: build_prompt_manager(fill_descriptions=True,
+                                                                prefix_cache=job.get("prefix_cache", False),
+                                                                use_few_shot=job.get("useFewshot", False)),
+        max_workers=4,
+        upload_manager=GeminiUploadManager() if needs_upload else None,
+        cnae_hierarchy=CNAEHierarchy.load()
     )
+    outcome = runner.run(jobs)
+    print(f"{len(outcome['results'])} jobs concluídos, {len(outcome['errors'])} com erro.")
+
+def main():
+    # Exemplo de uso básico via script
+    youtube_url = "https://www.youtube.com/watch?v=SEU_VIDEO_ID"
+    download_dir = "./downloads"
+    video_filename = "meu_video.mp4"
+
+    print("Baixando vídeo...")
+    video_path = download_video_yt_dlp(youtube_url, download_dir, filename=video_filename)
+    print("Vídeo salvo em:", video_path)
+    
+    print("Extraindo frames...")
+    processor = VideoProcessor(video_path)
+    frames_list, metadata = processor.process_video()
+    print("Metadados:", metadata)
+
+    prompt_manager = build_prompt_manager()
 
     # Configura LLM (OpenAI)
     api_key = os.getenv("OPENAI_API_KEY", "SUA_CHAVE_AQUI")
@@ -101,4 +181,8 @@ def main():
     print(df.head())
 
 if __name__ == "__main__":
-    main()
+    # Uso: python main.py [manifesto.csv|manifesto.jsonl]
+    if len(sys.argv) > 1:
+        run_manifest(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,85 @@
+import os
+import threading
+
+import pytest
+
+from videoqa.cnae import CNAEIndex, load_few_shot_cnaes
+from videoqa.fakes import DEFAULT_ANSWER
+from videoqa.inspector import VideoInspector
+from videoqa.llms import MockLLM
+from videoqa.prompts import PromptManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def table_path(name):
+    return os.path.join(ROOT, name)
+
+
+@pytest.fixture(scope="module")
+def cnae_index():
+    return CNAEIndex.from_csv(table_path("CNAE.csv"), table_path("CNAE_v2.csv"), table_path("CNAE_estrutura.csv"))
+
+
+@pytest.fixture(scope="module")
+def few_shot_table():
+    return load_few_shot_cnaes(table_path("CNAE.csv"), table_path("CNAE_v2.csv"))
+
+
+class RecordingLLM(MockLLM):
+    """
+    MockLLM que guarda os prompts recebidos, para inspecionar o que foi enviado em cada batch.
+    """
+
+    def __init__(self):
+        super().__init__(time_scale=0)
+        self.prompts = []
+        self._prompts_lock = threading.Lock()
+
+    def run_prompt(self, prompt, json_output=False):
+        with self._prompts_lock:
+            self.prompts.append(prompt)
+        return super().run_prompt(prompt, json_output=json_output)
+
+
+def test_search_returns_known_subclass_first(cnae_index):
+    results = cnae_index.search("supermercado", top_k=3)
+    assert results[0][1]["subclasse"] == "4711-3/02"
+
+
+def test_first_pass_answer_retrieves_answered_subclass(cnae_index):
+    codes = [entry["subclasse"] for _, entry in cnae_index.search(DEFAULT_ANSWER, top_k=20)]
+    assert "4711-3/02" in codes
+
+
+def test_candidates_include_division_and_group_descriptions(cnae_index):
+    candidates = cnae_index.format_candidates("supermercado", top_k=3)
+    assert "Divisão 47 - Comércio varejista" in candidates
+    assert "Grupo 47.1 - Comércio varejista não-especializado" in candidates
+    assert "Subclasse 4711-3/02" in candidates
+
+
+def test_pipeline_a_sends_full_table_only_in_first_batch(cnae_index, few_shot_table):
+    prompt_manager = PromptManager("d", "a", "Pergunta: qual o CNAE? Responda em JSON.", "Consolide: {inspections}",
+                                   few_shot_cnaes=few_shot_table, cnae_index=cnae_index, few_shot_top_k=5)
+    llm = RecordingLLM()
+    inspector = VideoInspector(llm, prompt_manager, batch_size=2)
+    inspector.inspect_pipeline_a(["frame"] * 6, video_time_limit=60)
+
+    batch_instructions = [prompt[0]["content"][0] for prompt in llm.prompts[:3]]
+    assert batch_instructions[0].startswith(few_shot_table)
+    for instruction in batch_instructions[1:]:
+        assert few_shot_table not in instruction
+        assert "Subclasse 4711-3/02" in instruction
+    # A consolidação não leva lista de CNAEs
+    assert "Subclasse" not in str(llm.prompts[3])
+
+
+def test_prefix_cache_keeps_full_table_in_prefix_without_query(cnae_index, few_shot_table):
+    prompt_manager = PromptManager("d", "a", "INSTR", "{inspections}", few_shot_cnaes=few_shot_table,
+                                   cnae_index=cnae_index, prefix_cache=True)
+    first = prompt_manager.get_inspection_messages(["frame"], 0)
+    later = prompt_manager.get_inspection_messages(["frame"], 1, few_shot_query="supermercado")
+    assert few_shot_table in first[0]["content"]
+    assert later[0]["content"] == "INSTR"
+    assert "Subclasse 4711-3/02" in later[1]["content"][0]
@@ -0,0 +1,74 @@
+import google.generativeai as genai
+import pytest
+
+from videoqa.execution import RequestExecutor
+from videoqa.fakes import FakeLLMServer
+from videoqa.llms import Gemini_LLM, OpenAI_LLM
+
+FAILURES = [(429, {"Retry-After": "0"}), (503, {})]
+
+
+def openai_llm(server, **options):
+    return OpenAI_LLM("chave", model="gpt-4o", base_url=server.openai_base_url, **options)
+
+
+def gemini_llm(server, config=None, **options):
+    return Gemini_LLM("chave", "gemini-1.5-flash", config or {"temperature": 1},
+                      client_options={"api_endpoint": server.url}, transport="rest", **options)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_openai_client_against_fake_server(stream):
+    with FakeLLMServer() as server:
+        result = openai_llm(server, stream=stream).run_prompt("Qual o CNAE?")
+    assert result["output"] == server.answer
+    assert result["token_usage"].total_tokens > 0
+    assert len(server.requests) == 1
+    assert server.requests[0]["body"]["model"] == "gpt-4o"
+    if stream:
+        assert result["time_to_first_token"] is not None
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_openai_retries_are_owned_by_the_executor(stream):
+    with FakeLLMServer(failures=FAILURES) as server:
+        llm = openai_llm(server, executor=RequestExecutor(base_delay=0.01), stream=stream)
+        result = llm.run_prompt("Qual o CNAE?")
+    # Uma requisição por tentativa: o cliente da OpenAI não refaz as chamadas por conta própria
+    assert len(server.requests) == 3
+    assert result["retries"] == 2
+    assert result["output"] == server.answer
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_gemini_client_against_fake_server(stream):
+    with FakeLLMServer() as server:
+        llm = gemini_llm(server, stream=stream)
+        result = llm.run_prompt(llm.text_prompt("Qual o CNAE?"))
+    assert result["output"] == server.answer
+    assert result["token_usage"].total_token_count > 0
+    assert len(server.requests) == 1
+    assert (":streamGenerateContent" if stream else ":generateContent") in server.requests[0]["path"]
+
+
+def test_gemini_retries_are_owned_by_the_executor():
+    with FakeLLMServer(failures=FAILURES) as server:
+        llm = gemini_llm(server, executor=RequestExecutor(base_delay=0.01))
+        result = llm.run_prompt(llm.text_prompt("Qual o CNAE?"))
+    assert len(server.requests) == 3
+    assert result["retries"] == 2
+
+
+@pytest.mark.parametrize("config", [
+    {"temperature": 1},
+    genai.GenerationConfig(temperature=1),
+    genai.protos.GenerationConfig(temperature=1),
+])
+def test_gemini_json_output_keeps_generation_config(config):
+    with FakeLLMServer() as server:
+        llm = gemini_llm(server, config=config)
+        llm.run_prompt(llm.text_prompt("Qual o CNAE?"), json_output=True)
+    generation_config = server.requests[0]["body"]["generationConfig"]
+    assert generation_config["responseMimeType"] == "application/json"
+    assert generation_config["temperature"] == 1
+    assert llm.config == config
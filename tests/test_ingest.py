@@ -0,0 +1,58 @@
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from videoqa.ingest import FFMPEG_BINARY, stream_source_frames
+from videoqa.inspector import VideoInspector
+from videoqa.llms import MockLLM
+from videoqa.prompts import PromptManager
+
+pytestmark = pytest.mark.skipif(shutil.which(FFMPEG_BINARY) is None, reason="ffmpeg não encontrado")
+
+FPS = 10
+
+
+@pytest.fixture(scope="module")
+def video_path(tmp_path_factory):
+    """
+    Vídeo sintético de 4 s a 10 fps, com o número do frame codificado na cor.
+    """
+    path = str(tmp_path_factory.mktemp("video") / "video.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (64, 48))
+    for index in range(4 * FPS):
+        writer.write(np.full((48, 64, 3), index * 6, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_every_seconds_records_source_indices(video_path):
+    frames, metadata = stream_source_frames(video_path, every_seconds=0.5)
+    assert len(list(frames)) == 8
+    assert metadata["fps"] == FPS
+    assert metadata["frame_indices"] == [0, 5, 10, 15, 20, 25, 30, 35]
+
+
+def test_frame_interval_and_max_seconds(video_path):
+    frames, metadata = stream_source_frames(video_path, frame_interval=4, max_seconds=2)
+    assert len(list(frames)) == 5
+    assert metadata["frame_indices"] == [0, 4, 8, 12, 16]
+
+
+def test_closing_generator_stops_ffmpeg(video_path):
+    frames, metadata = stream_source_frames(video_path, every_seconds=0.1, buffer_frames=1)
+    next(frames)
+    frames.close()
+    assert metadata["frame_indices"] == [0]
+    assert metadata["stream_time"] > 0
+
+
+def test_inspector_cuts_stream_at_time_limit(video_path):
+    prompt_manager = PromptManager("d", "a", "Pergunta: qual o CNAE? Responda em JSON.", "Consolide: {inspections}")
+    inspector = VideoInspector(MockLLM(time_scale=0), prompt_manager, batch_size=2)
+    frames, metadata = stream_source_frames(video_path, every_seconds=0.5)
+    result = inspector.inspect_pipeline_a(frames, video_time_limit=1.5, metadata=metadata)
+    # Frames em 0, 0.5 e 1 s: dois batches (o frame em 1.5 s é lido, mas não enviado)
+    assert len(result["batch_stats"]) == 2
+    assert metadata["frame_indices"][:3] == [0, 5, 10]
@@ -0,0 +1,115 @@
+import pytest
+
+from videoqa import llm_cache
+from videoqa.fakes import FakeLLMServer
+from videoqa.llm_cache import CachedLLM
+from videoqa.llms import MockLLM, OpenAI_LLM
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "llm_cache.sqlite")
+
+
+def test_hit_reports_zero_usage_and_keeps_original(cache_path):
+    llm = MockLLM(time_scale=0)
+    cached = CachedLLM(llm, cache_path=cache_path)
+
+    miss = cached.run_prompt("Qual o CNAE? Responda em JSON.")
+    hit = cached.run_prompt("Qual o CNAE? Responda em JSON.")
+
+    assert llm.calls == 1
+    assert miss["cached"] is False and hit["cached"] is True
+    assert hit["output"] == miss["output"]
+    assert hit["token_usage"].total_tokens == 0
+    assert hit["token_usage"].prompt_tokens == 0
+    assert hit["original_token_usage"].total_tokens == miss["token_usage"].total_tokens
+    assert hit["original_processing_time"] == miss["processing_time"]
+    assert cached.stats()["hits"] == 1
+    assert cached.stats()["misses"] == 1
+    assert cached.stats()["hit_rate"] == 0.5
+    assert cached.stats()["entries"] == 1
+
+
+def test_key_depends_on_prompt_and_json_output(cache_path):
+    llm = MockLLM(time_scale=0)
+    cached = CachedLLM(llm, cache_path=cache_path)
+    cached.run_prompt("prompt 1")
+    cached.run_prompt("prompt 2")
+    cached.run_prompt("prompt 1", json_output=True)
+    assert llm.calls == 3
+    assert cached.stats()["misses"] == 3
+
+
+def test_cache_persists_across_instances(cache_path):
+    llm = MockLLM(time_scale=0)
+    CachedLLM(llm, cache_path=cache_path).run_prompt("prompt")
+    again = CachedLLM(llm, cache_path=cache_path).run_prompt("prompt")
+    assert again["cached"] is True
+    assert llm.calls == 1
+
+
+def test_bypass_neither_reads_nor_writes(cache_path):
+    llm = MockLLM(time_scale=0)
+    cached = CachedLLM(llm, cache_path=cache_path, bypass=True)
+    cached.run_prompt("prompt")
+    result = cached.run_prompt("prompt")
+    assert result["cached"] is False
+    assert llm.calls == 2
+    assert cached.stats()["entries"] == 0
+
+
+def test_max_entries_evicts_least_recently_accessed(cache_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(llm_cache.time, "time", lambda: next(clock))
+    llm = MockLLM(time_scale=0)
+    cached = CachedLLM(llm, cache_path=cache_path, max_entries=2)
+
+    cached.run_prompt("a")
+    cached.run_prompt("b")
+    cached.run_prompt("a")  # acerto: "a" passa a ser o mais recente
+    cached.run_prompt("c")  # remove "b"
+
+    assert cached.stats()["entries"] == 2
+    assert cached.run_prompt("a")["cached"] is True
+    assert cached.run_prompt("b")["cached"] is False
+
+
+def test_max_age_expires_entries(cache_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    llm = MockLLM(time_scale=0)
+    cached = CachedLLM(llm, cache_path=cache_path, max_age_seconds=60)
+
+    cached.run_prompt("prompt")
+    now[0] += 30
+    assert cached.run_prompt("prompt")["cached"] is True
+    now[0] += 60
+    assert cached.run_prompt("prompt")["cached"] is False
+    assert llm.calls == 2
+
+
+def test_max_bytes_keeps_total_size_under_limit(cache_path):
+    llm = MockLLM(time_scale=0, description="x" * 100)
+    cached = CachedLLM(llm, cache_path=cache_path, max_bytes=300)
+    for prompt in ("a", "b", "c", "d"):
+        cached.run_prompt(prompt)
+    stats = cached.stats()
+    assert 0 < stats["bytes"] <= 300
+    assert stats["entries"] < 4
+
+
+def test_streamed_hit_does_not_call_the_server(cache_path):
+    with FakeLLMServer() as server:
+        cached = CachedLLM(OpenAI_LLM("chave", model="gpt-4o", base_url=server.openai_base_url),
+                           cache_path=cache_path)
+        chunks = []
+        miss = cached.run_prompt_streaming("Qual o CNAE?", on_text=chunks.append)
+        hit = cached.run_prompt_streaming("Qual o CNAE?")
+
+    assert len(server.requests) == 1
+    assert "".join(chunks) == miss["output"] == server.answer
+    assert miss["cached"] is False and hit["cached"] is True
+    assert hit["output"] == miss["output"]
+    assert hit["token_usage"].total_tokens == 0
+    assert hit["original_token_usage"].total_tokens == miss["token_usage"].total_tokens
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+import main
+from videoqa.llms import Gemini_LLM, MockLLM, OpenAI_LLM
+from videoqa.prompts import PromptManager
+from videoqa.runner import ExperimentRunner, job_id, load_job_manifest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FRAMES = ["frame"] * 6
+METADATA = {"fps": 30, "frame_interval": 30, "total_frames": 180, "frame_indices": [0, 30, 60, 90, 120, 150]}
+
+
+class OfflineRunner(ExperimentRunner):
+    """
+    ExperimentRunner com frames fixos, sem download nem extração.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_requests = []
+
+    def get_frames(self, youtube_url, frame_interval=None):
+        self.frame_requests.append(youtube_url)
+        return FRAMES, dict(METADATA)
+
+
+def prompt_manager_factory(job):
+    return PromptManager("d", "a", "Pergunta: qual o CNAE? Responda em JSON.", "Consolide: {inspections}")
+
+
+def make_jobs():
+    return [
+        {"youtube_url": f"https://example.com/video{index}", "llmModel": "mock", "batch_size": 2,
+         "pipeline": "A", "runs": 1, "gt_CNAE": "47.11-3-02"}
+        for index in range(3)
+    ]
+
+
+def test_run_resumes_after_interruption(tmp_path):
+    jobs = make_jobs()
+    llms = []
+    interrupted = {job_id(jobs[1])}
+
+    def llm_factory(job):
+        if job_id(job) in interrupted:
+            raise RuntimeError("Execução interrompida")
+        llms.append(MockLLM(time_scale=0))
+        return llms[-1]
+
+    def make_runner():
+        return OfflineRunner(llm_factory, prompt_manager_factory, results_csv=str(tmp_path / "stats.csv"),
+                             state_path=str(tmp_path / "state.jsonl"), max_workers=2)
+
+    runner = make_runner()
+    first = runner.run(jobs)
+    assert set(first["results"]) == {job_id(jobs[0]), job_id(jobs[2])}
+    assert set(first["errors"]) == {job_id(jobs[1])}
+    assert runner.completed_jobs() == {job_id(jobs[0]), job_id(jobs[2])}
+
+    interrupted.clear()
+    factories_before = len(llms)
+    resumed = make_runner()
+    second = resumed.run(jobs)
+    assert set(second["results"]) == {job_id(jobs[1])}
+    assert not second["errors"]
+    assert len(llms) == factories_before + 1
+    assert resumed.frame_requests == [jobs[1]["youtube_url"]]
+    assert resumed.completed_jobs() == {job_id(job) for job in jobs}
+
+    # Tudo concluído: uma nova execução não chama a LLM
+    assert make_runner().run(jobs)["results"] == {}
+    assert len(llms) == factories_before + 1
+
+
+def test_pipeline_c_without_upload_manager_fails_clearly(tmp_path):
+    runner = OfflineRunner(lambda job: MockLLM(time_scale=0), prompt_manager_factory,
+                           state_path=str(tmp_path / "state.jsonl"))
+    with pytest.raises(ValueError, match="upload_manager"):
+        runner.get_upload("https://example.com/video")
+
+
+def test_manifest_coerces_types(tmp_path):
+    manifest = tmp_path / "jobs.csv"
+    manifest.write_text(
+        "youtube_url;llmModel;batch_size;pipeline;useFewshot;prefix_cache;runs\n"
+        "https://example.com/a;gpt-4o;10;A;retrieval;true;2\n"
+        "https://example.com/b;gemini-1.5-flash;5;C;False;;1\n",
+        encoding="utf-8"
+    )
+    jobs = load_job_manifest(str(manifest))
+    assert jobs[0]["batch_size"] == 10 and jobs[0]["runs"] == 2
+    assert jobs[0]["useFewshot"] == "retrieval"
+    assert jobs[0]["prefix_cache"] is True
+    assert jobs[1]["useFewshot"] is False
+    assert "prefix_cache" not in jobs[1]
+
+
+def test_build_llm_follows_llm_model():
+    assert isinstance(main.build_llm({"llmModel": "gemini-1.5-flash"}), Gemini_LLM)
+    assert main.build_llm({"llmModel": "gemini-1.5-flash"}).llmmodel == "gemini-1.5-flash"
+    openai_llm = main.build_llm({"llmModel": "gpt-4o"})
+    assert isinstance(openai_llm, OpenAI_LLM) and openai_llm.model == "gpt-4o"
+
+
+def test_build_prompt_manager_few_shot_modes(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    assert main.build_prompt_manager(use_few_shot=False).few_shot_cnaes == ""
+    full = main.build_prompt_manager(use_few_shot=True)
+    assert full.few_shot_cnaes and full.cnae_index is None
+    retrieval = main.build_prompt_manager(use_few_shot="retrieval")
+    assert retrieval.few_shot_cnaes == full.few_shot_cnaes
+    assert retrieval.cnae_index is not None
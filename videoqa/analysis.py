@@ -1,23 +1,52 @@
 import time
 import json
+import pandas as pd
+from .cnae import cnae_digits
+from .structured import extract_json_object
+from .tracing import get_tracer, span, stage_breakdown
 
-def run_experiments(video_inspector, base64_frames, video_time_limit, pipeline="A", runs=1):
+def validate_final_inspection(result, cnae_hierarchy, experiment_run=None):
+    """
+    Valida o CNAE de final_inspection contra a árvore CNAE (CNAEHierarchy): repara códigos
+    inválidos, preenche as descrições a partir da tabela e registra o resultado em cnae_validation.
+    """
+    final_inspection = coerce_final_inspection(result.get("final_inspection", "{}"), experiment_run)
+    if not final_inspection:
+        result["cnae_validation"] = {"valido": False, "reparado": False, "codigo_original": None, "prefixo_valido": None}
+        return result
+    fixed, report = cnae_hierarchy.validate_answer(final_inspection)
+    if report["reparado"]:
+        print(f"CNAE inválido na execução {experiment_run}: {report['codigo_original']} -> {fixed['cnae']}")
+    result["final_inspection"] = json.dumps(fixed, ensure_ascii=False)
+    result["cnae_validation"] = report
+    return result
+
+
+def run_experiments(video_inspector, base64_frames, video_time_limit, pipeline="A", runs=1, cnae_hierarchy=None,
+                    metadata=None):
     """
     Executa múltiplas rodadas (runs) de inspeção do vídeo (pipeline A ou B) e coleta estatísticas.
+    Cada rodada é um trace (span experiment_run) e traz em stage_breakdown o tempo, bytes e tokens por etapa.
+    Se cnae_hierarchy for informado, o CNAE de cada resposta é validado e reparado (validate_final_inspection).
+    Se metadata (da extração de frames) for informado, video_time_limit é aplicado em segundos reais de vídeo.
     """
     results = []
     for i in range(runs):
         start = time.time()
-        if pipeline.upper() == "A":
-            result = video_inspector.inspect_pipeline_a(base64_frames, video_time_limit)
-        elif pipeline.upper() == "B":
-            result = video_inspector.inspect_pipeline_b(base64_frames, video_time_limit)
-        else:
-            raise ValueError("O pipeline deve ser 'A' ou 'B'")
+        with span("experiment_run", experiment_run=i + 1, pipeline=pipeline.upper()) as run_span:
+            if pipeline.upper() == "A":
+                result = video_inspector.inspect_pipeline_a(base64_frames, video_time_limit, metadata=metadata)
+            elif pipeline.upper() == "B":
+                result = video_inspector.inspect_pipeline_b(base64_frames, video_time_limit, metadata=metadata)
+            else:
+                raise ValueError("O pipeline deve ser 'A' ou 'B'")
+        result["stage_breakdown"] = stage_breakdown(get_tracer().trace_spans(run_span.trace_id))
 
         end = time.time()
         result["experiment_run"] = i + 1
         result["experiment_time"] = end - start
+        if cnae_hierarchy is not None:
+            validate_final_inspection(result, cnae_hierarchy, i + 1)
         results.append(result)
         print(f"Execução {i + 1} concluída em {end - start:.2f} segundos.")
 
@@ -28,17 +57,21 @@ def run_experiments(video_inspector, base64_frames, video_time_limit, pipeline="
         "avg_time": avg_time
     }
 
-def run_experimentsGemini(video_inspector, runs=1):
+def run_experimentsGemini(video_inspector, runs=1, cnae_hierarchy=None):
     """
     Executa múltiplas rodadas (runs) de inspeção do vídeo (pipeline A ou B) e coleta estatísticas.
     """
     results = []
     for i in range(runs):
         start = time.time()
-        result = video_inspector.inspect_pipeline_a()
+        with span("experiment_run", experiment_run=i + 1, pipeline="C") as run_span:
+            result = video_inspector.inspect_pipeline_a()
+        result["stage_breakdown"] = stage_breakdown(get_tracer().trace_spans(run_span.trace_id))
         end = time.time()
         result["experiment_run"] = i + 1
         result["experiment_time"] = end - start
+        if cnae_hierarchy is not None:
+            validate_final_inspection(result, cnae_hierarchy, i + 1)
         results.append(result)
         print(f"Execução {i + 1} concluída em {end - start:.2f} segundos.")
 
@@ -50,13 +83,94 @@ def run_experimentsGemini(video_inspector, runs=1):
     }
 
 
+def coerce_final_inspection(final_inspection_data, experiment_run=None):
+    """
+    Normaliza o campo final_inspection de uma execução em um dicionário.
+    Aceita string JSON, lista (usa o primeiro elemento) ou dicionário; em caso de erro retorna {}.
+    """
+    # Se for uma string, tenta converter usando json.loads()
+    if isinstance(final_inspection_data, str):
+        final_inspection = extract_json_object(final_inspection_data)
+        if final_inspection is None:
+            print(f"Erro ao decodificar JSON na execução {experiment_run}")
+            final_inspection = {}
+    # Se for uma lista, tenta pegar o primeiro elemento (convertendo-o se necessário)
+    elif isinstance(final_inspection_data, list):
+        try:
+            elem = final_inspection_data[0]
+            if isinstance(elem, str):
+                final_inspection = json.loads(elem)
+            else:
+                final_inspection = elem
+        except (IndexError, json.JSONDecodeError):
+            print(f"Erro ao processar `final_inspection` na execução {experiment_run}")
+            final_inspection = {}
+    else:
+        final_inspection = final_inspection_data
+
+    # Se, após o processamento, final_inspection ainda for uma lista,
+    # pega o primeiro elemento (ou usa {} se estiver vazia)
+    if isinstance(final_inspection, list):
+        final_inspection = final_inspection[0] if final_inspection else {}
+    if not isinstance(final_inspection, dict):
+        final_inspection = {}
+    return final_inspection
+
+
 def parse_final_inspection_json(final_inspection_str):
     """
     Exemplo de função para converter o texto retornado pela LLM 
     (que deve estar em formato JSON) em dicionário Python.
+    Usa o primeiro objeto JSON balanceado do texto (ver extract_json_object); retorna {} se não houver.
+    """
+    data = extract_json_object(final_inspection_str)
+    return data if data is not None else {}
+
+
+def few_shot_savings_report(df, baseline="True"):
+    """
+    Compara o consumo de tokens e a taxa de acerto (subclasse) entre os modos de few shot
+    registrados na coluna useFewshot (ex.: True = tabela completa, "retrieval" = CNAEs recuperados pelo índice).
+
+    :param df: DataFrame com as colunas de experimentos_v2.csv (gt_CNAE, cnae, total_tokens, useFewshot...).
+    :param baseline: Valor de useFewshot usado como referência para calcular economia e variação de acerto.
+    :return: DataFrame por llmModel/pipeline/useFewshot com tokens médios, acerto e diferenças para o baseline.
+    """
+    data = df.copy()
+    data["useFewshot"] = data["useFewshot"].astype(str)
+    data["acerto"] = (
+        data["cnae"].map(cnae_digits) == data["gt_CNAE"].map(cnae_digits)
+    ).astype(float) * 100
+
+    report = (
+        data.groupby(["llmModel", "pipeline", "useFewshot"])
+        .agg(n_experimentos=("acerto", "size"),
+             tokens_medios=("total_tokens", "mean"),
+             acerto_full_rate=("acerto", "mean"))
+        .reset_index()
+    )
+
+    base = report[report["useFewshot"] == str(baseline)].set_index(["llmModel", "pipeline"])
+    keys = list(zip(report["llmModel"], report["pipeline"]))
+    base_tokens = [base["tokens_medios"].get(key) for key in keys]
+    base_acerto = [base["acerto_full_rate"].get(key) for key in keys]
+    report["tokens_economizados"] = pd.Series(base_tokens, dtype=float) - report["tokens_medios"]
+    report["variacao_acerto"] = report["acerto_full_rate"] - pd.Series(base_acerto, dtype=float)
+    return report
+
+
+def stage_breakdown_table(experiments_results):
+    """
+    Tabela com o detalhamento por etapa (stage_breakdown) de cada execução:
+    uma linha por execução e etapa, com chamadas, duração, bytes, tokens e tempos parciais.
     """
-    try:
-        data = json.loads(final_inspection_str)
-        return data
-    except json.JSONDecodeError:
-        return {}
+    rows = []
+    for run in experiments_results.get("runs", []):
+        for stage in run.get("stage_breakdown", []):
+            rows.append(dict(stage, experiment_run=run.get("experiment_run")))
+    columns = ["experiment_run", "stage", "calls", "duration", "bytes", "tokens"]
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return pd.DataFrame(columns=columns)
+    extra = [column for column in table.columns if column not in columns]
+    return table[columns + extra]
@@ -0,0 +1,180 @@
+import os
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import pandas as pd
+from .analysis import run_experiments, run_experimentsGemini
+from .frames import compute_sample_indices, encode_frame, extract_base64_frames, iter_sampled_frames, read_video_metadata
+from .inspector import VideoInspector, VideoInspectorGemini
+from .llms import MockLLM
+from .prompts import PromptManager
+
+
+def benchmark_frame_sampling(video_path, seek_modes=("read", "grab", "seek"), encode=True, repeats=1,
+                             frame_interval=None, every_seconds=None, timestamps=None, max_frames=None):
+    """
+    Compara a velocidade de amostragem de frames entre o loop original (cap.read() em todos os frames)
+    e os modos baseados em grab()/retrieve() e em posicionamento direto.
+
+    :param video_path: Caminho do arquivo de vídeo.
+    :param seek_modes: Modos de leitura a comparar (ver frames.SEEK_MODES).
+    :param encode: Se True, inclui a codificação JPEG/base64 no tempo medido.
+    :param repeats: Número de repetições por modo (é reportado o melhor tempo).
+    :return: DataFrame com frames amostrados, tempo e frames/seg por modo.
+    """
+    metadata = read_video_metadata(video_path)
+    indices, _ = compute_sample_indices(
+        metadata["fps"], metadata["total_frames"], frame_interval=frame_interval,
+        every_seconds=every_seconds, timestamps=timestamps, max_frames=max_frames
+    )
+
+    rows = []
+    for seek_mode in seek_modes:
+        best_time = None
+        n_frames = 0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            n_frames = 0
+            for _, frame in iter_sampled_frames(video_path, indices, fps=metadata["fps"], seek_mode=seek_mode):
+                if encode:
+                    encode_frame(frame)
+                n_frames += 1
+            elapsed = time.perf_counter() - start
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+        rows.append({
+            "seek_mode": seek_mode,
+            "frames": n_frames,
+            "seconds": best_time,
+            "frames_per_sec": n_frames / best_time if best_time else 0.0
+        })
+
+    return pd.DataFrame(rows)
+
+
+def make_synthetic_video(path, seconds=30, fps=30, width=640, height=360, scene_seconds=5, seed=0):
+    """
+    Gera um vídeo sintético com OpenCV (cenas coloridas com retângulos em movimento e texto),
+    para benchmarks sem depender de downloads. Reaproveita o arquivo se ele já existir.
+
+    :param path: Caminho do vídeo (.mp4).
+    :param seconds: Duração do vídeo.
+    :param scene_seconds: Duração de cada cena (cor de fundo diferente).
+    :return: Caminho do vídeo.
+    """
+    if os.path.exists(path):
+        return path
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    n_scenes = max(1, int(np.ceil(seconds / scene_seconds)))
+    backgrounds = rng.integers(0, 255, size=(n_scenes, 3))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    try:
+        for index in range(int(seconds * fps)):
+            scene = min(int(index / fps / scene_seconds), n_scenes - 1)
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[:] = backgrounds[scene]
+            x = int((index * 4) % max(1, width - 80))
+            cv2.rectangle(frame, (x, height // 3), (x + 80, height // 3 + 80), (255, 255, 255), -1)
+            cv2.putText(frame, f"cena {scene} frame {index}", (10, height - 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def _benchmark_prompt_manager():
+    # Chaves duplicadas: os templates passam por str.format
+    mask = '{{"cnae": "...", "cnae_divisao": "...", "cnae_grupo": "...", "cnae_classe": "...", ' \
+           '"cnae_subclasse": "...", "reasoning": "...", "images": [[frame_index, batch_sequence]]}}'
+    return PromptManager(
+        dense_prompt="Descreva os frames.",
+        answer_prompt="Com base nas descrições: {descriptions}, retorne o CNAE neste formato JSON: " + mask,
+        inspection_prompt="Pergunta: qual o CNAE? Responda no formato JSON a seguir: " + mask,
+        rewrite_prompt="Você recebeu diversas respostas parciais: {inspections}. Consolide em um só JSON: " + mask
+    )
+
+
+def benchmark_pipelines(video_seconds=(30, 120), batch_sizes=(5, 10, 20), pipelines=("A", "B", "C"),
+                        work_dir="./benchmarks", llm_factory=None, max_concurrency=1, runs=1,
+                        every_seconds=1, video_time_limit=None, time_scale=0.0):
+    """
+    Mede vazão, latência e memória dos pipelines A, B e do caminho do Gemini (C) com vídeos sintéticos
+    e um backend simulado (MockLLM), sem rede.
+
+    :param video_seconds: Durações dos vídeos sintéticos gerados.
+    :param batch_sizes: Tamanhos de batch avaliados (A e B).
+    :param pipelines: Pipelines avaliados ('A', 'B' e/ou 'C').
+    :param work_dir: Diretório dos vídeos sintéticos.
+    :param llm_factory: Função (pipeline) -> LLM; default = MockLLM determinístico
+                        (provider 'gemini' para o pipeline C).
+    :param max_concurrency: Batches simultâneos no VideoInspector.
+    :param runs: Repetições por configuração.
+    :param every_seconds: Intervalo de amostragem dos frames.
+    :param video_time_limit: Limite de tempo de vídeo (default = vídeo inteiro).
+    :param time_scale: Fator de espera real do MockLLM (0 = mede só o custo local do pipeline).
+    :return: DataFrame com uma linha por vídeo/pipeline/batch_size.
+    """
+    if llm_factory is None:
+        def llm_factory(pipeline):
+            return MockLLM(provider="gemini" if pipeline == "C" else "openai", time_scale=time_scale)
+
+    prompt_manager = _benchmark_prompt_manager()
+    rows = []
+    for seconds in video_seconds:
+        video_path = make_synthetic_video(os.path.join(work_dir, f"synthetic_{seconds}s.mp4"), seconds=seconds)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        frames, metadata = extract_base64_frames(video_path, every_seconds=every_seconds)
+        extract_time = time.perf_counter() - start
+        _, extract_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        for pipeline in pipelines:
+            for batch_size in (batch_sizes if pipeline != "C" else (None,)):
+                llm = llm_factory(pipeline)
+                tracemalloc.start()
+                start = time.perf_counter()
+                if pipeline == "C":
+                    inspector = VideoInspectorGemini(llm, video_path, prompt_manager)
+                    results = run_experimentsGemini(inspector, runs=runs)
+                else:
+                    inspector = VideoInspector(llm, prompt_manager, batch_size=batch_size,
+                                               max_concurrency=max_concurrency)
+                    results = run_experiments(inspector, frames, video_time_limit or len(frames),
+                                              pipeline=pipeline, runs=runs)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                latencies = [
+                    stats["processing_time"]
+                    for run in results["runs"]
+                    for stats in run.get("batch_stats", []) + ([run["final_stats"]] if run.get("final_stats") else [])
+                ] or [run["total_time"] for run in results["runs"]]
+                n_calls = sum(len(run.get("batch_stats", [])) + 1 for run in results["runs"])
+                rows.append({
+                    "video_seconds": seconds,
+                    "frames": len(frames),
+                    "pipeline": pipeline,
+                    "batch_size": batch_size,
+                    "runs": runs,
+                    "llm_calls": n_calls,
+                    "total_tokens": sum(run["total_tokens"] for run in results["runs"]),
+                    "extract_seconds": extract_time,
+                    "pipeline_seconds": elapsed,
+                    "frames_per_sec": len(frames) * runs / elapsed if pipeline != "C" and elapsed else None,
+                    "latency_p50": float(np.percentile(latencies, 50)),
+                    "latency_p95": float(np.percentile(latencies, 95)),
+                    "extract_peak_mb": extract_peak / 2 ** 20,
+                    "pipeline_peak_mb": peak / 2 ** 20
+                })
+                print(f"{seconds}s / pipeline {pipeline} / batch {batch_size}: {elapsed:.2f}s")
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,198 @@
+import os
+import csv
+import math
+import re
+import unicodedata
+from collections import Counter
+
+# Palavras muito frequentes em português que não ajudam a discriminar atividades
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "para", "por", "com", "sem", "um", "uma", "uns", "umas", "ao", "aos", "que", "se", "ou",
+    "exceto", "outros", "outras", "outro", "outra", "nao", "especificados", "especificadas",
+    "anteriormente", "atividades", "atividade", "servicos", "produtos", "imagem", "imagens",
+    "frame", "frames", "cnae", "batch", "sequence",
+}
+
+
+def normalize_text(text):
+    """
+    Converte o texto para minúsculas e remove acentos.
+    """
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """
+    Quebra o texto em termos para o índice léxico: minúsculas, sem acentos,
+    sem stopwords e com um stemming simples de plural.
+    """
+    tokens = []
+    for token in re.findall(r"[a-z]+", normalize_text(text)):
+        if len(token) < 3 or token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def cnae_digits(code):
+    """
+    Mantém apenas os dígitos de um código CNAE (ex.: "47.11-3-01" -> "4711301").
+    """
+    if code is None:
+        return ""
+    return re.sub(r"\D", "", str(code))
+
+
+def load_few_shot_cnaes(classes_csv="CNAE.csv", subclasses_csv="CNAE_v2.csv"):
+    """
+    Texto das tabelas de CNAE (classes com observações e subclasses) usado como few shot completo
+    (PromptManager(few_shot_cnaes=...)).
+    """
+    parts = []
+    for path in (classes_csv, subclasses_csv):
+        with open(path, encoding="utf-8-sig") as f:
+            parts.append(f.read().strip())
+    return "\n\n".join(parts)
+
+
+def load_cnae_structure(structure_csv="CNAE_estrutura.csv"):
+    """
+    Lê as descrições das divisões e grupos (CNAE;descricao), ex.: "47" e "47.1".
+    Retorna dict código -> descrição (vazio se o arquivo não existir).
+    """
+    if not structure_csv or not os.path.exists(structure_csv):
+        return {}
+    with open(structure_csv, encoding="utf-8-sig", newline="") as f:
+        return {row["CNAE"].strip(): row["descricao"].strip() for row in csv.DictReader(f, delimiter=";")}
+
+
+def load_cnae_entries(classes_csv="CNAE.csv", subclasses_csv="CNAE_v2.csv", structure_csv="CNAE_estrutura.csv"):
+    """
+    Lê as tabelas de CNAE (classes com observações e subclasses) e monta uma lista de
+    subclasses com seus ancestrais (divisão, grupo e classe).
+
+    :param classes_csv: CSV com as classes (CNAE;descricao;observacao), ex.: "47.11-3".
+    :param subclasses_csv: CSV com as subclasses (CNAE;Descricao), ex.: "4711-3/01".
+    :param structure_csv: CSV com as divisões e grupos (CNAE;descricao), ex.: "47" e "47.1".
+                          Sem ele, as descrições da divisão e do grupo ficam vazias.
+    :return: Lista de dicts com subclasse, classe, grupo, divisão e descrições.
+    """
+    structure = load_cnae_structure(structure_csv)
+    classes = {}
+    with open(classes_csv, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            code = row["CNAE"].strip()
+            entry = classes.setdefault(code, {"descricao": row["descricao"].strip(), "observacoes": []})
+            observacao = (row.get("observacao") or "").strip()
+            if observacao:
+                entry["observacoes"].append(observacao)
+
+    entries = []
+    with open(subclasses_csv, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            subclasse = row["CNAE"].strip()
+            digits = cnae_digits(subclasse)
+            classe = f"{digits[:2]}.{digits[2:4]}-{digits[4]}"
+            class_info = classes.get(classe, {"descricao": "", "observacoes": []})
+            entries.append({
+                "subclasse": subclasse,
+                "subclasse_descricao": row["Descricao"].strip(),
+                "classe": classe,
+                "classe_descricao": class_info["descricao"],
+                "classe_observacoes": class_info["observacoes"],
+                "grupo": f"{digits[:2]}.{digits[2]}",
+                "grupo_descricao": structure.get(f"{digits[:2]}.{digits[2]}", ""),
+                "divisao": digits[:2],
+                "divisao_descricao": structure.get(digits[:2], ""),
+            })
+    return entries
+
+
+def _ancestor_line(level, code, description):
+    return f"{level} {code} - {description}" if description else f"{level} {code}"
+
+
+class CNAEIndex:
+    def __init__(self, entries, k1=1.5, b=0.75):
+        """
+        Índice léxico BM25 (local, sem rede) sobre as subclasses CNAE.
+        Cada documento contém a descrição da subclasse e a descrição/observações da sua classe.
+
+        :param entries: Lista retornada por load_cnae_entries.
+        :param k1: Parâmetro de saturação de frequência do BM25.
+        :param b: Parâmetro de normalização por tamanho do documento do BM25.
+        """
+        self.entries = entries
+        self.k1 = k1
+        self.b = b
+
+        self.doc_terms = []
+        doc_freq = Counter()
+        for entry in entries:
+            text = " ".join(
+                [entry["subclasse_descricao"], entry["classe_descricao"]] + entry["classe_observacoes"]
+            )
+            terms = Counter(tokenize(text))
+            self.doc_terms.append(terms)
+            doc_freq.update(terms.keys())
+
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_length = sum(self.doc_lengths) / max(len(self.doc_lengths), 1)
+        n_docs = len(entries)
+        self.idf = {
+            term: math.log(1 + (n_docs - freq + 0.5) / (freq + 0.5))
+            for term, freq in doc_freq.items()
+        }
+
+    @classmethod
+    def from_csv(cls, classes_csv="CNAE.csv", subclasses_csv="CNAE_v2.csv", structure_csv="CNAE_estrutura.csv",
+                 **kwargs):
+        return cls(load_cnae_entries(classes_csv, subclasses_csv, structure_csv), **kwargs)
+
+    def search(self, query, top_k=20):
+        """
+        Retorna as top_k subclasses mais relevantes para o texto de consulta
+        (descrições dos batches ou um palpite inicial da LLM), como lista de (score, entry).
+        """
+        query_terms = set(tokenize(query))
+        scores = []
+        for i, terms in enumerate(self.doc_terms):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_length)
+            for term in query_terms:
+                freq = terms.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scores.append((score, i))
+
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, self.entries[i]) for score, i in scores[:top_k]]
+
+    def format_candidates(self, query, top_k=20):
+        """
+        Monta o bloco de texto com as subclasses candidatas agrupadas por divisão, grupo e classe,
+        pronto para ser incluído no prompt no lugar da tabela completa.
+        """
+        results = self.search(query, top_k=top_k)
+        # Mantém a ordem hierárquica para que os ancestrais apareçam uma única vez
+        selected = sorted((entry for _, entry in results), key=lambda entry: entry["subclasse"])
+
+        lines = []
+        last_divisao = last_grupo = last_classe = None
+        for entry in selected:
+            if entry["divisao"] != last_divisao:
+                lines.append(_ancestor_line("Divisão", entry["divisao"], entry.get("divisao_descricao")))
+                last_divisao = entry["divisao"]
+            if entry["grupo"] != last_grupo:
+                lines.append("  " + _ancestor_line("Grupo", entry["grupo"], entry.get("grupo_descricao")))
+                last_grupo = entry["grupo"]
+            if entry["classe"] != last_classe:
+                lines.append(f"    Classe {entry['classe']} - {entry['classe_descricao']}")
+                last_classe = entry["classe"]
+            lines.append(f"      Subclasse {entry['subclasse']} - {entry['subclasse_descricao']}")
+        return "\n".join(lines)
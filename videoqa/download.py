@@ -1,29 +1,122 @@
 import os
+import hashlib
 import yt_dlp
+from yt_dlp.utils import download_range_func
+from yt_dlp.downloader.external import FFmpegFD
+from .tracing import current_span, traced
 
-def download_video_yt_dlp(youtube_url, download_dir, filename="downloaded_video.mp4"):
+
+def download_format_options(max_height=None, max_bitrate=None, video_only=False, format_selector=None):
+    """
+    Opções de formato do yt_dlp para amostragem de frames.
+
+    Sem limites, mantém o formato original ('mp4'). Com limites, ordena os formatos pela maior
+    resolução/bitrate que não ultrapassa o teto (ou, se nenhum couber, pelo menor acima dele),
+    preferindo mp4 e arquivos únicos, que não exigem mesclar áudio e vídeo com o ffmpeg.
+
+    :param max_height: Altura máxima do vídeo em pixels (os prompts redimensionam os frames para 768 px).
+    :param max_bitrate: Bitrate total máximo em kbps.
+    :param video_only: Se True, prefere streams só de vídeo (sem áudio), suficientes para extrair frames.
+    :param format_selector: Seletor do yt_dlp que substitui o formato escolhido (ex.: "worst[ext=mp4]").
+    """
+    options = {}
+    if max_height is None and max_bitrate is None and not video_only and format_selector is None:
+        options["format"] = "mp4"
+        return options
+
+    options["format"] = format_selector or ("bv[ext=mp4]/bv/b[ext=mp4]/b" if video_only else "b[ext=mp4]/b")
+    format_sort = []
+    if max_height is not None:
+        format_sort.append(f"res:{int(max_height)}")
+    if max_bitrate is not None:
+        format_sort.append(f"tbr:{int(max_bitrate)}")
+    format_sort.append("ext:mp4")
+    options["format_sort"] = format_sort
+    return options
+
+
+def video_variant_filename(filename, section=None, max_height=None, max_bitrate=None, video_only=False,
+                           format_selector=None):
+    """
+    Nome do arquivo em cache para uma combinação de opções de download, para que versões
+    parciais ou de baixa resolução de um mesmo vídeo não se confundam com o vídeo completo.
+    Sem opções, retorna o próprio filename.
+
+    Ex.: video_variant_filename("loja.mp4", section=(0, 30), max_height=360) -> "loja.s0-30.h360.mp4"
+    """
+    parts = []
+    if section is not None:
+        start, end = section
+        parts.append(f"s{start:g}-{end:g}" if end is not None else f"s{start:g}-")
+    if max_height is not None:
+        parts.append(f"h{int(max_height)}")
+    if max_bitrate is not None:
+        parts.append(f"b{int(max_bitrate)}")
+    if video_only:
+        parts.append("v")
+    if format_selector is not None:
+        parts.append("f" + hashlib.sha1(format_selector.encode("utf-8")).hexdigest()[:8])
+    if not parts:
+        return filename
+    base, extension = os.path.splitext(filename)
+    return ".".join([base] + parts) + extension
+
+
+@traced("download")
+def download_video_yt_dlp(youtube_url, download_dir, filename="downloaded_video.mp4", max_duration=None,
+                          section=None, max_height=None, max_bitrate=None, video_only=False,
+                          format_selector=None, ydl_options=None):
     """
     Faz download de um vídeo do YouTube utilizando yt_dlp, caso o arquivo não exista.
-    
+
+    Os pipelines só analisam os primeiros video_time_limit segundos e redimensionam os frames,
+    então é possível baixar apenas um trecho e/ou uma versão de menor resolução. Cada combinação
+    de opções gera um arquivo próprio em cache (ver video_variant_filename).
+
     :param youtube_url: URL do vídeo no YouTube
     :param download_dir: Diretório onde o vídeo será salvo
     :param filename: Nome do arquivo de saída
+    :param max_duration: Baixa apenas os primeiros max_duration segundos (equivale a section=(0, max_duration)).
+    :param section: Trecho (início, fim) em segundos a baixar; fim None = até o final. Exige ffmpeg no PATH;
+                    sem ele, o vídeo é baixado inteiro.
+    :param max_height: Altura máxima do vídeo em pixels.
+    :param max_bitrate: Bitrate total máximo em kbps.
+    :param video_only: Se True, prefere streams sem áudio.
+    :param format_selector: Seletor de formato do yt_dlp (substitui o escolhido pelas opções acima).
+    :param ydl_options: Opções extras repassadas ao yt_dlp.YoutubeDL (sobrescrevem as geradas aqui).
     :return: Caminho completo do vídeo baixado
     """
+    if section is None and max_duration is not None:
+        section = (0, max_duration)
+    if section is not None and not FFmpegFD.available():
+        print("ffmpeg não encontrado: o trecho não pode ser recortado no download; baixando o vídeo completo.")
+        section = None
+    filename = video_variant_filename(filename, section, max_height, max_bitrate, video_only, format_selector)
+
     os.makedirs(download_dir, exist_ok=True)
     output_path = os.path.join(download_dir, filename)
-    
+
     # Verifica se o arquivo já existe
     if os.path.exists(output_path):
         print(f"Arquivo '{filename}' já existe em '{download_dir}'. Pulando download.")
+        current_span().set(url=youtube_url, cached=True, bytes=os.path.getsize(output_path))
         return output_path
-    
+
     print("Iniciando download do vídeo...")
     ydl_opts = {
         'outtmpl': output_path,
-        'format': 'mp4',
     }
+    ydl_opts.update(download_format_options(max_height, max_bitrate, video_only, format_selector))
+
+    if section is not None:
+        start, end = section
+        ydl_opts['download_ranges'] = download_range_func(None, [(start, end if end is not None else float("inf"))])
+    ydl_opts.update(ydl_options or {})
+
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         ydl.download([youtube_url])
-    
+
+    current_span().set(url=youtube_url, cached=False, format=ydl_opts.get('format'),
+                       max_height=max_height, max_bitrate=max_bitrate, section=section,
+                       bytes=os.path.getsize(output_path) if os.path.exists(output_path) else None)
     return output_path
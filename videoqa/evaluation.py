@@ -0,0 +1,130 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Níveis hierárquicos do CNAE: (nome, número de dígitos, divisor do código inteiro de 7 dígitos)
+CNAE_LEVELS = (
+    ("divisao", 2, 100000),
+    ("grupo", 3, 10000),
+    ("classe", 5, 100),
+    ("subclasse", 7, 1),
+)
+
+GROUP_BY = ("llmModel", "pipeline", "useFewshot")
+
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+
+def normalize_cnae_code(code):
+    """
+    Converte um código CNAE em qualquer formato ("47.11-3-01", "47-11-3-01", "0111-3/01", "4711301")
+    para (código inteiro de 7 dígitos, número de dígitos informados). Códigos parciais
+    (ex.: só a classe "47.11-3") são completados com zeros. Retorna (None, 0) se não houver dígitos.
+    """
+    digits = re.sub(r"\D", "", "" if code is None else str(code))[:7]
+    if not digits:
+        return None, 0
+    return int(digits.ljust(7, "0")), len(digits)
+
+
+def normalize_cnae_series(codes):
+    """
+    Versão vetorizada de normalize_cnae_code para uma Series do pandas.
+    Retorna (códigos inteiros como float com NaN para inválidos, número de dígitos).
+    """
+    digits = codes.astype("string").fillna("").str.replace(r"\D", "", regex=True).str.slice(0, 7)
+    lengths = digits.str.len().fillna(0).astype(int).to_numpy()
+    padded = digits.str.pad(7, side="right", fillchar="0")
+    values = pd.to_numeric(padded.where(lengths > 0), errors="coerce").to_numpy(dtype=float)
+    return values, lengths
+
+
+def hierarchical_hits(predicted, expected):
+    """
+    Calcula, de forma vetorizada, os acertos por nível (divisão, grupo, classe, subclasse)
+    entre duas Series de códigos CNAE. Retorna um DataFrame booleano com uma coluna por nível.
+    """
+    pred_codes, pred_lengths = normalize_cnae_series(pd.Series(predicted).reset_index(drop=True))
+    true_codes, true_lengths = normalize_cnae_series(pd.Series(expected).reset_index(drop=True))
+    valid = ~np.isnan(pred_codes) & ~np.isnan(true_codes)
+    pred_int = np.where(valid, pred_codes, 0).astype(np.int64)
+    true_int = np.where(valid, true_codes, 0).astype(np.int64)
+
+    hits = {}
+    for level, n_digits, divisor in CNAE_LEVELS:
+        informed = valid & (pred_lengths >= n_digits) & (true_lengths >= n_digits)
+        hits[f"acerto_{level}"] = informed & (pred_int // divisor == true_int // divisor)
+    return pd.DataFrame(hits, index=pd.Series(predicted).index)
+
+
+def run_costs(df, prices):
+    """
+    Custo estimado de cada execução, com preços por milhão de tokens por modelo:
+    prices = {"gpt-4o-mini": {"input": 0.15, "output": 0.60}, ...}.
+    Usa prompt_tokens/completion_tokens quando disponíveis; senão cobra total_tokens pelo preço de entrada.
+    """
+    input_price = df["llmModel"].map(lambda model: prices.get(model, {}).get("input", np.nan)).astype(float)
+    output_price = df["llmModel"].map(lambda model: prices.get(model, {}).get("output", np.nan)).astype(float)
+    total = pd.to_numeric(df["total_tokens"], errors="coerce")
+    if "prompt_tokens" in df and "completion_tokens" in df:
+        prompt = pd.to_numeric(df["prompt_tokens"], errors="coerce")
+        completion = pd.to_numeric(df["completion_tokens"], errors="coerce")
+        split_cost = (prompt * input_price + completion * output_price) / 1e6
+        return split_cost.fillna(total * input_price / 1e6)
+    return total * input_price / 1e6
+
+
+def evaluate_runs(df, group_by=GROUP_BY, prices=None, time_column="total_time"):
+    """
+    Avalia o histórico de execuções (ResultStore.to_dataframe() ou experimentos_v2.csv):
+    taxas de acerto por nível do CNAE, tempo e tokens médios/totais, percentis de latência,
+    tokens (e custo, se prices for informado) por resposta correta.
+
+    :param df: DataFrame com gt_CNAE, cnae, total_tokens, total_time e as colunas de group_by.
+    :param group_by: Colunas de agrupamento.
+    :param prices: Preços por milhão de tokens por modelo (ver run_costs), opcional.
+    :param time_column: Coluna de latência usada nos tempos e percentis.
+    :return: DataFrame com uma linha por grupo.
+    """
+    group_by = list(group_by)
+    data = df[group_by].copy()
+    for column in group_by:
+        data[column] = data[column].astype(str)
+    data = data.reset_index(drop=True)
+
+    hits = hierarchical_hits(df["cnae"].reset_index(drop=True), df["gt_CNAE"].reset_index(drop=True))
+    for column in hits:
+        data[column] = hits[column].to_numpy(dtype=float)
+    data["acerto_full"] = data["acerto_subclasse"]
+    data["tempo"] = pd.to_numeric(df[time_column].reset_index(drop=True).astype(str).str.replace(",", "."), errors="coerce")
+    data["tokens"] = pd.to_numeric(df["total_tokens"].reset_index(drop=True), errors="coerce")
+    if prices is not None:
+        data["custo"] = run_costs(df.reset_index(drop=True), prices).to_numpy()
+
+    grouped = data.groupby(group_by, sort=True)
+    report = grouped.agg(
+        n_experimentos=("acerto_full", "size"),
+        acerto_full_rate=("acerto_full", "mean"),
+        acerto_divisao_rate=("acerto_divisao", "mean"),
+        acerto_grupo_rate=("acerto_grupo", "mean"),
+        acerto_classe_rate=("acerto_classe", "mean"),
+        tempo_medio=("tempo", "mean"),
+        tokens_medios=("tokens", "mean"),
+        tempo_total=("tempo", "sum"),
+        tokens_totais=("tokens", "sum"),
+        acertos=("acerto_full", "sum"),
+    )
+    for column in ("acerto_full_rate", "acerto_divisao_rate", "acerto_grupo_rate", "acerto_classe_rate"):
+        report[column] *= 100
+
+    percentiles = grouped["tempo"].quantile([p / 100 for p in LATENCY_PERCENTILES]).unstack()
+    percentiles.columns = [f"latencia_p{p}" for p in LATENCY_PERCENTILES]
+    report = report.join(percentiles)
+
+    correct = report["acertos"].replace(0, np.nan)
+    report["tokens_por_acerto"] = report["tokens_totais"] / correct
+    if prices is not None:
+        report["custo_total"] = grouped["custo"].sum(min_count=1)
+        report["custo_por_acerto"] = report["custo_total"] / correct
+
+    return report.reset_index()
@@ -0,0 +1,260 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+# Códigos HTTP que justificam uma nova tentativa
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Trechos de nomes de exceções transitórias (OpenAI, Google API core, httpx, requests)
+RETRYABLE_ERROR_NAMES = (
+    "Timeout", "Connection", "RateLimit", "ServiceUnavailable", "ResourceExhausted",
+    "InternalServerError", "DeadlineExceeded", "TooManyRequests"
+)
+
+# Atributos de uso de tokens dos backends (OpenAI: *_tokens, Gemini: *_token_count)
+TOKEN_USAGE_FIELDS = (
+    "prompt_tokens", "completion_tokens", "total_tokens",
+    "prompt_token_count", "candidates_token_count", "total_token_count", "cached_content_token_count"
+)
+
+
+def run_coroutine(coro):
+    """
+    Executa uma coroutine até o fim. Se já houver um event loop rodando
+    (ex.: Jupyter), executa em uma thread separada para não bloquear o loop atual.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        """
+        Balde de fichas para limitar uma taxa por minuto (requisições ou tokens).
+
+        :param rate_per_minute: Fichas repostas por minuto.
+        :param capacity: Máximo de fichas acumuladas (default = rate_per_minute).
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount=1):
+        """
+        Consome amount fichas, esperando se necessário. Retorna o tempo de espera em segundos.
+        Pedidos maiores que a capacidade esperam até o balde encher.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """
+        Corrige o saldo após a chamada (ex.: diferença entre tokens estimados e reais).
+        O saldo pode ficar negativo, atrasando as próximas chamadas.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+def error_status(error):
+    """
+    Extrai o código HTTP de uma exceção dos clientes (status_code, code ou response.status_code).
+    """
+    for attribute in ("status_code", "code", "http_status"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_seconds(error):
+    """
+    Lê o cabeçalho Retry-After (segundos ou data HTTP) ou retry-after-ms da resposta de erro, se houver.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(error):
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__
+    return any(fragment in name for fragment in RETRYABLE_ERROR_NAMES)
+
+
+class RequestExecutor:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=5,
+                 base_delay=1.0, max_delay=60.0, timeout=None):
+        """
+        Camada comum de execução das chamadas às APIs de LLM: limite de requisições e de tokens
+        por minuto (token bucket), novas tentativas com backoff exponencial e jitter,
+        respeito ao Retry-After e timeout por chamada.
+        Pode ser compartilhada entre várias instâncias de LLMBase (e entre threads).
+
+        :param requests_per_minute: Limite de requisições por minuto (None = sem limite).
+        :param tokens_per_minute: Limite de tokens por minuto (None = sem limite).
+        :param max_retries: Número máximo de novas tentativas em erros transitórios.
+        :param base_delay: Espera inicial do backoff, em segundos.
+        :param max_delay: Espera máxima do backoff, em segundos.
+        :param timeout: Timeout de cada chamada, em segundos (repassado ao cliente da API).
+        """
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    def backoff_delay(self, attempt, error=None):
+        """
+        Espera antes da tentativa seguinte: Retry-After, se informado, ou backoff exponencial com jitter completo.
+        """
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def execute(self, call, estimated_tokens=0):
+        """
+        Executa call(timeout) respeitando os limites e refazendo a chamada em erros transitórios.
+
+        :param call: Função que recebe o timeout (ou None) e faz a chamada à API.
+        :param estimated_tokens: Tokens estimados da chamada, para o limite de tokens por minuto.
+        :return: (resposta, estatísticas com retries, throttle_wait e retry_wait).
+        """
+        stats = {"retries": 0, "throttle_wait": 0.0, "retry_wait": 0.0}
+        attempt = 0
+        while True:
+            if self.request_bucket is not None:
+                stats["throttle_wait"] += self.request_bucket.acquire(1)
+            if self.token_bucket is not None and estimated_tokens:
+                stats["throttle_wait"] += self.token_bucket.acquire(estimated_tokens)
+            try:
+                return call(self.timeout), stats
+            except Exception as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    raise
+                delay = self.backoff_delay(attempt, error)
+                print(f"Erro transitório ({type(error).__name__}); nova tentativa em {delay:.1f}s...")
+                time.sleep(delay)
+                stats["retries"] += 1
+                stats["retry_wait"] += delay
+                attempt += 1
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """
+        Ajusta o limite de tokens com a diferença entre os tokens estimados e os efetivamente usados.
+        """
+        if self.token_bucket is not None and actual_tokens is not None:
+            self.token_bucket.adjust(actual_tokens - estimated_tokens)
+
+
+# Estimativa grosseira de tokens por imagem (detail=high, frame de até 768px)
+IMAGE_TOKENS_ESTIMATE = 765
+
+
+def estimate_prompt_tokens(prompt):
+    """
+    Estimativa rápida dos tokens de um prompt (≈4 caracteres por token de texto e um valor
+    fixo por imagem), usada apenas para o limite de tokens por minuto.
+    """
+    if isinstance(prompt, str):
+        return len(prompt) // 4 + 1
+    if isinstance(prompt, dict):
+        if "image" in prompt:
+            return IMAGE_TOKENS_ESTIMATE
+        return sum(estimate_prompt_tokens(value) for key, value in prompt.items() if key != "role")
+    if isinstance(prompt, (list, tuple)):
+        return sum(estimate_prompt_tokens(item) for item in prompt)
+    return 0
+
+
+def token_usage_to_dict(token_usage):
+    """
+    Extrai os contadores de tokens do objeto de uso retornado pelo backend (ou de um dict).
+    """
+    if isinstance(token_usage, dict):
+        return {key: value for key, value in token_usage.items() if isinstance(value, (int, float))}
+    usage = {}
+    for field in TOKEN_USAGE_FIELDS:
+        value = getattr(token_usage, field, None)
+        if isinstance(value, (int, float)):
+            usage[field] = value
+    return usage
+
+
+def cached_prompt_tokens(token_usage):
+    """
+    Tokens do prompt servidos pelo cache do provedor: prompt_tokens_details.cached_tokens (cache automático
+    da OpenAI) ou cached_content_token_count (cache explícito do Gemini). Retorna None se o backend não informar.
+    """
+    if isinstance(token_usage, dict):
+        details = token_usage.get("prompt_tokens_details") or {}
+        value = details.get("cached_tokens") if isinstance(details, dict) else None
+        if value is None:
+            value = token_usage.get("cached_content_token_count")
+        return value if isinstance(value, (int, float)) else None
+    details = getattr(token_usage, "prompt_tokens_details", None)
+    value = getattr(details, "cached_tokens", None) if details is not None else None
+    if not isinstance(value, (int, float)):
+        value = getattr(token_usage, "cached_content_token_count", None)
+    return value if isinstance(value, (int, float)) else None
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = json.dumps({
+    "cnae": "47.11-3-02",
+    "cnae_divisao": "47",
+    "cnae_divisao_descricao": "Comércio varejista",
+    "cnae_grupo": "11",
+    "cnae_grupo_descricao": "Comércio varejista não especializado",
+    "cnae_classe": "3",
+    "cnae_classe_descricao": "Comércio varejista de mercadorias em geral, com predominância de produtos alimentícios - hipermercados e supermercados",
+    "cnae_subclasse": "02",
+    "cnae_subclasse_descricao": "Supermercados",
+    "reasoning": "Resposta simulada pelo servidor local.",
+    "images": [[0, 0]]
+}, ensure_ascii=False)
+
+
+class FakeLLMServer:
+    def __init__(self, answer=DEFAULT_ANSWER, failures=None, host="127.0.0.1", port=0,
+                 chunk_size=16, first_token_delay=0.0, chunk_delay=0.0, cache_min_tokens=1024,
+                 cache_granularity=128):
+        """
+        Servidor HTTP local que imita as APIs da OpenAI (/chat/completions, também com stream=True)
+        e do Gemini (:generateContent e :streamGenerateContent), para testar os backends sem rede.
+
+        :param answer: Texto retornado pelo "modelo".
+        :param failures: Lista de respostas de erro devolvidas antes das respostas normais,
+                         cada uma como (status, headers), ex.: [(429, {"Retry-After": "0"}), (503, {})].
+        :param host: Endereço de escuta.
+        :param port: Porta (0 = escolhida automaticamente).
+        :param chunk_size: Caracteres da resposta por evento nas respostas em streaming (SSE).
+        :param first_token_delay: Espera antes do primeiro evento (simula fila/prefill), em segundos.
+        :param chunk_delay: Espera entre eventos (simula a geração), em segundos.
+        :param cache_min_tokens: Tamanho mínimo do prefixo comum (em tokens) para o cache de prompt simulado.
+        :param cache_granularity: O prefixo em cache é arredondado para baixo em múltiplos deste valor,
+                                  como no cache automático da OpenAI.
+        """
+        self.answer = answer
+        self.chunk_size = chunk_size
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.failures = list(failures or [])
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_granularity = cache_granularity
+        self.requests = []
+        self.cached_contents = {}
+        self._prompts = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.url}/v1/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def next_failure(self):
+        with self._lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def record(self, path, body):
+        with self._lock:
+            self.requests.append({"path": path, "body": body})
+
+    def usage(self, body):
+        """
+        Contagem de tokens simulada a partir do tamanho do payload (≈4 bytes por token).
+        """
+        prompt_tokens = max(1, len(json.dumps(body)) // 4)
+        completion_tokens = max(1, len(self.answer) // 4)
+        return prompt_tokens, completion_tokens
+
+    @staticmethod
+    def serialized_prompt(body):
+        """
+        Prompt de uma requisição serializado na ordem em que o provedor o recebe (instruções e mensagens).
+        """
+        if "messages" in body:
+            return json.dumps(body["messages"], ensure_ascii=False)
+        return json.dumps([body.get("systemInstruction"), body.get("contents")], ensure_ascii=False)
+
+    @staticmethod
+    def request_prefix(body):
+        """
+        Primeira parte do prompt (mensagem inicial, instrução de sistema ou conteúdo em cache).
+        """
+        if "messages" in body:
+            first = body["messages"][0] if body["messages"] else None
+        else:
+            first = body.get("cachedContent") or body.get("systemInstruction") or (body.get("contents") or [None])[0]
+        return json.dumps(first, ensure_ascii=False, sort_keys=True)
+
+    def cached_tokens(self, body):
+        """
+        Simula o cache automático de prompt: tokens do maior prefixo comum com uma requisição anterior,
+        em múltiplos de cache_granularity e a partir de cache_min_tokens.
+        """
+        prompt = self.serialized_prompt(body)
+        with self._lock:
+            common = max((len(os.path.commonprefix([prompt, previous])) for previous in self._prompts), default=0)
+            self._prompts.append(prompt)
+        tokens = common // 4 // self.cache_granularity * self.cache_granularity
+        return tokens if tokens >= self.cache_min_tokens else 0
+
+    def prefix_report(self):
+        """
+        Resumo da estabilidade do prefixo nas requisições de geração recebidas: número de requisições,
+        de prefixos distintos, contagem por prefixo (hash) e se todas começaram pelo mesmo prefixo.
+        """
+        with self._lock:
+            bodies = [request["body"] for request in self.requests
+                      if ":generateContent" in request["path"] or ":streamGenerateContent" in request["path"]
+                      or request["path"].rstrip("/").endswith("chat/completions")]
+        counts = {}
+        for body in bodies:
+            digest = hashlib.sha256(self.request_prefix(body).encode("utf-8")).hexdigest()[:12]
+            counts[digest] = counts.get(digest, 0) + 1
+        return {
+            "requests": len(bodies),
+            "distinct_prefixes": len(counts),
+            "prefixes": counts,
+            "stable": len(counts) == 1
+        }
+
+    def create_cached_content(self, body):
+        """
+        Imita POST /cachedContents do Gemini (cache explícito de contexto).
+        """
+        with self._lock:
+            name = f"cachedContents/fake-{len(self.cached_contents)}"
+            tokens = max(1, len(json.dumps([body.get("systemInstruction"), body.get("contents")])) // 4)
+            self.cached_contents[name] = tokens
+        return dict(body, name=name, usageMetadata={"totalTokenCount": tokens},
+                    expireTime="2099-01-01T00:00:00Z", createTime="2000-01-01T00:00:00Z",
+                    updateTime="2000-01-01T00:00:00Z")
+
+    def openai_response(self, body):
+        prompt_tokens, completion_tokens = self.usage(body)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": min(prompt_tokens, self.cached_tokens(body))}
+            }
+        }
+
+    def gemini_response(self, body):
+        prompt_tokens, completion_tokens = self.usage(body)
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": completion_tokens,
+            "totalTokenCount": prompt_tokens + completion_tokens
+        }
+        cached = self.cached_contents.get(body.get("cachedContent"))
+        if cached:
+            usage["promptTokenCount"] += cached
+            usage["totalTokenCount"] += cached
+            usage["cachedContentTokenCount"] = cached
+        return {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": self.answer}]},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": usage
+        }
+
+    def answer_chunks(self):
+        return [self.answer[i:i + self.chunk_size] for i in range(0, len(self.answer), self.chunk_size)]
+
+    def openai_stream_events(self, body):
+        """
+        Eventos SSE de /chat/completions com stream=True: um delta por pedaço da resposta e,
+        se stream_options.include_usage, um último evento só com o uso de tokens.
+        """
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", "fake")}
+        events = []
+        for i, text in enumerate(self.answer_chunks()):
+            delta = {"role": "assistant", "content": text} if i == 0 else {"content": text}
+            events.append(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        events.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = self.openai_response(body)["usage"]
+            events.append(dict(base, choices=[], usage=usage))
+        return events + ["[DONE]"]
+
+    def gemini_stream_events(self, body):
+        """
+        Eventos de :streamGenerateContent (SSE com alt=sse, ou um array JSON enviado aos poucos, como no
+        transporte REST do google-generativeai); o uso de tokens vem no último evento.
+        """
+        chunks = self.answer_chunks()
+        usage = self.gemini_response(body)["usageMetadata"]
+        events = []
+        for i, text in enumerate(chunks):
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+            if i == len(chunks) - 1:
+                event["candidates"][0]["finishReason"] = "STOP"
+                event["usageMetadata"] = usage
+            events.append(event)
+        return events
+
+    def handle_post(self, path, body):
+        """
+        Retorna (status, headers, payload) para uma requisição POST.
+        Nas respostas em streaming, payload é a lista de eventos SSE.
+        """
+        self.record(path, body)
+        failure = self.next_failure()
+        if failure is not None:
+            status, headers = failure
+            return status, headers, {"error": {"code": status, "message": "Erro simulado"}}
+        if path.rstrip("/").endswith("chat/completions"):
+            if body.get("stream"):
+                return 200, {}, self.openai_stream_events(body)
+            return 200, {}, self.openai_response(body)
+        if ":streamGenerateContent" in path:
+            return 200, {}, self.gemini_stream_events(body)
+        if ":generateContent" in path:
+            return 200, {}, self.gemini_response(body)
+        if path.split("?")[0].rstrip("/").endswith("cachedContents"):
+            return 200, {}, self.create_cached_content(body)
+        return 404, {}, {"error": {"code": 404, "message": f"Rota desconhecida: {path}"}}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw or b"{}")
+                except json.JSONDecodeError:
+                    body = {"raw": raw.decode("utf-8", "replace")}
+                status, headers, payload = server.handle_post(self.path, body)
+                if isinstance(payload, list) and ":streamGenerateContent" in self.path and "alt=sse" not in self.path:
+                    self.send_json_array(status, headers, payload)
+                elif isinstance(payload, list):
+                    self.send_events(status, headers, payload)
+                else:
+                    self.send_json(status, headers, payload)
+
+            def send_events(self, status, headers, events):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.close_connection = True
+                time.sleep(server.first_token_delay)
+                for i, event in enumerate(events):
+                    if i:
+                        time.sleep(server.chunk_delay)
+                    data = event if isinstance(event, str) else json.dumps(event, ensure_ascii=False)
+                    self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+            def send_json_array(self, status, headers, events):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.close_connection = True
+                time.sleep(server.first_token_delay)
+                for i, event in enumerate(events):
+                    if i:
+                        time.sleep(server.chunk_delay)
+                    prefix = "[" if i == 0 else ",\r\n"
+                    self.wfile.write((prefix + json.dumps(event, ensure_ascii=False)).encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"]")
+
+            def send_json(self, status, headers, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
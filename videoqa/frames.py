@@ -1,25 +1,314 @@
+import os
 import cv2
 import base64
 import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .framestore import FrameStore, video_fingerprint
+from .tokens import image_token_estimates, resized_dimensions
+from .tracing import current_span, traced
 
-def extract_base64_frames(video_path, frame_interval=None, cache_json_path=None):
+SEEK_MODES = ("grab", "seek", "read")
+
+INTERPOLATIONS = {
+    "area": cv2.INTER_AREA,
+    "linear": cv2.INTER_LINEAR,
+    "cubic": cv2.INTER_CUBIC,
+    "lanczos": cv2.INTER_LANCZOS4,
+    "nearest": cv2.INTER_NEAREST
+}
+
+
+def compute_sample_indices(fps, total_frames, frame_interval=None, every_seconds=None,
+                           timestamps=None, max_frames=None):
     """
-    Abre o vídeo (video_path), extrai frames (a cada frame_interval) e converte-os para base64.
-    Caso 'cache_json_path' seja fornecido e o arquivo exista, carrega os frames e metadados dali.
-    
+    Calcula os índices dos frames que devem ser amostrados.
+
+    A prioridade é: timestamps > every_seconds > frame_interval (default = 1 frame por segundo).
+    Se max_frames for informado e houver mais índices, escolhe max_frames índices igualmente espaçados.
+
+    :param fps: Frames por segundo do vídeo.
+    :param total_frames: Número total de frames do vídeo.
+    :param frame_interval: Intervalo em frames.
+    :param every_seconds: Intervalo em segundos.
+    :param timestamps: Lista de instantes (em segundos) a amostrar.
+    :param max_frames: Número máximo de frames retornados.
+    :return: (indices, frame_interval)
+    """
+    fps = fps or 1
+    if frame_interval is None:
+        frame_interval = int(fps) if fps else 1
+
+    if timestamps is not None:
+        indices = sorted({int(round(t * fps)) for t in timestamps if t >= 0})
+        indices = [i for i in indices if i < total_frames]
+    else:
+        if every_seconds is not None:
+            frame_interval = max(1, int(round(every_seconds * fps)))
+        indices = list(range(0, total_frames, frame_interval))
+
+    if max_frames is not None and len(indices) > max_frames:
+        step = len(indices) / max_frames
+        indices = [indices[int(i * step)] for i in range(max_frames)]
+
+    return indices, frame_interval
+
+
+def encoder_settings(max_side=None, interpolation="area", jpeg_quality=None, grayscale=False):
+    """
+    Configurações de pré-processamento e codificação dos frames (também usadas para validar o cache).
+
+    :param max_side: Tamanho máximo do maior lado, em pixels (None = resolução original).
+    :param interpolation: Interpolação do redimensionamento (ver INTERPOLATIONS).
+    :param jpeg_quality: Qualidade JPEG de 0 a 100 (None = padrão do OpenCV, 95).
+    :param grayscale: Se True, converte os frames para tons de cinza.
+    """
+    if interpolation not in INTERPOLATIONS:
+        raise ValueError(f"interpolation deve ser um de {tuple(INTERPOLATIONS)}")
+    return {
+        "format": "jpg",
+        "max_side": max_side,
+        "interpolation": interpolation,
+        "jpeg_quality": jpeg_quality,
+        "grayscale": grayscale
+    }
+
+
+def prepare_frame(frame, encoding=None):
+    """
+    Aplica o redimensionamento e a conversão para tons de cinza definidos em encoding.
+    """
+    if not encoding:
+        return frame
+    if encoding.get("max_side"):
+        height, width = frame.shape[:2]
+        new_width, new_height = resized_dimensions(width, height, encoding["max_side"])
+        if (new_width, new_height) != (width, height):
+            frame = cv2.resize(
+                frame, (new_width, new_height),
+                interpolation=INTERPOLATIONS[encoding.get("interpolation", "area")]
+            )
+    if encoding.get("grayscale"):
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return frame
+
+
+def encode_jpeg(frame, encoding=None):
+    """
+    Codifica um frame (array BGR) em JPEG e retorna os bytes, ou None se falhar.
+    :param encoding: Configurações de encoder_settings (redimensionamento, qualidade, tons de cinza).
+    """
+    frame = prepare_frame(frame, encoding)
+    params = []
+    if encoding and encoding.get("jpeg_quality") is not None:
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(encoding["jpeg_quality"])]
+    success_encode, buffer = cv2.imencode(".jpg", frame, params)
+    if not success_encode:
+        return None
+    return buffer.tobytes()
+
+
+def encode_frame(frame, encoding=None):
+    """
+    Codifica um frame (array BGR) em JPEG e retorna a string base64, ou None se falhar.
+    """
+    jpeg_bytes = encode_jpeg(frame, encoding)
+    if jpeg_bytes is None:
+        return None
+    return base64.b64encode(jpeg_bytes).decode("utf-8")
+
+
+def payload_stats(frame_sizes, width, height, encoding=None):
+    """
+    Resume o tamanho do payload dos frames codificados: bytes por frame (JPEG e base64),
+    dimensões após o redimensionamento e tokens estimados por imagem para cada provider.
+    """
+    max_side = encoding.get("max_side") if encoding else None
+    encoded_width, encoded_height = resized_dimensions(width, height, max_side)
+    n_frames = len(frame_sizes)
+    total_bytes = sum(frame_sizes)
+    mean_bytes = total_bytes / n_frames if n_frames else 0
+    return {
+        "encoded_width": encoded_width,
+        "encoded_height": encoded_height,
+        "total_bytes": total_bytes,
+        "bytes_per_frame": mean_bytes,
+        "base64_bytes_per_frame": 4 * math.ceil(mean_bytes / 3),
+        "image_tokens_per_frame": image_token_estimates(encoded_width, encoded_height)
+    }
+
+
+def _read_frames(cap, indices):
+    """
+    Loop original: decodifica e converte todos os frames, mantendo apenas os amostrados.
+    """
+    targets = set(indices)
+    last = indices[-1] if indices else -1
+    frame_count = 0
+    while frame_count <= last:
+        success, frame = cap.read()
+        if not success:
+            break
+        if frame_count in targets:
+            yield frame_count, frame
+        frame_count += 1
+
+
+def _grab_frames(cap, indices, start=0):
+    """
+    Avança com grab() e só chama retrieve() (conversão de cor e cópia) nos frames amostrados.
+    Retorna exatamente os mesmos frames do loop com cap.read().
+    :param start: Índice do frame em que a captura está posicionada.
+    """
+    targets = set(indices)
+    last = indices[-1] if indices else -1
+    frame_count = start
+    while frame_count <= last:
+        if not cap.grab():
+            break
+        if frame_count in targets:
+            success, frame = cap.retrieve()
+            if success:
+                yield frame_count, frame
+        frame_count += 1
+
+
+def _seek_frames(cap, indices):
+    """
+    Posiciona o vídeo diretamente em cada frame amostrado (CAP_PROP_POS_FRAMES).
+    Vantajoso quando os frames amostrados estão muito espaçados.
+    """
+    for index in indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        success, frame = cap.read()
+        if not success:
+            break
+        yield index, frame
+
+
+def _keyframe_frames(video_path, indices, fps):
+    """
+    Para cada frame amostrado, retorna o keyframe mais próximo anterior a ele (usando PyAV),
+    evitando decodificar os frames intermediários do GOP.
+    """
+    try:
+        import av
+    except ImportError:
+        raise ImportError("nearest_keyframe=True requer o PyAV: instale com `pip install av`.") from None
+
+    seen = set()
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        time_base = stream.time_base
+        for index in indices:
+            pts = int(index / fps / time_base)
+            container.seek(pts, stream=stream, backward=True, any_frame=False)
+            for av_frame in container.decode(stream):
+                frame_index = int(round(av_frame.time * fps)) if av_frame.time is not None else index
+                if frame_index not in seen:
+                    seen.add(frame_index)
+                    yield frame_index, av_frame.to_ndarray(format="bgr24")
+                break
+
+
+def _extract_chunk(video_path, indices, encoding=None):
+    """
+    Extrai e codifica um trecho contíguo de frames amostrados em um processo separado.
+    Cada processo abre sua própria captura e posiciona-se no primeiro índice do trecho.
+    Retorna lista de (frame_index, jpeg_bytes).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Não foi possível abrir o vídeo: {video_path}")
+    try:
+        start = indices[0]
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        results = []
+        for frame_index, frame in _grab_frames(cap, indices, start=start):
+            jpeg_bytes = encode_jpeg(frame, encoding)
+            if jpeg_bytes is not None:
+                results.append((frame_index, jpeg_bytes))
+        return results
+    finally:
+        cap.release()
+
+
+def split_indices(indices, n_chunks):
+    """
+    Divide a lista de índices em até n_chunks trechos contíguos (intervalos de tempo) de tamanho similar.
+    """
+    n_chunks = max(1, min(n_chunks, len(indices)))
+    size, remainder = divmod(len(indices), n_chunks)
+    chunks = []
+    start = 0
+    for i in range(n_chunks):
+        end = start + size + (1 if i < remainder else 0)
+        chunks.append(indices[start:end])
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+
+def extract_frames_parallel(video_path, indices, workers=None, chunks_per_worker=1, encoding=None):
+    """
+    Extrai e codifica os frames amostrados dividindo o vídeo em intervalos de tempo,
+    processados em paralelo por um pool de processos. Os resultados são unidos em ordem.
+
     :param video_path: Caminho do arquivo de vídeo.
-    :param frame_interval: Intervalo de frames (se None, default = 1 frame por segundo).
-    :param cache_json_path: Caminho para arquivo JSON de cache. Se existir, carregamos direto.
-    :return: (base64_frames, metadata)
+    :param indices: Lista ordenada de índices de frames a extrair.
+    :param workers: Número de processos (None = número de CPUs).
+    :param chunks_per_worker: Número de trechos por processo (mais trechos equilibram melhor a carga).
+    :param encoding: Configurações de encoder_settings.
+    :return: Lista de (frame_index, jpeg_bytes) ordenada por frame_index.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = split_indices(indices, workers * chunks_per_worker)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_result in executor.map(
+            _extract_chunk, [video_path] * len(chunks), chunks, [encoding] * len(chunks)
+        ):
+            results.extend(chunk_result)
+    return results
+
+
+def iter_sampled_frames(video_path, indices, fps=None, seek_mode="grab", nearest_keyframe=False):
+    """
+    Gera (frame_index, frame) apenas para os índices amostrados.
+
+    :param video_path: Caminho do arquivo de vídeo.
+    :param indices: Lista ordenada de índices de frames a decodificar.
+    :param fps: FPS do vídeo (necessário para nearest_keyframe).
+    :param seek_mode: 'grab' (grab/retrieve), 'seek' (posicionamento direto) ou 'read' (loop original).
+    :param nearest_keyframe: Se True, usa o keyframe mais próximo de cada índice (requer PyAV).
+    """
+    if nearest_keyframe:
+        yield from _keyframe_frames(video_path, indices, fps)
+        return
+
+    if seek_mode not in SEEK_MODES:
+        raise ValueError(f"seek_mode deve ser um de {SEEK_MODES}")
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Não foi possível abrir o vídeo: {video_path}")
+    try:
+        if seek_mode == "grab":
+            yield from _grab_frames(cap, indices)
+        elif seek_mode == "seek":
+            yield from _seek_frames(cap, indices)
+        else:
+            yield from _read_frames(cap, indices)
+    finally:
+        cap.release()
+
+
+def read_video_metadata(video_path):
+    """
+    Lê fps, número de frames e dimensões do vídeo.
     """
-    # Se especificaram um cache e ele já existe, apenas carrega o conteúdo
-    if cache_json_path and os.path.exists(cache_json_path):
-        print(f"Arquivo de cache '{cache_json_path}' encontrado. Carregando frames do cache...")
-        with open(cache_json_path, 'r') as f:
-            data = json.load(f)
-        return data["base64_frames"], data["metadata"]
-    
-    # Caso não exista cache ou não tenha sido especificado, faz a extração
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError(f"Não foi possível abrir o vídeo: {video_path}")
@@ -28,36 +317,154 @@ def extract_base64_frames(video_path, frame_interval=None, cache_json_path=None)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
 
-    # Por padrão, se frame_interval não for informado, usar 1 frame por segundo
-    if frame_interval is None:
-        frame_interval = int(fps) if fps else 1
+    return {
+        "fps": fps,
+        "total_frames": total_frames,
+        "width": width,
+        "height": height
+    }
 
-    base64_frames = []
-    frame_count = 0
 
+def iter_encoded_frames(video_path, indices, fps=None, seek_mode="grab", nearest_keyframe=False, workers=None,
+                        encoding=None):
+    """
+    Gera (frame_index, jpeg_bytes) para os índices amostrados, de forma serial ou,
+    se workers > 1, com extração paralela por intervalos de tempo.
+    """
+    if workers is not None and workers > 1 and not nearest_keyframe:
+        yield from extract_frames_parallel(video_path, indices, workers=workers, encoding=encoding)
+        return
+
+    # Tempos de decodificação e codificação acumulados no span ativo (ex.: extract_frames)
+    current = current_span()
+    frames = iter_sampled_frames(
+        video_path, indices, fps=fps, seek_mode=seek_mode, nearest_keyframe=nearest_keyframe
+    )
     while True:
-        success, frame = cap.read()
-        if not success:
+        decode_start = time.perf_counter()
+        try:
+            frame_index, frame = next(frames)
+        except StopIteration:
             break
-        if frame_count % frame_interval == 0:
-            success_encode, buffer = cv2.imencode(".jpg", frame)
-            if success_encode:
-                frame_b64 = base64.b64encode(buffer).decode("utf-8")
-                base64_frames.append(frame_b64)
-        frame_count += 1
-    
-    cap.release()
+        encode_start = time.perf_counter()
+        jpeg_bytes = encode_jpeg(frame, encoding)
+        current.add(decode_time=encode_start - decode_start, encode_time=time.perf_counter() - encode_start)
+        if jpeg_bytes is not None:
+            yield frame_index, jpeg_bytes
 
-    metadata = {
-        "fps": fps,
-        "total_frames": total_frames,
-        "width": width,
-        "height": height,
-        "frame_interval": frame_interval
+
+@traced("extract_frames")
+def extract_base64_frames(video_path, frame_interval=None, cache_json_path=None, every_seconds=None,
+                          timestamps=None, max_frames=None, seek_mode="grab", nearest_keyframe=False,
+                          workers=None, cache_path=None, max_side=None, interpolation="area",
+                          jpeg_quality=None, grayscale=False, selector=None):
+    """
+    Abre o vídeo (video_path), extrai frames (a cada frame_interval) e converte-os para base64.
+    Caso 'cache_json_path' seja fornecido e o arquivo exista, carrega os frames e metadados dali.
+    Apenas os frames amostrados são decodificados (ver seek_mode).
+
+    :param video_path: Caminho do arquivo de vídeo.
+    :param frame_interval: Intervalo de frames (se None, default = 1 frame por segundo).
+    :param cache_json_path: Caminho para arquivo JSON de cache (formato antigo). Se existir, carregamos direto.
+    :param every_seconds: Intervalo de amostragem em segundos (substitui frame_interval).
+    :param timestamps: Lista de instantes (em segundos) a amostrar (substitui os intervalos).
+    :param max_frames: Número máximo de frames, igualmente espaçados.
+    :param seek_mode: 'grab' (default), 'seek' ou 'read' (loop original, decodifica todos os frames).
+    :param nearest_keyframe: Se True, usa o keyframe mais próximo de cada instante (requer PyAV).
+    :param workers: Se > 1, divide o vídeo em intervalos de tempo extraídos em paralelo por esse número de processos.
+    :param cache_path: Caminho base de um cache binário (FrameStore). Os JPEGs são lidos sob demanda via mmap
+                       e convertidos para base64 apenas quando acessados. O cache só é reutilizado se o vídeo
+                       e as configurações de amostragem e codificação forem os mesmos.
+    :param max_side: Redimensiona os frames para que o maior lado tenha no máximo max_side pixels.
+    :param interpolation: Interpolação do redimensionamento ('area', 'linear', 'cubic', 'lanczos', 'nearest').
+    :param jpeg_quality: Qualidade JPEG de 0 a 100 (None = padrão do OpenCV).
+    :param grayscale: Se True, codifica os frames em tons de cinza.
+    :param selector: FrameSelector opcional para descartar quase-duplicatas e manter mudanças de cena.
+                     Os frames mantidos preservam o índice original em metadata["frame_indices"].
+    :return: (base64_frames, metadata). metadata["payload"] traz bytes por frame e tokens estimados por imagem.
+    """
+    # Se especificaram um cache e ele já existe, apenas carrega o conteúdo
+    if cache_json_path and os.path.exists(cache_json_path):
+        print(f"Arquivo de cache '{cache_json_path}' encontrado. Carregando frames do cache...")
+        with open(cache_json_path, 'r') as f:
+            data = json.load(f)
+        return data["base64_frames"], data["metadata"]
+
+    sampling = {
+        "frame_interval": frame_interval,
+        "every_seconds": every_seconds,
+        "timestamps": timestamps,
+        "max_frames": max_frames,
+        "seek_mode": seek_mode,
+        "nearest_keyframe": nearest_keyframe
     }
+    encoding = encoder_settings(max_side, interpolation, jpeg_quality, grayscale)
+    if cache_path:
+        fingerprint = {
+            "video": video_fingerprint(video_path),
+            "sampling": sampling,
+            "encoder": encoding,
+            "selector": selector.settings() if selector else None
+        }
+        store = FrameStore.open(cache_path, fingerprint=fingerprint)
+        if store is not None:
+            print(f"Cache de frames '{cache_path}' encontrado. Carregando frames sob demanda...")
+            store.metadata["payload"] = payload_stats(
+                store.lengths, store.metadata["width"], store.metadata["height"], encoding
+            )
+            current_span().set(cached=True, frames=len(store), bytes=sum(store.lengths))
+            return store.base64_frames(), store.metadata
+
+    # Caso não exista cache ou não tenha sido especificado, faz a extração
+    metadata = read_video_metadata(video_path)
+    indices, frame_interval = compute_sample_indices(
+        metadata["fps"], metadata["total_frames"], frame_interval=frame_interval,
+        every_seconds=every_seconds, timestamps=timestamps, max_frames=max_frames
+    )
+    metadata["frame_interval"] = frame_interval
+
+    encoded_frames = iter_encoded_frames(
+        video_path, indices, fps=metadata["fps"], seek_mode=seek_mode,
+        nearest_keyframe=nearest_keyframe, workers=workers, encoding=encoding
+    )
+
+    if selector is not None:
+        sampled_frames = list(encoded_frames)
+        encoded_frames = selector.select(sampled_frames)
+        metadata["selection"] = dict(
+            selector.settings(), sampled_frames=len(sampled_frames), kept_frames=len(encoded_frames)
+        )
+        print(f"Seleção de frames: {len(encoded_frames)} de {len(sampled_frames)} frames mantidos.")
+
+    # Com cache binário, os JPEGs vão direto para o disco, sem ficar em memória
+    if cache_path:
+        store = FrameStore.write(cache_path, encoded_frames, metadata, fingerprint)
+        store.metadata["payload"] = payload_stats(
+            store.lengths, metadata["width"], metadata["height"], encoding
+        )
+        print(f"{len(store)} frames extraídos (a cada {frame_interval} frames).")
+        print(f"Frames e metadados salvos no cache '{cache_path}'.")
+        current_span().set(cached=False, frames=len(store), bytes=sum(store.lengths))
+        return store.base64_frames(), store.metadata
+
+    base64_frames = []
+    frame_indices = []
+    frame_sizes = []
+    current = current_span()
+    for frame_index, jpeg_bytes in encoded_frames:
+        base64_start = time.perf_counter()
+        base64_frames.append(base64.b64encode(jpeg_bytes).decode("utf-8"))
+        current.add(base64_time=time.perf_counter() - base64_start)
+        frame_indices.append(frame_index)
+        frame_sizes.append(len(jpeg_bytes))
+
+    metadata["frame_indices"] = frame_indices
+    metadata["payload"] = payload_stats(frame_sizes, metadata["width"], metadata["height"], encoding)
 
     print(f"{len(base64_frames)} frames extraídos (a cada {frame_interval} frames).")
+    current.set(cached=False, frames=len(base64_frames), bytes=sum(frame_sizes))
 
     # Se um caminho de cache foi informado, salva nele
     if cache_json_path:
@@ -67,3 +474,37 @@ def extract_base64_frames(video_path, frame_interval=None, cache_json_path=None)
         print(f"Frames e metadados salvos no cache '{cache_json_path}'.")
 
     return base64_frames, metadata
+
+
+def stream_base64_frames(video_path, frame_interval=None, every_seconds=None, timestamps=None, max_frames=None,
+                         seek_mode="grab", max_seconds=None, max_side=None, interpolation="area",
+                         jpeg_quality=None, grayscale=False):
+    """
+    Versão em streaming de extract_base64_frames: os frames são decodificados e codificados
+    apenas quando consumidos, permitindo enviar batches à LLM enquanto os próximos são extraídos.
+    Se o consumidor parar de iterar, nenhum frame posterior é decodificado.
+
+    :param max_seconds: Não amostra frames após esse instante do vídeo (em segundos).
+    :return: (gerador de frames base64, metadata). metadata["frame_indices"] é preenchido
+             à medida que os frames são gerados.
+    """
+    metadata = read_video_metadata(video_path)
+    indices, frame_interval = compute_sample_indices(
+        metadata["fps"], metadata["total_frames"], frame_interval=frame_interval,
+        every_seconds=every_seconds, timestamps=timestamps, max_frames=max_frames
+    )
+    if max_seconds is not None:
+        stop_frame = max_seconds * (metadata["fps"] or 1)
+        indices = [index for index in indices if index < stop_frame]
+    metadata["frame_interval"] = frame_interval
+    metadata["frame_indices"] = []
+    encoding = encoder_settings(max_side, interpolation, jpeg_quality, grayscale)
+
+    def generator():
+        for frame_index, jpeg_bytes in iter_encoded_frames(
+            video_path, indices, fps=metadata["fps"], seek_mode=seek_mode, encoding=encoding
+        ):
+            metadata["frame_indices"].append(frame_index)
+            yield base64.b64encode(jpeg_bytes).decode("utf-8")
+
+    return generator(), metadata
@@ -0,0 +1,194 @@
+import os
+import json
+import mmap
+import base64
+import hashlib
+
+STORE_VERSION = 1
+
+
+def video_fingerprint(video_path, sample_bytes=1 << 20):
+    """
+    Identifica o vídeo de origem sem ler o arquivo inteiro:
+    tamanho, data de modificação e hash do início e do fim do arquivo.
+    """
+    stat = os.stat(video_path)
+    digest = hashlib.sha1()
+    with open(video_path, "rb") as f:
+        digest.update(f.read(sample_bytes))
+        if stat.st_size > sample_bytes:
+            f.seek(max(stat.st_size - sample_bytes, sample_bytes))
+            digest.update(f.read(sample_bytes))
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": digest.hexdigest()
+    }
+
+
+class FrameStore:
+    def __init__(self, path):
+        """
+        Cache binário de frames: um arquivo com os JPEGs concatenados (<path>.bin),
+        aberto com mmap, e um índice (<path>.idx.json) com offsets, tamanhos, índices
+        originais dos frames, metadados e a assinatura (vídeo, amostragem e codificação).
+
+        Use FrameStore.open para ler um cache existente e FrameStore.write para criá-lo.
+
+        :param path: Caminho base do cache (sem extensão).
+        """
+        self.path = path
+        with open(self.index_path(path), "r") as f:
+            index = json.load(f)
+        self.metadata = index["metadata"]
+        self.fingerprint = index["fingerprint"]
+        self.frame_indices = index["frame_indices"]
+        self.offsets = index["offsets"]
+        self.lengths = index["lengths"]
+
+        self._file = open(self.blob_path(path), "rb")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mmap = b""
+
+    @staticmethod
+    def blob_path(path):
+        return f"{path}.bin"
+
+    @staticmethod
+    def index_path(path):
+        return f"{path}.idx.json"
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(cls.index_path(path)) and os.path.exists(cls.blob_path(path))
+
+    @classmethod
+    def open(cls, path, fingerprint=None):
+        """
+        Abre o cache. Se fingerprint for informado e não coincidir com o do cache
+        (vídeo, amostragem ou codificação diferentes), retorna None.
+        """
+        if not cls.exists(path):
+            return None
+        store = cls(path)
+        if fingerprint is not None and not store.matches(fingerprint):
+            store.close()
+            return None
+        return store
+
+    @classmethod
+    def write(cls, path, frames, metadata, fingerprint):
+        """
+        Grava os frames no cache à medida que são produzidos, sem mantê-los em memória.
+
+        :param frames: Iterável de (frame_index, jpeg_bytes).
+        :param metadata: Metadados do vídeo/amostragem.
+        :param fingerprint: Assinatura usada para validar o cache (ver matches).
+        :return: FrameStore aberto para leitura.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        frame_indices, offsets, lengths = [], [], []
+        offset = 0
+        tmp_blob = cls.blob_path(path) + ".tmp"
+        with open(tmp_blob, "wb") as f:
+            for frame_index, jpeg_bytes in frames:
+                f.write(jpeg_bytes)
+                frame_indices.append(frame_index)
+                offsets.append(offset)
+                lengths.append(len(jpeg_bytes))
+                offset += len(jpeg_bytes)
+
+        metadata = dict(metadata, frame_indices=frame_indices)
+        index = {
+            "version": STORE_VERSION,
+            "metadata": metadata,
+            "fingerprint": fingerprint,
+            "frame_indices": frame_indices,
+            "offsets": offsets,
+            "lengths": lengths
+        }
+        tmp_index = cls.index_path(path) + ".tmp"
+        with open(tmp_index, "w") as f:
+            json.dump(index, f)
+
+        # Substitui atomicamente para nunca deixar um cache pela metade
+        os.replace(tmp_blob, cls.blob_path(path))
+        os.replace(tmp_index, cls.index_path(path))
+        return cls(path)
+
+    def matches(self, fingerprint):
+        """
+        Verifica se o cache corresponde ao vídeo de origem e às configurações de amostragem e codificação.
+        """
+        return json.loads(json.dumps(fingerprint)) == self.fingerprint
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_jpeg(self, position):
+        """
+        Retorna os bytes JPEG do frame na posição informada (lidos sob demanda do mmap).
+        """
+        offset = self.offsets[position]
+        return self._mmap[offset : offset + self.lengths[position]]
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.get_jpeg(i) for i in range(*position.indices(len(self)))]
+        return self.get_jpeg(position)
+
+    def positions_in_range(self, start_frame, end_frame):
+        """
+        Retorna as posições dos frames cujo índice original está em [start_frame, end_frame).
+        """
+        return [
+            position for position, frame_index in enumerate(self.frame_indices)
+            if start_frame <= frame_index < end_frame
+        ]
+
+    def frames_in_range(self, start_frame, end_frame):
+        """
+        Retorna lista de (frame_index, jpeg_bytes) com índice original em [start_frame, end_frame).
+        """
+        return [
+            (self.frame_indices[position], self.get_jpeg(position))
+            for position in self.positions_in_range(start_frame, end_frame)
+        ]
+
+    def base64_frames(self):
+        """
+        Retorna uma sequência que converte cada frame para base64 apenas quando acessado.
+        """
+        return LazyBase64Frames(self)
+
+
+class LazyBase64Frames:
+    def __init__(self, store):
+        """
+        Sequência de frames em base64 apoiada em um FrameStore.
+        Suporta len(), índices e fatias (como a lista de base64 retornada por extract_base64_frames),
+        mas só converte para base64 os frames efetivamente acessados (ao montar o prompt).
+        """
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        return base64.b64encode(self.store.get_jpeg(position)).decode("utf-8")
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
@@ -0,0 +1,235 @@
+import os
+import pickle
+from bisect import bisect_left
+from collections import Counter
+from .cnae import cnae_digits, load_cnae_entries, tokenize
+
+# Número de dígitos de cada nível do CNAE
+LEVEL_DIGITS = {"divisao": 2, "grupo": 3, "classe": 5, "subclasse": 7}
+
+# Versão do formato do arquivo de cache (mudar ao alterar a estrutura salva)
+CACHE_VERSION = 2
+
+_LOADED = {}
+
+
+def format_cnae(digits):
+    """
+    Formata os dígitos de um código CNAE no padrão das respostas:
+    "47" (divisão), "47.1" (grupo), "47.11-3" (classe), "47.11-3-01" (subclasse).
+    """
+    if len(digits) == 2:
+        return digits
+    if len(digits) == 3:
+        return f"{digits[:2]}.{digits[2]}"
+    if len(digits) == 5:
+        return f"{digits[:2]}.{digits[2:4]}-{digits[4]}"
+    return f"{digits[:2]}.{digits[2:4]}-{digits[4]}-{digits[5:7]}"
+
+
+def _source_signature(paths):
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+class CNAEHierarchy:
+    def __init__(self, nodes):
+        """
+        Árvore CNAE compacta em memória: um dicionário de nós indexado pelos dígitos do código
+        ("47", "471", "47113", "4711301"), com busca O(1), consultas por prefixo
+        e reparo de códigos inválidos.
+
+        :param nodes: Dict dígitos -> (descrição, dígitos do nó pai). Divisões e grupos só têm
+                      descrição se CNAE_estrutura.csv estiver disponível; senão ficam com "".
+        """
+        self.nodes = nodes
+        self.subclasses = sorted(digits for digits in nodes if len(digits) == 7)
+
+    @classmethod
+    def from_csv(cls, classes_csv="CNAE.csv", subclasses_csv="CNAE_v2.csv", structure_csv="CNAE_estrutura.csv"):
+        nodes = {}
+        for entry in load_cnae_entries(classes_csv, subclasses_csv, structure_csv):
+            digits = cnae_digits(entry["subclasse"])
+            nodes.setdefault(digits[:2], (entry["divisao_descricao"], None))
+            nodes.setdefault(digits[:3], (entry["grupo_descricao"], digits[:2]))
+            nodes.setdefault(digits[:5], (entry["classe_descricao"], digits[:3]))
+            nodes[digits] = (entry["subclasse_descricao"], digits[:5])
+        return cls(nodes)
+
+    @classmethod
+    def load(cls, classes_csv="CNAE.csv", subclasses_csv="CNAE_v2.csv", cache_path="./cache/cnae_hierarchy.pkl",
+             structure_csv="CNAE_estrutura.csv"):
+        """
+        Carrega a árvore uma única vez por processo. Usa o cache binário (pickle) se ele tiver sido
+        gerado a partir das mesmas tabelas (caminho, tamanho e data de modificação); senão reconstrói
+        a partir dos CSVs e regrava o cache.
+        """
+        sources = [classes_csv, subclasses_csv]
+        if structure_csv and os.path.exists(structure_csv):
+            sources.append(structure_csv)
+        signature = _source_signature(sources)
+        key = (cache_path, tuple(signature))
+        if key in _LOADED:
+            return _LOADED[key]
+
+        hierarchy = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    cached = pickle.load(f)
+                if cached.get("version") == CACHE_VERSION and cached.get("signature") == signature:
+                    hierarchy = cls(cached["nodes"])
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+                hierarchy = None
+
+        if hierarchy is None:
+            hierarchy = cls.from_csv(classes_csv, subclasses_csv, structure_csv)
+            if cache_path:
+                directory = os.path.dirname(cache_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump({"version": CACHE_VERSION, "signature": signature, "nodes": hierarchy.nodes},
+                                f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+
+        _LOADED[key] = hierarchy
+        return hierarchy
+
+    def __contains__(self, code):
+        return cnae_digits(code) in self.nodes
+
+    def lookup(self, code):
+        """
+        Busca O(1) de um código em qualquer formatação. Retorna dict com codigo, nivel e descricao, ou None.
+        """
+        digits = cnae_digits(code)
+        node = self.nodes.get(digits)
+        if node is None:
+            return None
+        level = next(name for name, n_digits in LEVEL_DIGITS.items() if n_digits == len(digits))
+        return {"codigo": format_cnae(digits), "digitos": digits, "nivel": level, "descricao": node[0]}
+
+    def ancestors(self, code):
+        """
+        Nós da divisão até o próprio código (inclusive), do mais geral para o mais específico.
+        """
+        digits = cnae_digits(code)
+        chain = []
+        while digits is not None and digits in self.nodes:
+            chain.append(self.lookup(digits))
+            digits = self.nodes[digits][1]
+        return chain[::-1]
+
+    def with_prefix(self, prefix):
+        """
+        Subclasses cujo código começa com o prefixo informado (ex.: "47.1" -> todas do grupo 47.1).
+        """
+        digits = cnae_digits(prefix)
+        start = bisect_left(self.subclasses, digits)
+        matches = []
+        for code in self.subclasses[start:]:
+            if not code.startswith(digits):
+                break
+            matches.append(code)
+        return matches
+
+    def longest_valid_prefix(self, code):
+        """
+        Maior prefixo do código que existe na árvore (subclasse, classe, grupo ou divisão), ou "".
+        """
+        digits = cnae_digits(code)[:7]
+        for n_digits in (7, 5, 3, 2):
+            if len(digits) >= n_digits and digits[:n_digits] in self.nodes:
+                return digits[:n_digits]
+        return ""
+
+    def repair(self, code, hint=None):
+        """
+        Subclasse válida mais próxima de um código possivelmente inválido ou incompleto.
+        Mantém o maior prefixo válido e escolhe, entre as subclasses sob ele, a de maior
+        sobreposição de termos com o texto de apoio (ex.: descrição/reasoning da resposta)
+        e, em empate, a numericamente mais próxima do código original.
+
+        :return: Dígitos da subclasse escolhida, ou None se nenhum prefixo for válido.
+        """
+        digits = cnae_digits(code)[:7]
+        if len(digits) == 7 and digits in self.nodes:
+            return digits
+        prefix = self.longest_valid_prefix(digits)
+        if not prefix:
+            return None
+
+        candidates = self.with_prefix(prefix)
+        target = int(digits.ljust(7, "0"))
+        hint_terms = Counter(tokenize(hint)) if hint else Counter()
+
+        def rank(candidate):
+            description, parent = self.nodes[candidate]
+            terms = set(tokenize(description + " " + self.nodes[parent][0]))
+            overlap = sum(count for term, count in hint_terms.items() if term in terms)
+            return (-overlap, abs(int(candidate) - target))
+
+        return min(candidates, key=rank)
+
+    def answer_digits(self, answer):
+        """
+        Dígitos do CNAE de uma resposta da LLM: usa o campo "cnae" ou, se incompleto, compõe a partir
+        de cnae_divisao ("47"), cnae_grupo ("11"), cnae_classe ("3") e cnae_subclasse ("01").
+        """
+        digits = cnae_digits(answer.get("cnae"))
+        if len(digits) >= 7:
+            return digits[:7]
+        parts = [
+            (cnae_digits(answer.get("cnae_divisao")), 2),
+            (cnae_digits(answer.get("cnae_grupo"))[-2:], 2),
+            (cnae_digits(answer.get("cnae_classe"))[-1:], 1),
+            (cnae_digits(answer.get("cnae_subclasse"))[-2:], 2),
+        ]
+        composed = ""
+        for part, size in parts:
+            if not part:
+                break
+            composed += part.zfill(size)
+        return composed if len(composed) > len(digits) else digits
+
+    def validate_answer(self, answer):
+        """
+        Valida a resposta (dict) contra a tabela CNAE, repara códigos inválidos e preenche as
+        descrições da classe e da subclasse a partir da tabela. Divisão e grupo mantêm as
+        descrições da resposta, pois as tabelas não as contêm.
+
+        :return: (resposta corrigida, dict com valido, reparado, codigo_original e prefixo_valido).
+        """
+        original = self.answer_digits(answer)
+        hint = " ".join(
+            str(answer.get(field) or "")
+            for field in ("cnae_subclasse_descricao", "cnae_classe_descricao", "reasoning")
+        )
+        valid = len(original) == 7 and original in self.nodes
+        prefix = self.longest_valid_prefix(original)
+        digits = original if valid else self.repair(original, hint)
+        report = {
+            "valido": valid,
+            "reparado": not valid and digits is not None,
+            "codigo_original": answer.get("cnae"),
+            "prefixo_valido": format_cnae(prefix) if prefix else None,
+        }
+        if digits is None:
+            return dict(answer), report
+
+        fixed = dict(answer)
+        fixed.update({
+            "cnae": format_cnae(digits),
+            "cnae_divisao": digits[:2],
+            "cnae_grupo": digits[2:4],
+            "cnae_classe": digits[4],
+            "cnae_classe_descricao": self.nodes[digits[:5]][0],
+            "cnae_subclasse": digits[5:7],
+            "cnae_subclasse_descricao": self.nodes[digits][0],
+        })
+        return fixed, report
@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import queue
+import base64
+import shutil
+import threading
+import subprocess
+import numpy as np
+import yt_dlp
+from .download import download_format_options
+from .frames import encoder_settings, encode_jpeg
+from .tracing import current_span, traced
+
+# Executável do ffmpeg usado na decodificação em streaming (versão 5.1 ou superior, por causa de -fps_mode)
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_SHOWINFO = re.compile(r"Parsed_showinfo.*\bpts_time:\s*(-?\d+(?:\.\d+)?)")
+_SIZE = re.compile(r", (\d{2,5})x(\d{2,5})")
+_FPS = re.compile(r"([\d.]+) (?:fps|tbr)")
+
+_END = object()
+
+
+def resolve_media_url(url, max_height=None, max_bitrate=None, format_selector=None):
+    """
+    Resolve, sem baixar, a URL de mídia de um vídeo (YouTube ou link direto) com o yt_dlp.
+    Usa as mesmas opções de formato de download_video_yt_dlp, preferindo arquivos únicos
+    (áudio e vídeo juntos), que o ffmpeg consegue ler diretamente.
+
+    :return: (URL da mídia, cabeçalhos HTTP exigidos pela origem, info do yt_dlp)
+    """
+    options = download_format_options(max_height, max_bitrate, format_selector=format_selector)
+    if options["format"] == "mp4":
+        options["format"] = "b[ext=mp4]/b"
+    options.update({"quiet": True, "noprogress": True, "skip_download": True})
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=False)
+    media = info["requested_formats"][0] if info.get("requested_formats") else info
+    return media["url"], media.get("http_headers") or {}, info
+
+
+def _select_filter(frame_interval, every_seconds):
+    # showinfo registra no log o instante (pts_time) de cada frame selecionado (ver _record_line)
+    if frame_interval is not None:
+        return f"select='not(mod(n\\,{int(frame_interval)}))',showinfo=checksum=0"
+    return f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{every_seconds})',showinfo=checksum=0"
+
+
+def _ffmpeg_command(input_url, headers, frame_interval, every_seconds, max_seconds, max_frames, ffmpeg):
+    command = [ffmpeg, "-hide_banner", "-nostats", "-loglevel", "info"]
+    if headers:
+        command += ["-headers", "".join(f"{key}: {value}\r\n" for key, value in headers.items())]
+    if max_seconds is not None:
+        command += ["-t", str(max_seconds)]
+    command += ["-i", input_url, "-an", "-vf", _select_filter(frame_interval, every_seconds),
+                "-fps_mode", "vfr", "-pix_fmt", "bgr24", "-f", "rawvideo"]
+    if max_frames is not None:
+        command += ["-frames:v", str(int(max_frames))]
+    return command + ["pipe:1"]
+
+
+def _feed_source(source, stdin, chunk_size, counter):
+    """
+    Copia os bytes de um objeto file-like (ex.: resposta HTTP, stdout do yt-dlp) para o ffmpeg.
+    """
+    try:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            counter["bytes"] += len(chunk)
+            stdin.write(chunk)
+    except (BrokenPipeError, ValueError, OSError):
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def _record_line(raw, lines, timeline):
+    """
+    Guarda uma linha do log do ffmpeg e, se for do showinfo, o instante do frame em timeline["times"].
+    """
+    line = raw.decode("utf-8", "replace").rstrip()
+    lines.append(line)
+    showinfo = _SHOWINFO.search(line)
+    if showinfo:
+        with timeline["condition"]:
+            timeline["times"].append(float(showinfo.group(1)))
+            timeline["condition"].notify_all()
+    return line
+
+
+def _frame_time(timeline, position, timeout=5.0):
+    """
+    Instante (pts_time) do frame na posição informada da saída do ffmpeg, ou None se o log não o trouxer.
+    A linha do showinfo é escrita antes do frame, mas é lida em outra thread: espera até timeout segundos.
+    """
+    with timeline["condition"]:
+        timeline["condition"].wait_for(lambda: len(timeline["times"]) > position or timeline["done"], timeout)
+        times = timeline["times"]
+        return times[position] if position < len(times) else None
+
+
+def _read_header(stderr, lines, timeline):
+    """
+    Lê o log do ffmpeg até a descrição do stream de saída e extrai duração, fps e dimensões.
+    Retorna dict (vazio se o ffmpeg terminar antes, ex.: fonte inválida).
+    """
+    header = {}
+    section = None
+    for raw in iter(stderr.readline, b""):
+        line = _record_line(raw, lines, timeline)
+        if line.startswith("Input #"):
+            section = "input"
+        elif line.startswith("Output #"):
+            section = "output"
+        duration = _DURATION.search(line)
+        if duration:
+            hours, minutes, seconds = duration.groups()
+            header["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        if "Video:" in line:
+            if section == "input" and "fps" not in header:
+                fps = _FPS.search(line)
+                header["fps"] = float(fps.group(1)) if fps else None
+            elif section == "output":
+                size = _SIZE.search(line)
+                if size:
+                    header["width"], header["height"] = int(size.group(1)), int(size.group(2))
+                    return header
+    return header
+
+
+def _drain(stderr, lines, timeline):
+    try:
+        for raw in iter(stderr.readline, b""):
+            _record_line(raw, lines, timeline)
+    finally:
+        with timeline["condition"]:
+            timeline["done"] = True
+            timeline["condition"].notify_all()
+
+
+@traced("ingest")
+def stream_source_frames(source, frame_interval=None, every_seconds=None, max_seconds=None, max_frames=None,
+                         max_side=None, interpolation="area", jpeg_quality=None, grayscale=False,
+                         buffer_frames=8, chunk_size=1 << 16, resolve=True, max_height=None,
+                         format_selector=None, ffmpeg=FFMPEG_BINARY):
+    """
+    Decodifica um vídeo diretamente do stream de mídia, sem gravá-lo em disco: os bytes vão para
+    um processo ffmpeg, que entrega apenas os frames amostrados, e cada frame é codificado em JPEG
+    base64 (mesmas opções de extract_base64_frames) assim que chega, enquanto o restante ainda é baixado.
+
+    O buffer é limitado: até buffer_frames frames decodificados ficam na fila; quando ela enche,
+    a leitura do pipe para e o ffmpeg (e o download) esperam o consumidor. Se o consumidor parar de
+    iterar (ex.: limite de tempo atingido), o ffmpeg é encerrado e nada mais é baixado.
+
+    :param source: URL do YouTube ou de um arquivo de mídia (resolvida com o yt_dlp se resolve=True),
+                   caminho local, ou objeto file-like com read() (ex.: stdout de `yt-dlp -o -`).
+                   Fontes file-like precisam de um formato legível em sequência (mp4 com o índice
+                   no início, webm, mpeg-ts).
+    :param frame_interval: Intervalo em frames (tem prioridade sobre every_seconds).
+    :param every_seconds: Intervalo em segundos (default = 1 frame por segundo).
+    :param max_seconds: Lê apenas os primeiros max_seconds segundos do vídeo.
+    :param max_frames: Número máximo de frames gerados.
+    :param buffer_frames: Número máximo de frames decodificados aguardando o consumidor.
+    :param chunk_size: Tamanho dos blocos copiados de fontes file-like para o ffmpeg.
+    :param resolve: Se True, URLs são resolvidas com o yt_dlp (necessário para o YouTube).
+    :param max_height: Altura máxima do formato escolhido pelo yt_dlp.
+    :param format_selector: Seletor de formato do yt_dlp.
+    :param ffmpeg: Executável do ffmpeg, versão 5.1 ou superior (usa -fps_mode).
+    :return: (gerador de frames base64, metadata). metadata["frame_indices"] é preenchido à medida
+             que os frames são gerados, com o índice de cada frame no vídeo calculado a partir do seu
+             instante (pts_time × fps, registrado pelo showinfo do ffmpeg), e metadata["time_to_first_frame"]
+             ao gerar o primeiro.
+    """
+    start = time.perf_counter()
+    every_seconds = every_seconds if every_seconds is not None else 1
+    encoding = encoder_settings(max_side, interpolation, jpeg_quality, grayscale)
+
+    if shutil.which(ffmpeg) is None:
+        raise FileNotFoundError(f"ffmpeg não encontrado ({ffmpeg!r}): instale o ffmpeg 5.1+ e coloque-o no PATH "
+                                "ou informe o caminho em FFMPEG_BINARY.")
+
+    headers = {}
+    is_stream = hasattr(source, "read")
+    input_url = "pipe:0" if is_stream else source
+    if not is_stream and resolve and re.match(r"https?://", source):
+        input_url, headers, _ = resolve_media_url(source, max_height=max_height, format_selector=format_selector)
+
+    process = subprocess.Popen(
+        _ffmpeg_command(input_url, headers, frame_interval, every_seconds, max_seconds, max_frames, ffmpeg),
+        stdin=subprocess.PIPE if is_stream else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    counter = {"bytes": 0}
+    if is_stream:
+        threading.Thread(target=_feed_source, args=(source, process.stdin, chunk_size, counter), daemon=True).start()
+
+    log = []
+    timeline = {"times": [], "done": False, "condition": threading.Condition()}
+    header = _read_header(process.stderr, log, timeline)
+    threading.Thread(target=_drain, args=(process.stderr, log, timeline), daemon=True).start()
+    if "width" not in header:
+        process.kill()
+        process.wait()
+        raise ValueError(f"Não foi possível decodificar o vídeo: {source!r}\n" + "\n".join(log[-10:]))
+
+    fps = header.get("fps") or 0
+    duration = header.get("duration")
+    if max_seconds is not None and duration is not None:
+        duration = min(duration, max_seconds)
+    if frame_interval is None:
+        frame_interval = max(1, int(round(every_seconds * fps))) if fps else 1
+    metadata = {
+        "fps": fps,
+        "total_frames": int(duration * fps) if duration and fps else 0,
+        "width": header["width"],
+        "height": header["height"],
+        "frame_interval": frame_interval,
+        "frame_indices": [],
+        "source": "stream",
+        "time_to_header": time.perf_counter() - start
+    }
+    current_span().set(source=input_url if not is_stream else "file-like", fps=fps,
+                       width=header["width"], height=header["height"])
+
+    frame_bytes = header["width"] * header["height"] * 3
+    frames = queue.Queue(maxsize=max(1, buffer_frames))
+    stop = threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                frame = np.frombuffer(data, dtype=np.uint8).reshape(header["height"], header["width"], 3)
+                while not stop.is_set():
+                    try:
+                        frames.put(frame, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        finally:
+            # Se o consumidor já fechou o gerador, ninguém lê a fila: não bloqueia esperando espaço
+            while not stop.is_set():
+                try:
+                    frames.put(_END, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    def generator():
+        try:
+            count = 0
+            position = -1
+            while True:
+                frame = frames.get()
+                if frame is _END:
+                    break
+                # Posição na saída do ffmpeg, que também conta os frames descartados abaixo
+                position += 1
+                jpeg_bytes = encode_jpeg(frame, encoding)
+                if jpeg_bytes is None:
+                    continue
+                if count == 0:
+                    metadata["time_to_first_frame"] = time.perf_counter() - start
+                frame_time = _frame_time(timeline, position)
+                if frame_time is not None and fps:
+                    metadata["frame_indices"].append(int(round(frame_time * fps)))
+                else:
+                    metadata["frame_indices"].append(position * frame_interval)
+                count += 1
+                yield base64.b64encode(jpeg_bytes).decode("utf-8")
+        finally:
+            stop.set()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            metadata["bytes_read"] = counter["bytes"] if is_stream else None
+            metadata["stream_time"] = time.perf_counter() - start
+
+    return generator(), metadata
@@ -1,148 +1,619 @@
+import asyncio
+import re
 import json
+import math
 import time
-from .frames import extract_base64_frames
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from .execution import cached_prompt_tokens, run_coroutine, token_usage_to_dict
+from .frames import extract_base64_frames, stream_base64_frames
+from .ingest import stream_source_frames
+from .evaluation import CNAE_LEVELS, normalize_cnae_code
+from .structured import extract_json_object, parse_structured_output
+from .tracing import bind_context, traced
+
+def call_stats(result, **extra):
+    """
+    Resume uma chamada à LLM: tempo, tokens (com a divisão prompt/resposta, se disponível)
+    e contadores da camada de execução.
+    """
+    stats = dict(extra)
+    stats["processing_time"] = result["processing_time"]
+    stats.update(token_usage_to_dict(result["token_usage"]))
+    for key in ("retries", "throttle_wait", "cached", "time_to_first_token", "tokens_per_second"):
+        if key in result:
+            stats[key] = result[key]
+    cached_tokens = cached_prompt_tokens(result["token_usage"])
+    if cached_tokens is not None:
+        stats["cached_tokens"] = cached_tokens
+    return stats
+
+
+def apply_structured_output(llm, final_result, inspection):
+    """
+    Interpreta a resposta final como JSON (com chamada de reparo só em caso de falha) e atualiza
+    o resultado da inspeção: final_inspection normalizado, parse_failures, repairs e, se houve reparo,
+    os tokens e o tempo da chamada de reparo (repair_stats).
+    """
+    data, parse_stats = parse_structured_output(llm, final_result)
+    if data:
+        inspection["final_inspection"] = json.dumps(data, ensure_ascii=False)
+    inspection["parse_failures"] = parse_stats["parse_failures"]
+    inspection["repairs"] = parse_stats["repairs"]
+    repair_result = parse_stats["repair_result"]
+    if repair_result is not None:
+        usage = token_usage_to_dict(repair_result["token_usage"])
+        inspection["total_tokens"] += usage.get("total_tokens", usage.get("total_token_count", 0))
+        inspection["total_time"] += repair_result["processing_time"]
+        inspection["repair_stats"] = call_stats(repair_result)
+    return inspection
+
+def frame_seconds(metadata):
+    """
+    Intervalo, em segundos de vídeo, entre dois frames amostrados (frame_interval / fps), ou None.
+    Só vale para amostragem uniforme; com frame_indices nos metadados, use frames_before_limit.
+    """
+    if not metadata or not metadata.get("fps") or not metadata.get("frame_interval"):
+        return None
+    return metadata["frame_interval"] / metadata["fps"]
+
+
+def has_frame_indices(metadata):
+    """
+    True se os metadados trazem o índice original de cada frame (frame_indices) e o fps do vídeo.
+    """
+    return bool(metadata) and bool(metadata.get("fps")) and metadata.get("frame_indices") is not None
+
+
+def frame_count_before(frame_indices, fps, video_time_limit):
+    """
+    Quantos frames (em ordem) têm instante no vídeo (índice / fps) anterior a video_time_limit.
+    """
+    for position, frame_index in enumerate(frame_indices):
+        if frame_index / fps >= video_time_limit:
+            return position
+    return len(frame_indices)
+
+
+def frames_before_limit(base64_frames, metadata, video_time_limit):
+    """
+    Corta os frames em video_time_limit pelo instante real de cada um (frame_indices / fps), o que também
+    vale para amostragem não uniforme (every_seconds, timestamps, FrameSelector, vídeos VFR).
+    Listas (ou sequências) são fatiadas; de um gerador, que preenche frame_indices à medida que gera os
+    frames, são repassados os frames até o primeiro após o limite.
+    """
+    frame_indices = metadata["frame_indices"]
+    fps = metadata["fps"]
+    if hasattr(base64_frames, "__len__"):
+        return base64_frames[:frame_count_before(frame_indices, fps, video_time_limit)]
+
+    def generator():
+        try:
+            for position, frame in enumerate(base64_frames):
+                if position < len(frame_indices) and frame_indices[position] / fps >= video_time_limit:
+                    break
+                yield frame
+        finally:
+            # Libera o gerador original (e a captura do vídeo) junto com este
+            close = getattr(base64_frames, "close", None)
+            if close is not None:
+                close()
+
+    return generator()
+
+
+def answer_level_key(output, level):
+    """
+    Dígitos do CNAE de uma resposta de batch truncados no nível informado ('divisao', 'grupo', 'classe'
+    ou 'subclasse'; ex.: "47.11-3-01" -> grupo "471"), para comparar respostas.
+    Retorna None se a resposta não tiver um CNAE com dígitos suficientes para o nível.
+    """
+    data = extract_json_object(output)
+    if not data:
+        return None
+    code, n_digits = normalize_cnae_code(data.get("cnae"))
+    for name, level_digits, divisor in CNAE_LEVELS:
+        if name == level:
+            if code is None or n_digits < level_digits:
+                return None
+            return f"{code // divisor:0{level_digits}d}"
+    raise ValueError(f"level deve ser um de {tuple(name for name, _, _ in CNAE_LEVELS)}")
+
+
+_IMAGE_REFERENCE = re.compile(r"\[\s*(\d+)\s*,\s*(\d+)\s*\]")
+
+
+def image_references(text):
+    """
+    Pares [frame_index, batch_sequence] citados em uma resposta (JSON ou texto livre), sem repetições e na ordem.
+    """
+    references = []
+    for match in _IMAGE_REFERENCE.finditer(text or ""):
+        reference = [int(match.group(1)), int(match.group(2))]
+        if reference not in references:
+            references.append(reference)
+    return references
+
+
+def carry_image_references(output, references, max_images=10):
+    """
+    Garante que a resposta de uma consolidação intermediária continue citando as imagens das respostas
+    de origem: em JSON, mantém só os pares de "images" que existiam nas entradas (ou, se nenhum restar,
+    os primeiros max_images das entradas); em texto livre, acrescenta os pares se nenhum foi citado.
+    """
+    data = extract_json_object(output)
+    if data is not None:
+        known = {tuple(reference) for reference in references}
+        kept = [list(item) for item in data.get("images") or []
+                if isinstance(item, (list, tuple)) and len(item) == 2 and tuple(item) in known]
+        data["images"] = kept or references[:max_images]
+        return json.dumps(data, ensure_ascii=False)
+    if references and not image_references(output):
+        return f"{output}\nImagens: {json.dumps(references[:max_images])}"
+    return output
+
 
 class VideoProcessor:
     def __init__(self, video_path):
         """
-        :param video_path: Caminho do vídeo
+        :param video_path: Caminho do vídeo (em stream_source, também uma URL ou objeto file-like)
         """
         self.video_path = video_path
 
-    def process_video(self, frame_interval=None):
+    def process_video(self, frame_interval=None, workers=None, **sampling):
         """
         Extrai os frames do vídeo em formato base64.
         Retorna (base64Frames, metadata).
+        :param workers: Número de processos para extração paralela (None ou 1 = serial).
+        :param sampling: Demais opções de extract_base64_frames (every_seconds, max_frames, ...).
         """
-        return extract_base64_frames(self.video_path, frame_interval=frame_interval)
+        return extract_base64_frames(self.video_path, frame_interval=frame_interval, workers=workers, **sampling)
+
+    def stream_video(self, frame_interval=None, **sampling):
+        """
+        Extrai os frames sob demanda, em streaming (ver stream_base64_frames).
+        O gerador pode ser passado diretamente para os pipelines do VideoInspector,
+        que enviam cada batch assim que ele fica pronto.
+        Retorna (gerador de frames base64, metadata).
+        """
+        return stream_base64_frames(self.video_path, frame_interval=frame_interval, **sampling)
+
+    def stream_source(self, frame_interval=None, **options):
+        """
+        Extrai os frames direto do stream de mídia, sem gravar o vídeo em disco (ver stream_source_frames).
+        Aqui video_path pode ser uma URL (YouTube ou arquivo remoto), um caminho local ou um objeto file-like.
+        Retorna (gerador de frames base64, metadata).
+        """
+        return stream_source_frames(self.video_path, frame_interval=frame_interval, **options)
 
 
 class VideoInspector:
-    def __init__(self, llm, prompt_manager, batch_size=20):
+    def __init__(self, llm, prompt_manager, batch_size=20, max_concurrency=1, concurrency_backend="thread",
+                 structured_output=False, early_stop_level=None, early_stop_window=2, reduce_fan_in=None,
+                 reduce_concurrency=None):
         """
         :param llm: Instância de LLMBase (ex: OpenAI_LLM).
         :param prompt_manager: Instância de PromptManager.
         :param batch_size: Número de frames por batch.
+        :param max_concurrency: Número máximo de batches enviados simultaneamente à LLM (1 = sequencial).
+        :param concurrency_backend: 'thread' (ThreadPoolExecutor) ou 'asyncio'.
+        :param structured_output: Se True, a chamada final usa o modo JSON do provedor (run_prompt(..., json_output=True)).
+                                  Em todos os casos a resposta final é interpretada com tolerância e, se falhar,
+                                  reparada por uma chamada só de texto.
+        :param early_stop_level: Nível CNAE ('divisao', 'grupo', 'classe' ou 'subclasse') usado na parada
+                                 antecipada: a resposta JSON de cada batch é lida assim que chega e nenhum
+                                 batch novo é enviado quando as últimas early_stop_window respostas concordam
+                                 nesse nível. None = envia todos os batches até o limite de tempo.
+        :param early_stop_window: Número de respostas consecutivas que precisam concordar.
+        :param reduce_fan_in: Consolidação em árvore: as respostas dos batches são fundidas em grupos de
+                              reduce_fan_in (em paralelo, nível a nível) até restarem no máximo reduce_fan_in,
+                              que vão para o prompt final. None = todas as respostas em um único prompt final.
+        :param reduce_concurrency: Número máximo de fusões simultâneas em cada nível (None = todas do nível).
         """
         self.llm = llm
         self.prompt_manager = prompt_manager
         self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.concurrency_backend = concurrency_backend
+        self.structured_output = structured_output
+        self.early_stop_level = early_stop_level
+        self.early_stop_window = early_stop_window
+        self.reduce_fan_in = reduce_fan_in
+        self.reduce_concurrency = reduce_concurrency
         self.correct_cnae = None
 
     def register_correct_cnae(self, correct_cnae):
         self.correct_cnae = correct_cnae
 
-    def inspect_pipeline_a(self, base64_frames, video_time_limit):
+    def _iter_batches(self, base64_frames, video_time_limit, seconds_per_frame=None):
         """
-        Pipeline A: Envia frames em batches, e por fim reescreve numa resposta única.
+        Agrupa os frames (lista ou gerador) em batches e aplica o limite de tempo de vídeo.
+        Ao atingir o limite, para de consumir os frames.
+        Gera tuplas (batch_sequence, batch).
+
+        :param seconds_per_frame: Segundos de vídeo entre frames amostrados (ver frame_seconds). Se informado,
+                                  video_time_limit é comparado com o tempo real de vídeo coberto pelos batches;
+                                  senão, cada batch conta batch_size segundos (regra original).
         """
-        batch_results = []
-        total_tokens = 0
-        total_time = 0
+        frames = iter(base64_frames)
         video_time_current = 0
         batch_sequence = 0
+        while True:
+            batch = list(islice(frames, self.batch_size))
+            if not batch:
+                break
+            yield batch_sequence, batch
+            if seconds_per_frame is None:
+                video_time_current += self.batch_size
+            else:
+                video_time_current += len(batch) * seconds_per_frame
+            batch_sequence += 1
 
-        # Envia lotes de frames
-        for i in range(0, len(base64_frames), self.batch_size):
-            batch = base64_frames[i : i + self.batch_size]
-            prompt_messages = self.prompt_manager.get_inspection_messages(
-                batch, batch_sequence, pipeline='A'
-            )
-            result = self.llm.run_prompt(prompt_messages)
+            if video_time_current >= video_time_limit:
+                break
+
+    def _select_batches(self, base64_frames, video_time_limit, seconds_per_frame=None):
+        """
+        Divide os frames em batches e aplica o limite de tempo de vídeo,
+        preservando a mesma regra de parada do envio sequencial.
+        Retorna lista de tuplas (batch_sequence, batch).
+        """
+        return list(self._iter_batches(base64_frames, video_time_limit, seconds_per_frame))
+
+    def _planned_batches(self, base64_frames, video_time_limit, seconds_per_frame, metadata, frames_time_limit=None):
+        """
+        Número de batches que seriam enviados sem parada antecipada (None se não puder ser estimado,
+        ex.: gerador sem total_frames nos metadados).
+
+        :param frames_time_limit: Limite (em segundos) já aplicado aos frames por frames_before_limit; para
+                                  um gerador, a estimativa considera apenas o trecho do vídeo antes dele.
+        """
+        if hasattr(base64_frames, "__len__"):
+            n_frames = len(base64_frames)
+        elif metadata and metadata.get("total_frames") and metadata.get("frame_interval"):
+            total_frames = metadata["total_frames"]
+            if frames_time_limit is not None:
+                total_frames = min(total_frames, frames_time_limit * metadata["fps"])
+            n_frames = math.ceil(total_frames / metadata["frame_interval"])
+        else:
+            return None
+        return sum(1 for _ in self._iter_batches(range(n_frames), video_time_limit, seconds_per_frame))
+
+    def _run_batch_prompts(self, prompts):
+        """
+        Envia os prompts dos batches para a LLM, sequencialmente ou de forma concorrente
+        (conforme max_concurrency e concurrency_backend).
+        Os resultados são retornados na mesma ordem dos prompts (batch_sequence).
+        """
+        if self.max_concurrency <= 1 or len(prompts) <= 1:
+            return [self.llm.run_prompt(prompt) for prompt in prompts]
+
+        if self.concurrency_backend == "thread":
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                return list(executor.map(bind_context(self.llm.run_prompt), prompts))
+
+        if self.concurrency_backend == "asyncio":
+            return run_coroutine(self._run_batch_prompts_async(prompts))
+
+        raise ValueError("concurrency_backend deve ser 'thread' ou 'asyncio'")
+
+    async def _run_batch_prompts_async(self, prompts):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_one(prompt):
+            async with semaphore:
+                return await asyncio.to_thread(self.llm.run_prompt, prompt)
+
+        return await asyncio.gather(*(run_one(prompt) for prompt in prompts))
+
+    def batch_messages(self, batch, batch_sequence, pipeline, few_shot_query=None):
+        """
+        Prompt de um batch, exatamente como é enviado à LLM (também usado por planner.plan_inspection).
+        """
+        return self.prompt_manager.get_inspection_messages(batch, batch_sequence, pipeline=pipeline,
+                                                           few_shot_query=few_shot_query)
+
+    def uses_first_pass(self, pipeline):
+        """
+        Com cnae_index no Pipeline A, o primeiro batch vai com a tabela completa e sua resposta é a
+        consulta que recupera os CNAEs candidatos enviados nos batches seguintes.
+        """
+        return pipeline == "A" and self.prompt_manager.cnae_index is not None
+
+    def _run_streamed_batches(self, base64_frames, video_time_limit, pipeline, seconds_per_frame=None):
+        """
+        Envia cada batch à LLM assim que ele é extraído do gerador de frames,
+        de modo que o batch N é processado enquanto o batch N+1 ainda está sendo decodificado.
+        No máximo max_concurrency chamadas ficam em andamento ao mesmo tempo.
+        """
+        futures = []
+        few_shot_query = None
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            for batch_sequence, batch in self._iter_batches(base64_frames, video_time_limit, seconds_per_frame):
+                if futures and few_shot_query is None and self.uses_first_pass(pipeline):
+                    few_shot_query = futures[0].result()["output"]
+                prompt = self.batch_messages(batch, batch_sequence, pipeline, few_shot_query)
+                pending = [future for future in futures if not future.done()]
+                if len(pending) >= max(1, self.max_concurrency):
+                    wait(pending, return_when=FIRST_COMPLETED)
+                futures.append(executor.submit(bind_context(self.llm.run_prompt), prompt))
+
+        # Libera o gerador (e a captura do vídeo) sem decodificar frames além do limite
+        close = getattr(base64_frames, "close", None)
+        if close is not None:
+            close()
+        return [future.result() for future in futures]
+
+    def _agreement(self, keys):
+        """
+        Código (no nível early_stop_level) em que as últimas early_stop_window respostas concordam, ou None.
+        """
+        window = max(1, self.early_stop_window)
+        recent = keys[-window:]
+        if len(recent) < window or recent[0] is None or any(key != recent[0] for key in recent):
+            return None
+        return recent[0]
+
+    def _run_adaptive_batches(self, base64_frames, video_time_limit, pipeline, seconds_per_frame=None):
+        """
+        Envia os batches em ordem (com até max_concurrency chamadas em andamento), lendo a resposta JSON
+        de cada um assim que ela chega. Quando as últimas early_stop_window respostas concordam no nível
+        early_stop_level, nenhum batch novo é extraído nem enviado; as chamadas já em andamento são aguardadas.
+        Retorna (resultados na ordem dos batches, código acordado ou None).
+        """
+        concurrency = max(1, self.max_concurrency)
+        batches = self._iter_batches(base64_frames, video_time_limit, seconds_per_frame)
+        futures = deque()
+        results = []
+        keys = []
+        agreed = None
+        first = None
+        few_shot_query = None
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                if futures and (len(futures) >= concurrency or futures[0].done()):
+                    result = futures.popleft().result()
+                    results.append(result)
+                    keys.append(answer_level_key(result["output"], self.early_stop_level))
+                    agreed = self._agreement(keys)
+                    if agreed is not None:
+                        break
+                    continue
+                item = next(batches, None)
+                if item is None:
+                    break
+                batch_sequence, batch = item
+                if first is not None and few_shot_query is None and self.uses_first_pass(pipeline):
+                    few_shot_query = first.result()["output"]
+                prompt = self.batch_messages(batch, batch_sequence, pipeline, few_shot_query)
+                futures.append(executor.submit(bind_context(self.llm.run_prompt), prompt))
+                first = first or futures[-1]
+            # Chamadas já enviadas foram pagas: seus resultados também entram na consolidação
+            results.extend(future.result() for future in futures)
+
+        batches.close()
+        close = getattr(base64_frames, "close", None)
+        if close is not None:
+            close()
+        return results, agreed
+
+    @traced("batches")
+    def _inspect_batches(self, base64_frames, video_time_limit, pipeline, metadata=None):
+        """
+        Executa a etapa de batches comum aos pipelines A e B.
+        base64_frames pode ser uma lista (ou sequência) de frames ou um gerador em streaming
+        (ver VideoProcessor.stream_video). Se metadata for informado, video_time_limit é aplicado em
+        segundos reais de vídeo: pelo índice de cada frame (frame_indices / fps), se houver, ou pelo
+        intervalo de amostragem (frame_interval / fps).
+        Retorna (batch_results, total_tokens, total_time, batch_stats, early_stop), onde total_time
+        é a soma dos tempos de cada chamada, batch_stats traz tempo e tokens de cada batch e
+        early_stop resume a parada antecipada (None se early_stop_level não estiver ativo).
+        """
+        seconds_per_frame = frame_seconds(metadata)
+        frames_time_limit = None
+        if has_frame_indices(metadata):
+            # Corte pelo instante real de cada frame; os batches não contam mais tempo
+            base64_frames = frames_before_limit(base64_frames, metadata, video_time_limit)
+            frames_time_limit = video_time_limit
+            video_time_limit, seconds_per_frame = math.inf, None
+        early_stop = None
+        if self.early_stop_level is not None:
+            planned = self._planned_batches(base64_frames, video_time_limit, seconds_per_frame, metadata,
+                                            frames_time_limit)
+            results, agreed = self._run_adaptive_batches(base64_frames, video_time_limit, pipeline, seconds_per_frame)
+            early_stop = {"early_stopped": agreed is not None and (planned is None or len(results) < planned),
+                          "agreed_cnae": agreed,
+                          "batches_planned": planned, "batches_sent": len(results)}
+        elif hasattr(base64_frames, "__len__"):
+            batches = self._select_batches(base64_frames, video_time_limit, seconds_per_frame)
+            results = []
+            few_shot_query = None
+            if self.uses_first_pass(pipeline) and len(batches) > 1:
+                # Primeira passada: a resposta do primeiro batch é a consulta dos CNAEs candidatos
+                results = self._run_batch_prompts([self.batch_messages(batches[0][1], batches[0][0], pipeline)])
+                few_shot_query = results[0]["output"]
+                batches = batches[1:]
+            prompts = [
+                self.batch_messages(batch, batch_sequence, pipeline, few_shot_query)
+                for batch_sequence, batch in batches
+            ]
+            results += self._run_batch_prompts(prompts)
+        else:
+            results = self._run_streamed_batches(base64_frames, video_time_limit, pipeline, seconds_per_frame)
+
+        batch_results = []
+        batch_stats = []
+        total_tokens = 0
+        total_time = 0
+        for batch_sequence, result in enumerate(results):
             batch_results.append(result["output"])
             total_tokens += result["token_usage"].total_tokens
             total_time += result["processing_time"]
-            video_time_current += self.batch_size
-            batch_sequence += 1
+            batch_stats.append(call_stats(result, batch_sequence=batch_sequence))
 
-            if video_time_current >= video_time_limit:
-                break
+        if early_stop is not None:
+            planned = early_stop["batches_planned"]
+            calls_saved = max(0, planned - len(results)) if planned is not None else None
+            early_stop["calls_saved"] = calls_saved
+            # Estimativa: cada batch não enviado custaria a média de tokens dos batches enviados
+            early_stop["tokens_saved"] = (
+                round(calls_saved * total_tokens / len(results)) if calls_saved is not None and results else None
+            )
+        return batch_results, total_tokens, total_time, batch_stats, early_stop
 
-        combined_text = "\n".join(batch_results)
+    @traced("reduce")
+    def _reduce_batches(self, batch_results, pipeline):
+        """
+        Consolidação em árvore das respostas dos batches: a cada nível, funde grupos de reduce_fan_in
+        respostas com o prompt de fusão (get_merge_prompt), com as fusões do nível em paralelo,
+        preservando as referências [frame_index, batch_sequence] (carry_image_references).
+        O número de níveis cresce com log(batches), e o prompt final recebe no máximo reduce_fan_in respostas.
+        Retorna (respostas restantes, total_tokens, total_time, reduce_stats).
+        """
+        texts = list(batch_results)
+        fan_in = self.reduce_fan_in
+        reduce_stats = []
+        total_tokens = 0
+        total_time = 0
+        level = 0
+        while fan_in and fan_in >= 2 and len(texts) > fan_in:
+            groups = [texts[start:start + fan_in] for start in range(0, len(texts), fan_in)]
+            merges = [group for group in groups if len(group) > 1]
+            prompts = [
+                [{"role": "user", "content": self.prompt_manager.get_merge_prompt("\n\n".join(group), pipeline)}]
+                for group in merges
+            ]
+            workers = max(1, min(len(prompts), self.reduce_concurrency or len(prompts)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = iter(list(executor.map(bind_context(self.llm.run_prompt), prompts)))
+
+            merged = []
+            for group_sequence, group in enumerate(groups):
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                result = next(results)
+                references = [reference for text in group for reference in image_references(text)]
+                merged.append(carry_image_references(result["output"], references))
+                total_tokens += result["token_usage"].total_tokens
+                total_time += result["processing_time"]
+                reduce_stats.append(call_stats(result, reduce_level=level, batch_sequence=group_sequence))
+            texts = merged
+            level += 1
+        return texts, total_tokens, total_time, reduce_stats
+
+    @traced("pipeline_a")
+    def inspect_pipeline_a(self, base64_frames, video_time_limit, metadata=None):
+        """
+        Pipeline A: Envia frames em batches, e por fim reescreve numa resposta única.
+        :param metadata: Metadados da extração (fps, frame_indices ou frame_interval); se informados, video_time_limit é em segundos reais.
+        """
+        start_time = time.time()
+        batch_results, total_tokens, total_time, batch_stats, early_stop = self._inspect_batches(
+            base64_frames, video_time_limit, pipeline='A', metadata=metadata
+        )
+
+        partial_results, reduce_tokens, reduce_time, reduce_stats = self._reduce_batches(batch_results, pipeline='A')
+        total_tokens += reduce_tokens
+        total_time += reduce_time
+        combined_text = "\n".join(partial_results)
 
         # Reescrita final para consolidar
         rewrite_prompt_message = [{
             "role": "user",
-            "content": self.prompt_manager.rewrite_prompt.format(inspections=combined_text)
+            "content": self.prompt_manager.get_rewrite_prompt(combined_text)
         }]
-        final_result = self.llm.run_prompt(rewrite_prompt_message)
+        final_result = self.llm.run_prompt(rewrite_prompt_message, json_output=self.structured_output)
         total_tokens += final_result["token_usage"].total_tokens
         total_time += final_result["processing_time"]
 
-        return {
+        inspection = apply_structured_output(self.llm, final_result, {
             "final_inspection": final_result["output"],
             "batch_inspections": batch_results,
             "total_tokens": total_tokens,
-            "total_time": total_time
-        }
+            "total_time": total_time,
+            "batch_stats": batch_stats,
+            "final_stats": call_stats(final_result)
+        })
+        if reduce_stats:
+            inspection["reduce_stats"] = reduce_stats
+        if early_stop is not None:
+            inspection.update(early_stop)
+        inspection["wall_time"] = time.time() - start_time
+        return inspection
 
-    def inspect_pipeline_b(self, base64_frames, video_time_limit):
+    @traced("pipeline_b")
+    def inspect_pipeline_b(self, base64_frames, video_time_limit, metadata=None):
         """
         Pipeline B: Parecido com o A, mas ao final combina o texto em outro prompt 
         e envia novamente para a LLM (exemplo de variação).
+        :param metadata: Metadados da extração (fps, frame_indices ou frame_interval); se informados, video_time_limit é em segundos reais.
         """
-        batch_results = []
-        total_tokens = 0
-        total_time = 0
-        video_time_current = 0
-        batch_sequence = 0
+        start_time = time.time()
+        batch_results, total_tokens, total_time, batch_stats, early_stop = self._inspect_batches(
+            base64_frames, video_time_limit, pipeline='B', metadata=metadata
+        )
 
-        for i in range(0, len(base64_frames), self.batch_size):
-            batch = base64_frames[i : i + self.batch_size]
-            prompt_messages = self.prompt_manager.get_inspection_messages(
-                batch, batch_sequence, pipeline='B'
-            )
-            result = self.llm.run_prompt(prompt_messages)
-            batch_results.append(result["output"])
-
-            total_tokens += result["token_usage"].total_tokens
-            total_time += result["processing_time"]
-            video_time_current += self.batch_size
-            batch_sequence += 1
-
-            if video_time_current >= video_time_limit:
-                break
-
-        combined_text = "\n".join(batch_results)
+        partial_results, reduce_tokens, reduce_time, reduce_stats = self._reduce_batches(batch_results, pipeline='B')
+        total_tokens += reduce_tokens
+        total_time += reduce_time
+        combined_text = "\n".join(partial_results)
         # Envia ao prompt de inspeção final, por exemplo
-        rewrite_prompt_message = [{
-            "role": "user",
-            "content": self.prompt_manager.get_inspection_prompt(descriptions=combined_text)
-        }]
-        final_result = self.llm.run_prompt(rewrite_prompt_message)
+        rewrite_prompt_message = self.prompt_manager.get_final_inspection_messages(combined_text)
+        final_result = self.llm.run_prompt(rewrite_prompt_message, json_output=self.structured_output)
         total_tokens += final_result["token_usage"].total_tokens
         total_time += final_result["processing_time"]
 
-        return {
+        inspection = apply_structured_output(self.llm, final_result, {
             "final_inspection": final_result["output"],
             "batch_inspections": batch_results,
             "total_tokens": total_tokens,
-            "total_time": total_time
-        }
+            "total_time": total_time,
+            "batch_stats": batch_stats,
+            "final_stats": call_stats(final_result)
+        })
+        if reduce_stats:
+            inspection["reduce_stats"] = reduce_stats
+        if early_stop is not None:
+            inspection.update(early_stop)
+        inspection["wall_time"] = time.time() - start_time
+        return inspection
 
     def evaluate_inspection(self, predicted_cnae):
         """
-        Exemplo de função de avaliação simples 
-        (caso você queira verificar se a LLM acerta o CNAE).
+        Avalia o CNAE previsto contra o correto em cada nível (divisão, grupo, classe, subclasse),
+        aceitando qualquer formatação do código ("47.11-3-01", "47-11-3-01", "4711-3/01").
         """
-        overall = 1.0 if predicted_cnae == self.correct_cnae else 0.0
-        return {"overall": overall}
+        predicted, predicted_digits = normalize_cnae_code(predicted_cnae)
+        expected, expected_digits = normalize_cnae_code(self.correct_cnae)
+        scores = {}
+        for level, n_digits, divisor in CNAE_LEVELS:
+            hit = (predicted is not None and expected is not None
+                   and min(predicted_digits, expected_digits) >= n_digits
+                   and predicted // divisor == expected // divisor)
+            scores[level] = 1.0 if hit else 0.0
+        scores["overall"] = scores["subclasse"]
+        return scores
 
 class VideoInspectorGemini:
-    def __init__(self, llm, arquivo, prompt_manager):
+    def __init__(self, llm, arquivo, prompt_manager, structured_output=False):
         """
         :param llm: Instância de LLMBase (ex: OpenAI_LLM).
         :param prompt_manager: Instância de PromptManager.
         :param batch_size: Número de frames por batch.
+        :param structured_output: Se True, pede a resposta no modo JSON do Gemini (response_mime_type).
         """
         self.llm = llm
         self.prompt_manager = prompt_manager
         self.arquivo = arquivo
+        self.structured_output = structured_output
         self.correct_cnae = None
 
     def register_correct_cnae(self, correct_cnae):
         self.correct_cnae = correct_cnae
 
+    @traced("pipeline_gemini")
     def inspect_pipeline_a(self):
         """
         Pipeline A: Envia vídeo completo
@@ -172,42 +643,42 @@ class VideoInspectorGemini:
         """
         # Envia lotes de frames
 
-        prompt_messages=[
-            {
-                "role": "user",
-                "parts": [
-                    self.arquivo,
-                ],
-            },
-            {
-                "role": "user",
-                "parts": [
-                    (
-                        "### Contexto ###\n"
-                        "Você é um especialista em análise visual e sua tarefa é responder à pergunta abaixo, "
-                        "com base nas imagens disponibilizadas.\n"
-                        "Pergunta: Baseado nas imagens, estime qual é o código CNAE do empreendimento, segundo a classificação nacional de "
-                        "atividades econômicas do Brasil?\n"
-                        "Responda com a máscara completa: Divisão, Grupo, Classe e Subclasse (X.XX-XX-X). "
-                        "Responda apenas UM CNAE. Se houver várias atividades, informe APENAS o CNAE predominante.\n"
-                        "Informe a lista de imagens que justificam sua resposta. Seja muito sucinto, informando apenas "
-                        "as imagens imprescindíveis para dar credibilidade à sua resposta. NUNCA apresente mais do que 10 imagens."
-                      f"Lista de CNAEs: {self.prompt_manager.few_shot_cnaes}"
-                      f"Retorne a resposta no seguinte formato JSON, sem delimitadores de bloco de código: {json_mask}"                    
-                    )
-                        ],
-              }
-                ]
-
-
-        result = self.llm.run_prompt(prompt_messages)
+        instructions = (
+            "### Contexto ###\n"
+            "Você é um especialista em análise visual e sua tarefa é responder à pergunta abaixo, "
+            "com base nas imagens disponibilizadas.\n"
+            "Pergunta: Baseado nas imagens, estime qual é o código CNAE do empreendimento, segundo a classificação nacional de "
+            "atividades econômicas do Brasil?\n"
+            "Responda com a máscara completa: Divisão, Grupo, Classe e Subclasse (X.XX-XX-X). "
+            "Responda apenas UM CNAE. Se houver várias atividades, informe APENAS o CNAE predominante.\n"
+            "Informe a lista de imagens que justificam sua resposta. Seja muito sucinto, informando apenas "
+            "as imagens imprescindíveis para dar credibilidade à sua resposta. NUNCA apresente mais do que 10 imagens."
+            f"Lista de CNAEs: {self.prompt_manager.few_shot_cnaes}"
+            f"Retorne a resposta no seguinte formato JSON, sem delimitadores de bloco de código: {json_mask}"
+        )
+
+        if self.prompt_manager.prefix_cache:
+            # Instruções, lista de CNAEs e máscara JSON formam um prefixo estático, enviado antes do vídeo.
+            # "cache": True permite ao Gemini_LLM (com cache_ttl) guardá-lo como conteúdo em cache explícito.
+            prompt_messages = [
+                {"role": "user", "parts": [instructions], "cache": True},
+                {"role": "user", "parts": [self.arquivo]}
+            ]
+        else:
+            prompt_messages = [
+                {"role": "user", "parts": [self.arquivo]},
+                {"role": "user", "parts": [instructions]}
+            ]
+
+
+        result = self.llm.run_prompt(prompt_messages, json_output=self.structured_output)
         total_tokens = result["token_usage"].total_token_count
         total_time = result["processing_time"]
 
 
-        return {
+        return apply_structured_output(self.llm, result, {
             "final_inspection": result["output"],
             "batch_inspections": result,
             "total_tokens": total_tokens,
             "total_time": total_time
-        }
+        })
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from types import SimpleNamespace
+from .llms import LLMBase
+from .execution import token_usage_to_dict
+
+
+def _digest(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_messages(value):
+    """
+    Converte as mensagens em uma estrutura JSON estável para compor a chave do cache.
+    Imagens em base64 são substituídas pelo seu digest; arquivos enviados (Gemini) por uri/nome.
+    """
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            if key in ("image", "data") and isinstance(item, (str, bytes)):
+                normalized[key] = {"sha256": _digest(item)}
+            else:
+                normalized[key] = normalize_messages(item)
+        return normalized
+    if isinstance(value, (list, tuple)):
+        return [normalize_messages(item) for item in value]
+    if isinstance(value, bytes):
+        return {"sha256": _digest(value)}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    for attribute in ("uri", "name"):
+        identifier = getattr(value, attribute, None)
+        if isinstance(identifier, str):
+            return {"file": identifier}
+    return repr(value)
+
+
+class CachedLLM(LLMBase):
+    def __init__(self, llm, cache_path="./cache/llm_cache.sqlite", max_entries=None, max_bytes=None,
+                 max_age_seconds=None, bypass=False):
+        """
+        Cache persistente (SQLite) de respostas em volta de qualquer LLMBase.
+        A chave é o hash do backend, modelo, configuração de geração e mensagens normalizadas
+        (frames identificados pelo digest).
+
+        :param llm: Instância de LLMBase a ser envolvida.
+        :param cache_path: Caminho do arquivo SQLite.
+        :param max_entries: Número máximo de respostas guardadas (remove as menos acessadas).
+        :param max_bytes: Tamanho máximo (soma das respostas) guardado.
+        :param max_age_seconds: Idade máxima de uma resposta no cache.
+        :param bypass: Se True, ignora o cache (não lê nem grava), ex.: para medir a variância do modelo.
+        """
+        super().__init__(f"Cached{llm.name}")
+        self.llm = llm
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __getattr__(self, attribute):
+        # Repassa atributos do backend (ex.: model, llmmodel, config)
+        llm = self.__dict__.get("llm")
+        if llm is None:
+            raise AttributeError(attribute)
+        return getattr(llm, attribute)
+
+    def text_prompt(self, text):
+        # Definido em LLMBase, não passa por __getattr__: usa o formato do backend envolvido
+        return self.llm.text_prompt(text)
+
+    def cache_key(self, prompt, json_output=False):
+        signature = {
+            "backend": self.llm.name,
+            "model": getattr(self.llm, "model", None) or getattr(self.llm, "llmmodel", None),
+            "config": normalize_messages(getattr(self.llm, "config", None)),
+            "messages": normalize_messages(prompt)
+        }
+        if json_output:
+            signature["json_output"] = True
+        return _digest(json.dumps(signature, sort_keys=True, ensure_ascii=False, default=repr))
+
+    def stats(self):
+        """
+        Contadores de acertos/falhas do cache e quantidade de respostas guardadas.
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.max_age_seconds is not None and now - created_at > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(response)
+
+    def _put(self, key, result):
+        response = json.dumps({
+            "output": result["output"],
+            "token_usage": token_usage_to_dict(result["token_usage"]),
+            "processing_time": result["processing_time"]
+        }, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """
+        Remove respostas expiradas e, se necessário, as menos acessadas até respeitar os limites.
+        """
+        if self.max_age_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _hit_result(self, cached, start_time):
+        # Um acerto não consome tokens: token_usage zerado (com os mesmos campos do backend), e os
+        # contadores da chamada original ficam em original_token_usage
+        usage = cached["token_usage"]
+        return {
+            "output": cached["output"],
+            "token_usage": SimpleNamespace(**{key: 0 for key in usage}),
+            "original_token_usage": SimpleNamespace(**usage),
+            "processing_time": time.time() - start_time,
+            "original_processing_time": cached["processing_time"],
+            "cached": True
+        }
+
+    def run_prompt(self, prompt, json_output=False):
+        """
+        Retorna a resposta do cache se existir; caso contrário chama o backend e guarda a resposta.
+        O resultado tem as mesmas chaves do backend, mais "cached" (True/False). Em um acerto,
+        token_usage vem zerado (nenhum token foi pago), original_token_usage reproduz os contadores
+        da chamada original e processing_time é o tempo da consulta.
+        """
+        if self.bypass:
+            result = self.llm.run_prompt(prompt, json_output=json_output)
+            result["cached"] = False
+            return result
+
+        start_time = time.time()
+        key = self.cache_key(prompt, json_output)
+        cached = self._get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return self._hit_result(cached, start_time)
+
+        with self._lock:
+            self.misses += 1
+        result = self.llm.run_prompt(prompt, json_output=json_output)
+        self._put(key, result)
+        result["cached"] = False
+        return result
+
+    def stream_prompt(self, prompt, json_output=False):
+        """
+        Como LLMBase.stream_prompt, passando pelo cache: em um acerto, entrega a resposta guardada
+        em um único pedaço; senão, repassa o stream do backend e guarda o resultado ao final.
+        """
+        if self.bypass:
+            result = yield from self.llm.stream_prompt(prompt, json_output=json_output)
+            result["cached"] = False
+            return result
+
+        start_time = time.time()
+        key = self.cache_key(prompt, json_output)
+        cached = self._get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            result = self._hit_result(cached, start_time)
+            yield result["output"]
+            return result
+
+        with self._lock:
+            self.misses += 1
+        result = yield from self.llm.stream_prompt(prompt, json_output=json_output)
+        self._put(key, result)
+        result["cached"] = False
+        return result
@@ -1,79 +1,370 @@
+import os
+import json
+import math
 import time
+import asyncio
+import random
+import hashlib
+import datetime
+import threading
+import dataclasses
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 import openai
 import google.generativeai as genai
+from .execution import estimate_prompt_tokens, run_coroutine, token_usage_to_dict
+from .tracing import span, traced
+
+def _llm_span_attributes(current, args, kwargs, result):
+    llm = args[0]
+    usage = token_usage_to_dict(result["token_usage"])
+    current.set(
+        backend=llm.name,
+        model=getattr(llm, "model", None) or getattr(llm, "llmmodel", None),
+        tokens=usage.get("total_tokens", usage.get("total_token_count")),
+        bytes=len(result["output"].encode("utf-8")),
+        retries=result.get("retries"),
+        time_to_first_token=result.get("time_to_first_token")
+    )
 
 class LLMBase:
-    def __init__(self, name):
+    def __init__(self, name, executor=None):
+        """
+        :param name: Nome do backend.
+        :param executor: RequestExecutor opcional (limites de taxa, novas tentativas e timeout).
+        """
         self.name = name
+        self.executor = executor
 
-    def run_prompt(self, prompt):
+    def run_prompt(self, prompt, json_output=False):
+        """
+        :param prompt: Prompt no formato do backend.
+        :param json_output: Se True, pede a resposta no modo JSON/esquema do provedor, quando disponível.
+        """
         raise NotImplementedError("Este método deve ser implementado pela subclasse.")
 
+    def text_prompt(self, text):
+        """
+        Prompt só de texto no formato esperado por run_prompt (ex.: chamadas de reparo).
+        """
+        return text
+
+    def _execute(self, call, prompt):
+        """
+        Executa call(timeout) pela camada de execução (se houver).
+        Retorna (resposta, estatísticas de novas tentativas e esperas, tokens estimados).
+        """
+        with span("llm.request", backend=self.name):
+            if self.executor is None:
+                return call(None), {"retries": 0, "throttle_wait": 0.0, "retry_wait": 0.0}, 0
+            estimated_tokens = estimate_prompt_tokens(prompt)
+            response, stats = self.executor.execute(call, estimated_tokens)
+            return response, stats, estimated_tokens
+
+    def _record_usage(self, estimated_tokens, actual_tokens):
+        if self.executor is not None:
+            self.executor.record_usage(estimated_tokens, actual_tokens)
+
+    def _open_stream(self, prompt, json_output, timeout):
+        """
+        Abre a resposta em streaming do backend. Retorna (iterador de pedaços de texto,
+        função sem argumentos que devolve o token_usage após o fim do stream).
+        """
+        raise NotImplementedError("Streaming não implementado para este backend.")
+
+    def stream_prompt(self, prompt, json_output=False):
+        """
+        Gerador que entrega os pedaços de texto da resposta à medida que chegam.
+        Ao terminar, retorna (StopIteration.value) o mesmo dict de run_prompt, mais
+        time_to_first_token, generation_time e tokens_per_second:
+
+            result = yield from llm.stream_prompt(prompt)
+        """
+        start_time = time.time()
+        (chunks, get_usage), stats, estimated_tokens = self._execute(
+            lambda timeout: self._open_stream(prompt, json_output, timeout), prompt
+        )
+        first_token_time = None
+        parts = []
+        for text in chunks:
+            if not text:
+                continue
+            if first_token_time is None:
+                first_token_time = time.time()
+            parts.append(text)
+            yield text
+        end_time = time.time()
+
+        token_usage = get_usage()
+        usage = token_usage_to_dict(token_usage)
+        self._record_usage(estimated_tokens, usage.get("total_tokens", usage.get("total_token_count")))
+        completion_tokens = usage.get("completion_tokens", usage.get("candidates_token_count"))
+        first_token_time = first_token_time or end_time
+        generation_time = end_time - first_token_time
+        return {
+            "output": "".join(parts).replace("```json", "").replace("```", "").strip(),
+            "token_usage": token_usage,
+            "processing_time": end_time - start_time,
+            "time_to_first_token": first_token_time - start_time,
+            "generation_time": generation_time,
+            "tokens_per_second": completion_tokens / generation_time if completion_tokens and generation_time > 0 else None,
+            "retries": stats["retries"],
+            "throttle_wait": stats["throttle_wait"],
+            "retry_wait": stats["retry_wait"]
+        }
+
+    def run_prompt_streaming(self, prompt, json_output=False, on_text=None):
+        """
+        Consome stream_prompt e retorna o dict de resultado.
+        :param on_text: Função opcional chamada com cada pedaço de texto recebido.
+        """
+        stream = self.stream_prompt(prompt, json_output=json_output)
+        while True:
+            try:
+                text = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            if on_text is not None:
+                on_text(text)
+
 class OpenAI_LLM(LLMBase):
-    def __init__(self, api_key, model="gpt-4"):
+    def __init__(self, api_key, model="gpt-4", executor=None, base_url=None, json_schema=None, stream=False,
+                 prompt_cache_key=None):
         """
         Parâmetros:
           - api_key: Chave da API da OpenAI.
           - model: Nome do modelo (ex.: "gpt-4").
+          - executor: RequestExecutor opcional (limites de taxa, novas tentativas e timeout).
+          - base_url: URL alternativa da API (ex.: servidor local de testes).
+          - json_schema: Esquema usado em run_prompt(..., json_output=True) (structured outputs);
+                         sem esquema, usa o modo JSON simples (json_object).
+          - stream: Se True, run_prompt recebe a resposta em streaming (ver LLMBase.stream_prompt)
+                    e registra time_to_first_token e tokens_per_second.
+          - prompt_cache_key: Chave enviada à API para agrupar requisições com o mesmo prefixo no cache
+                              automático de prompt (ver PromptManager(prefix_cache=True)).
         """
-        super().__init__("OpenAI")
+        super().__init__("OpenAI", executor=executor)
         openai.api_key = api_key
+        if base_url:
+            openai.base_url = base_url
+        # Com executor, as novas tentativas ficam só com ele (limite de taxa, backoff e estatísticas):
+        # o cliente próprio desliga as tentativas internas do SDK (max_retries=2 por padrão)
+        self.client = openai
+        if executor is not None:
+            self.client = openai.OpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
         self.model = model
+        self.json_schema = json_schema
+        self.stream = stream
+        self.prompt_cache_key = prompt_cache_key
+
+    def _messages(self, prompt):
+        if isinstance(prompt, list):
+            return prompt
+        return [{"role": "user", "content": prompt}]
+
+    def _request_options(self, json_output, timeout):
+        options = {"timeout": timeout} if timeout else {}
+        if json_output:
+            options["response_format"] = self.response_format()
+        if self.prompt_cache_key:
+            options["extra_body"] = {"prompt_cache_key": self.prompt_cache_key}
+        return options
+
+    def _open_stream(self, prompt, json_output, timeout):
+        options = self._request_options(json_output, timeout)
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt),
+            stream=True,
+            stream_options={"include_usage": True},
+            **options
+        )
+        usage = {}
+
+        def chunks():
+            for chunk in response:
+                if getattr(chunk, "usage", None) is not None:
+                    usage["value"] = chunk.usage
+                for choice in chunk.choices or []:
+                    yield choice.delta.content or ""
+
+        return chunks(), lambda: usage.get("value")
+
+    def response_format(self):
+        if self.json_schema is not None:
+            return {"type": "json_schema", "json_schema": {"name": "cnae", "schema": self.json_schema}}
+        return {"type": "json_object"}
 
-    def run_prompt(self, prompt):
+    @traced("llm.call", annotate=_llm_span_attributes)
+    def run_prompt(self, prompt, json_output=False):
         """
         Se prompt for uma lista (de mensagens) já está formatado conforme a OpenAI (chat).
         Caso contrário, converte para o formato de lista.
         """
-        if isinstance(prompt, list):
-            messages = prompt
-        else:
-            messages = [{"role": "user", "content": prompt}]
+        if self.stream:
+            return self.run_prompt_streaming(prompt, json_output=json_output)
+        messages = self._messages(prompt)
         
+        def call(timeout):
+            options = self._request_options(json_output, timeout)
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                #temperature=0.0
+                **options
+            )
+
         start_time = time.time()
-        response = openai.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            #temperature=0.0
-        )
+        response, stats, estimated_tokens = self._execute(call, messages)
         end_time = time.time()
 
         output_text = response.choices[0].message.content.replace("```json", "").replace("```", "").strip()
         token_usage = response.usage
+        self._record_usage(estimated_tokens, token_usage.total_tokens)
         return {
             "output": output_text,
             "token_usage": token_usage,
-            "processing_time": end_time - start_time
+            "processing_time": end_time - start_time,
+            "retries": stats["retries"],
+            "throttle_wait": stats["throttle_wait"],
+            "retry_wait": stats["retry_wait"]
         }
 
 class Gemini_LLM(LLMBase):
-    def __init__(self, api_key, llmmodel, config):
-        super().__init__("Gemini")
-        genai.configure(api_key=api_key)
+    def __init__(self, api_key, llmmodel, config, executor=None, client_options=None, transport=None, stream=False,
+                 cache_ttl=None):
+        """
+        :param api_key: Chave da API do Gemini.
+        :param llmmodel: Nome do modelo (ex.: "gemini-1.5-flash").
+        :param config: generation_config do modelo.
+        :param executor: RequestExecutor opcional (limites de taxa, novas tentativas e timeout).
+        :param client_options: Opções do cliente (ex.: {"api_endpoint": ...} para um servidor local de testes).
+        :param transport: Transporte do cliente ('grpc' ou 'rest').
+        :param stream: Se True, run_prompt recebe a resposta em streaming (ver LLMBase.stream_prompt).
+        :param cache_ttl: Validade, em segundos, do cache explícito de contexto. Se informado, o primeiro
+                          conteúdo do prompt marcado com "cache": True (prefixo estático, ver
+                          PromptManager(prefix_cache=True)) é enviado uma vez como CachedContent e
+                          reaproveitado pelas chamadas seguintes até expirar. None = prefixo enviado a cada chamada.
+        """
+        super().__init__("Gemini", executor=executor)
+        options = {}
+        if client_options:
+            options["client_options"] = client_options
+        if transport:
+            options["transport"] = transport
+        genai.configure(api_key=api_key, **options)
         self.config = config
         self.llmmodel = llmmodel
+        self.modelo = None
+        self._model_lock = threading.Lock()
+        self.stream = stream
+        self.cache_ttl = cache_ttl
+        self._cached_models = {}
 
+    def get_model(self):
+        """
+        Retorna o GenerativeModel, criado uma única vez e reutilizado entre chamadas.
+        """
+        with self._model_lock:
+            if self.modelo is None:
+                self.modelo = genai.GenerativeModel(
+                  model_name=self.llmmodel,
+                  generation_config=self.config,
+                )
+            return self.modelo
 
-    def run_prompt(self, prompt):
+    def get_cached_model(self, prefix):
+        """
+        Retorna um GenerativeModel ligado a um CachedContent com o prefixo, criado uma vez por
+        conteúdo (hash) e recriado após cache_ttl. Retorna None se o cache não puder ser criado
+        (ex.: prefixo abaixo do mínimo de tokens do provedor); nesse caso o prefixo vai no prompt.
+        """
+        key = hashlib.sha256(json.dumps(prefix, sort_keys=True, default=repr).encode("utf-8")).hexdigest()
+        with self._model_lock:
+            cached = self._cached_models.get(key)
+            if cached is not None and (cached[0] is None or cached[1] > time.time()):
+                return cached[0]
+            try:
+                from google.generativeai import caching
+                content = caching.CachedContent.create(
+                    model=self.llmmodel,
+                    contents=[prefix],
+                    ttl=datetime.timedelta(seconds=self.cache_ttl)
+                )
+                modelo = genai.GenerativeModel.from_cached_content(cached_content=content,
+                                                                   generation_config=self.config)
+                print(f"Prefixo do prompt em cache como: {content.name}")
+            except Exception as e:
+                print(f"Não foi possível criar o cache de contexto ({type(e).__name__}: {e}); "
+                      "o prefixo será enviado em cada chamada.")
+                modelo = None
+            # Margem de alguns segundos para não usar um cache prestes a expirar
+            self._cached_models[key] = (modelo, time.time() + max(0, self.cache_ttl - 10))
+            return modelo
 
-        start_time = time.time()  
+    def text_prompt(self, text):
+        return [{"role": "user", "parts": [text]}]
 
-        modelo = genai.GenerativeModel(
-          model_name=self.llmmodel,
-          generation_config=self.config,
-        )
+    def json_generation_config(self):
+        """
+        Cópia do generation_config com response_mime_type="application/json", sem alterar self.config.
+        Aceita dict, genai.GenerationConfig (dataclass) ou genai.protos.GenerationConfig.
+        """
+        config = self.config
+        if config is None or isinstance(config, dict):
+            return dict(config or {}, response_mime_type="application/json")
+        if dataclasses.is_dataclass(config):
+            return dataclasses.replace(config, response_mime_type="application/json")
+        config = type(config)(config)
+        config.response_mime_type = "application/json"
+        return config
+
+    def _generate(self, prompt, json_output, timeout, stream=False):
+        # Equivale a start_chat(history=prompt).send_message(...), sem criar uma sessão por chamada
+        contents = list(prompt) + [{"role": "user", "parts": ["INSERT_INPUT_HERE"]}]
+        modelo = None
+        if isinstance(contents[0], dict) and contents[0].get("cache"):
+            prefix = {key: value for key, value in contents[0].items() if key != "cache"}
+            modelo = self.get_cached_model(prefix) if self.cache_ttl else None
+            contents = contents[1:] if modelo is not None else [prefix] + contents[1:]
+        request_options = {"timeout": timeout} if timeout else {}
+        if self.executor is not None:
+            # As novas tentativas ficam com o executor; sem isso o google-api-core refaz por baixo dele
+            request_options["retry"] = None
+        options = {"request_options": request_options} if request_options else {}
+        if json_output:
+            options["generation_config"] = self.json_generation_config()
+        if stream:
+            options["stream"] = True
+        return (modelo or self.get_model()).generate_content(contents, **options)
+
+    def _open_stream(self, prompt, json_output, timeout):
+        response = self._generate(prompt, json_output, timeout, stream=True)
+        return (chunk.text for chunk in response), lambda: response.usage_metadata
 
-        session_chat = modelo.start_chat(history = prompt)      
-        response = session_chat.send_message("INSERT_INPUT_HERE")
+    @traced("llm.call", annotate=_llm_span_attributes)
+    def run_prompt(self, prompt, json_output=False):
+        if self.stream:
+            return self.run_prompt_streaming(prompt, json_output=json_output)
+
+        def call(timeout):
+            return self._generate(prompt, json_output, timeout)
+
+        start_time = time.time()  
+        response, stats, estimated_tokens = self._execute(call, prompt)
         end_time = time.time()
 
         #output_text = response.text
         output_text = response.text.replace("```json", "").replace("```", "").strip()
         token_usage = response.usage_metadata
+        self._record_usage(estimated_tokens, token_usage.total_token_count)
         return {
             "output": output_text,
             "token_usage": response.usage_metadata,
-            "processing_time": end_time - start_time
+            "processing_time": end_time - start_time,
+            "retries": stats["retries"],
+            "throttle_wait": stats["throttle_wait"],
+            "retry_wait": stats["retry_wait"]
         }
 
         return 
@@ -95,19 +386,135 @@ class Gemini_LLM(LLMBase):
         Alguns arquivos precisam ser processados antes de serem utilizados como entrada.
         O status pode ser verificado consultando o campo "state" do arquivo.
         
-        Essa implementação usa um loop de polling simples; em produção, recomenda-se
-        uma abordagem mais sofisticada.
+        Os arquivos são consultados em paralelo, com intervalo de polling adaptativo
+        (ver GeminiUploadManager.wait_active).
+        """
+        GeminiUploadManager(registry_path=None).wait_active(arquivos)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """
+    Hash SHA-256 do conteúdo de um arquivo, lido em blocos.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GeminiUploadManager:
+    def __init__(self, registry_path="./cache/gemini_uploads.json", max_workers=4,
+                 initial_poll=0.5, max_poll=10.0, poll_backoff=2.0, timeout=None):
+        """
+        Gerencia uploads de arquivos para o Gemini: envios concorrentes, reaproveitamento de uploads
+        do mesmo conteúdo (por hash) e espera assíncrona até os arquivos ficarem ativos,
+        com polling que começa curto e aumenta progressivamente.
+
+        :param registry_path: JSON que associa o hash do conteúdo ao arquivo enviado (None = sem reaproveitamento).
+        :param max_workers: Número máximo de uploads simultâneos.
+        :param initial_poll: Primeiro intervalo de polling, em segundos.
+        :param max_poll: Intervalo máximo de polling, em segundos.
+        :param poll_backoff: Fator de aumento do intervalo a cada consulta.
+        :param timeout: Tempo máximo de espera por arquivo, em segundos (None = sem limite).
+        """
+        self.registry_path = registry_path
+        self.max_workers = max_workers
+        self.initial_poll = initial_poll
+        self.max_poll = max_poll
+        self.poll_backoff = poll_backoff
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.registry = {}
+        if registry_path and os.path.exists(registry_path):
+            with open(registry_path, "r") as f:
+                self.registry = json.load(f)
+
+    def _save_registry(self):
+        if not self.registry_path:
+            return
+        directory = os.path.dirname(self.registry_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.registry_path, "w") as f:
+            json.dump(self.registry, f, indent=2)
+
+    def _reuse(self, content_hash):
+        """
+        Retorna o arquivo já enviado com o mesmo conteúdo, se ainda existir no Gemini.
+        """
+        name = self.registry.get(content_hash)
+        if not name:
+            return None
+        try:
+            arquivo = genai.get_file(name)
+        except Exception:
+            return None
+        if arquivo.state.name == "FAILED":
+            return None
+        return arquivo
+
+    def upload(self, caminho, mime_type=None):
+        """
+        Faz o upload de um arquivo, reaproveitando um upload anterior do mesmo conteúdo.
+        """
+        content_hash = file_sha256(caminho) if self.registry_path else None
+        if content_hash:
+            arquivo = self._reuse(content_hash)
+            if arquivo is not None:
+                print(f"Arquivo '{caminho}' já enviado como: {arquivo.uri}")
+                return arquivo
+
+        arquivo = genai.upload_file(caminho, mime_type=mime_type)
+        print(f"Arquivo '{arquivo.display_name}' enviado como: {arquivo.uri}")
+        if content_hash:
+            with self._lock:
+                self.registry[content_hash] = arquivo.name
+                self._save_registry()
+        return arquivo
+
+    def upload_many(self, caminhos, mime_type=None):
+        """
+        Envia vários arquivos em paralelo. Retorna os arquivos na mesma ordem dos caminhos.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda caminho: self.upload(caminho, mime_type=mime_type), caminhos))
+
+    async def wait_file_async(self, nome):
         """
+        Consulta o estado de um arquivo até sair de PROCESSING, com intervalo crescente.
+        """
+        delay = self.initial_poll
+        waited = 0.0
+        arquivo = await asyncio.to_thread(genai.get_file, nome)
+        while arquivo.state.name == "PROCESSING":
+            if self.timeout is not None and waited >= self.timeout:
+                raise TimeoutError(f"O arquivo {nome} não ficou ativo em {self.timeout}s.")
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = min(delay * self.poll_backoff, self.max_poll)
+            arquivo = await asyncio.to_thread(genai.get_file, nome)
+        if arquivo.state.name != "ACTIVE":
+            raise Exception(f"O arquivo {arquivo.name} falhou no processamento.")
+        return arquivo
+
+    async def wait_active_async(self, arquivos):
+        """
+        Aguarda, em paralelo, que todos os arquivos fiquem ativos. Retorna os arquivos atualizados.
+        """
+        return await asyncio.gather(*(self.wait_file_async(arquivo.name) for arquivo in arquivos))
+
+    def wait_active(self, arquivos):
         print("Aguardando o processamento dos arquivos...")
-        for nome in (arquivo.name for arquivo in arquivos):
-            arquivo = genai.get_file(nome)
-            while arquivo.state.name == "PROCESSING":
-                print(".", end="", flush=True)
-                time.sleep(10)
-                arquivo = genai.get_file(nome)
-            if arquivo.state.name != "ACTIVE":
-                raise Exception(f"O arquivo {arquivo.name} falhou no processamento.")
+        ativos = run_coroutine(self.wait_active_async(arquivos))
         print("...todos os arquivos estão prontos\n")
+        return ativos
+
+    def upload_and_wait(self, caminhos, mime_type=None):
+        """
+        Envia os arquivos em paralelo e aguarda até que todos estejam ativos.
+        """
+        return self.wait_active(self.upload_many(caminhos, mime_type=mime_type))
 
 
 class Llama32b_LLM(LLMBase):
@@ -115,10 +522,110 @@ class Llama32b_LLM(LLMBase):
         super().__init__("Llama32b")
         self.config = config
 
-    def run_prompt(self, prompt):
+    @traced("llm.call", annotate=_llm_span_attributes)
+    def run_prompt(self, prompt, json_output=False):
         time.sleep(0.5)
         return {
             "output": "Resposta simulada pelo Llama32b.",
-            "token_usage": {"total_tokens": 120},
+            "token_usage": SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120),
             "processing_time": 0.5
         }
+
+
+class MockAPIError(Exception):
+    def __init__(self, status_code, message="Erro simulado"):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+
+
+class MockLLM(LLMBase):
+    def __init__(self, answers=None, description="Descrição simulada: fachada, balcão e prateleiras com produtos.",
+                 latency_median=0.5, latency_sigma=0.3, time_scale=1.0, error_rate=0.0, error_statuses=(429, 503),
+                 seed=0, provider="openai", executor=None):
+        """
+        Backend local e determinístico para testes e benchmarks sem rede.
+
+        :param answers: Lista de respostas JSON (texto) válidas; a resposta de cada prompt é escolhida
+                        de forma determinística (default = fakes.DEFAULT_ANSWER).
+        :param description: Texto retornado quando o prompt não pede JSON (ex.: descrições do pipeline B).
+        :param latency_median: Mediana da latência simulada, em segundos (distribuição log-normal).
+        :param latency_sigma: Desvio padrão do log da latência (0 = latência fixa).
+        :param time_scale: Fator aplicado à espera real (0 = não dorme, mas reporta a latência simulada).
+        :param error_rate: Probabilidade de cada chamada falhar com um dos error_statuses.
+        :param error_statuses: Códigos HTTP dos erros injetados (429/503 são refeitos pelo RequestExecutor).
+        :param seed: Semente; o mesmo prompt na mesma tentativa sempre tem a mesma latência/erro/resposta.
+        :param provider: 'openai' (token_usage com *_tokens) ou 'gemini' (*_token_count).
+        :param executor: RequestExecutor opcional (limites de taxa, novas tentativas e timeout).
+        """
+        super().__init__("Mock", executor=executor)
+        if answers is None:
+            from .fakes import DEFAULT_ANSWER
+            answers = [DEFAULT_ANSWER]
+        self.answers = list(answers)
+        self.description = description
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.time_scale = time_scale
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.seed = seed
+        self.provider = provider
+        self.model = f"mock-{provider}"
+        self.calls = 0
+        self.errors = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, prompt):
+        digest = hashlib.sha256(json.dumps(prompt, sort_keys=True, default=repr).encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.calls += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}"), digest
+
+    def token_usage(self, prompt_tokens, completion_tokens):
+        if self.provider == "gemini":
+            return SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=completion_tokens,
+                                   total_token_count=prompt_tokens + completion_tokens)
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                               total_tokens=prompt_tokens + completion_tokens)
+
+    def text_prompt(self, text):
+        if self.provider == "gemini":
+            return [{"role": "user", "parts": [text]}]
+        return text
+
+    @traced("llm.call", annotate=_llm_span_attributes)
+    def run_prompt(self, prompt, json_output=False):
+        def call(timeout):
+            rng, digest = self._rng(prompt)
+            latency = self.latency_median * math.exp(rng.gauss(0, self.latency_sigma)) if self.latency_sigma else self.latency_median
+            if timeout and latency > timeout:
+                time.sleep(timeout * self.time_scale)
+                raise TimeoutError(f"Tempo limite simulado ({timeout}s)")
+            time.sleep(latency * self.time_scale)
+            if rng.random() < self.error_rate:
+                with self._lock:
+                    self.errors += 1
+                raise MockAPIError(rng.choice(self.error_statuses))
+            wants_json = json_output or "json" in json.dumps(prompt, default=repr).lower()
+            output = self.answers[int(digest, 16) % len(self.answers)] if wants_json else self.description
+            return output, latency
+
+        start_time = time.time()
+        (output, latency), stats, estimated_tokens = self._execute(call, prompt)
+        end_time = time.time()
+
+        prompt_tokens = max(1, estimate_prompt_tokens(prompt))
+        completion_tokens = max(1, len(output) // 4)
+        self._record_usage(estimated_tokens, prompt_tokens + completion_tokens)
+        return {
+            "output": output,
+            "token_usage": self.token_usage(prompt_tokens, completion_tokens),
+            "processing_time": end_time - start_time if self.time_scale else latency,
+            "simulated_latency": latency,
+            "retries": stats["retries"],
+            "throttle_wait": stats["throttle_wait"],
+            "retry_wait": stats["retry_wait"]
+        }
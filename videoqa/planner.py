@@ -0,0 +1,265 @@
+import math
+from functools import lru_cache
+from .tokens import estimate_image_tokens, resized_dimensions
+from .inspector import frame_count_before, has_frame_indices
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken é opcional; sem ele usamos a aproximação de ~4 caracteres por token
+    tiktoken = None
+
+# Preços por milhão de tokens (USD), no mesmo formato de evaluation.run_costs. Atualize conforme a tabela do provedor.
+MODEL_PRICES = {
+    "gpt-4": {"input": 30.0, "output": 60.0},
+    "gpt-4o": {"input": 2.5, "output": 10.0},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.6},
+    "gemini-1.5-flash": {"input": 0.075, "output": 0.3},
+    "gemini-2.0-flash": {"input": 0.1, "output": 0.4},
+}
+
+# Janela de contexto (tokens de entrada) por modelo
+MODEL_CONTEXT = {
+    "gpt-4": 8192,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gemini-1.5-flash": 1048576,
+    "gemini-2.0-flash": 1048576,
+}
+
+# Tokens por segundo de vídeo no Gemini (258 por frame a 1 fps + 32 de áudio)
+GEMINI_VIDEO_TOKENS_PER_SECOND = 290
+
+# Lado máximo usado pelo PromptManager ao anexar os frames ({"image": ..., "resize": 768})
+PROMPT_IMAGE_SIDE = 768
+
+# Tokens estimados das instruções fixas do prompt do VideoInspectorGemini (sem a lista de CNAEs)
+GEMINI_INSTRUCTION_TOKENS = 400
+
+_ENCODINGS = {}
+
+
+def image_provider(model):
+    """
+    Regra de tiles a usar para o modelo (ver tokens.estimate_image_tokens).
+    """
+    model = (model or "").lower()
+    if model.startswith("gemini"):
+        return "gemini"
+    if "mini" in model:
+        return "openai-mini"
+    return "openai"
+
+
+@lru_cache(maxsize=256)
+def count_text_tokens(text, model=None):
+    """
+    Conta os tokens de um texto com o tokenizer local (tiktoken), se disponível;
+    senão, usa a aproximação de ~4 caracteres por token.
+    """
+    if not text:
+        return 0
+    if tiktoken is None or (model or "").lower().startswith("gemini"):
+        return math.ceil(len(text) / 4)
+    if model not in _ENCODINGS:
+        try:
+            try:
+                _ENCODINGS[model] = tiktoken.encoding_for_model(model)
+            except (KeyError, ValueError):
+                _ENCODINGS[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # O tiktoken baixa o vocabulário na primeira vez; sem rede, volta para a aproximação
+            print(f"Tokenizer indisponível para {model} ({type(e).__name__}); usando ~4 caracteres por token.")
+            _ENCODINGS[model] = None
+    if _ENCODINGS[model] is None:
+        return math.ceil(len(text) / 4)
+    return len(_ENCODINGS[model].encode(text, disallowed_special=()))
+
+
+def _message_text_tokens(messages, model):
+    tokens = 0
+    for message in messages:
+        parts = message["content"] if isinstance(message["content"], list) else [message["content"]]
+        tokens += 4 + sum(count_text_tokens(part, model) for part in parts if isinstance(part, str))
+    return tokens
+
+
+def plan_inspection(inspector, n_frames, width, height, video_time_limit, pipeline="A", model=None,
+                    batch_size=None, prices=None, answer_tokens=400, description_tokens=250,
+                    few_shot_query=None, video_seconds=None, seconds_per_frame=None):
+    """
+    Estima, antes de qualquer chamada, os tokens, o custo e o número de chamadas de uma inspeção.
+
+    :param inspector: VideoInspector (usa prompt_manager e batch_size) ou VideoInspectorGemini (pipeline 'C').
+    :param n_frames: Número de frames extraídos do vídeo.
+    :param width: Largura dos frames codificados (metadata["payload"]["encoded_width"]).
+    :param height: Altura dos frames codificados.
+    :param video_time_limit: Mesmo limite passado aos pipelines.
+    :param pipeline: 'A', 'B' ou 'C' (vídeo completo no Gemini).
+    :param model: Nome do modelo (tokenizer, regra de tiles, preço e janela de contexto).
+    :param batch_size: Substitui inspector.batch_size na simulação.
+    :param prices: Tabela de preços por milhão de tokens (default = MODEL_PRICES).
+    :param answer_tokens: Tokens estimados de cada resposta JSON.
+    :param description_tokens: Tokens estimados da descrição de cada batch (pipeline B).
+    :param few_shot_query: Consulta usada para estimar o bloco de CNAEs recuperados, quando há cnae_index
+                           (ex.: uma resposta típica do primeiro batch no Pipeline A, ou as descrições no B);
+                           default = inspection_prompt.
+    :param video_seconds: Duração do vídeo enviado (pipeline C).
+    :param seconds_per_frame: Segundos de vídeo entre frames (inspector.frame_seconds); se informado,
+                              video_time_limit é aplicado em segundos reais, como nos pipelines com metadata.
+    :return: Dict com calls, prompt_tokens, completion_tokens, total_tokens, cost, max_call_tokens,
+             frames_sent, fits_context e o detalhamento por chamada (per_call).
+    """
+    prompt_manager = inspector.prompt_manager
+    prices = MODEL_PRICES if prices is None else prices
+    per_call = []
+
+    if pipeline.upper() == "C":
+        few_shot = count_text_tokens(prompt_manager.few_shot_cnaes, model)
+        video_tokens = GEMINI_VIDEO_TOKENS_PER_SECOND * (video_seconds or n_frames)
+        per_call.append({"stage": "final", "frames": 0,
+                         "prompt_tokens": few_shot + video_tokens + GEMINI_INSTRUCTION_TOKENS,
+                         "completion_tokens": answer_tokens})
+        frames_sent = 0
+    else:
+        batch_size = batch_size or inspector.batch_size
+        batch_seconds = batch_size * (seconds_per_frame or 1)
+        n_batches = min(math.ceil(n_frames / batch_size), max(1, math.ceil(video_time_limit / batch_seconds)))
+        frames_sent = min(n_frames, n_batches * batch_size)
+        image_width, image_height = resized_dimensions(width, height, PROMPT_IMAGE_SIDE)
+        image_tokens = estimate_image_tokens(image_width, image_height, image_provider(model))
+        batch_output = answer_tokens if pipeline.upper() == "A" else description_tokens
+        query = few_shot_query or prompt_manager.inspection_prompt
+
+        # O texto dos batches só difere no batch_sequence: conta uma vez e soma os tokens das imagens.
+        # Com primeira passada (cnae_index), o primeiro batch leva a tabela completa e os demais, os candidatos.
+        first_tokens = _message_text_tokens(inspector.batch_messages([], 0, pipeline.upper()), model)
+        text_tokens = first_tokens
+        if inspector.uses_first_pass(pipeline.upper()):
+            text_tokens = _message_text_tokens(inspector.batch_messages([], 1, pipeline.upper(), query), model)
+        for batch_sequence in range(n_batches):
+            frames = min(batch_size, frames_sent - batch_sequence * batch_size)
+            per_call.append({
+                "stage": "batch",
+                "frames": frames,
+                "prompt_tokens": (first_tokens if batch_sequence == 0 else text_tokens) + frames * image_tokens,
+                "completion_tokens": batch_output
+            })
+
+        # Consolidação em árvore (reduce_fan_in): cada fusão recebe até fan_in respostas e devolve uma
+        partials = n_batches
+        fan_in = getattr(inspector, "reduce_fan_in", None)
+        merge_tokens = count_text_tokens(prompt_manager.get_merge_prompt("", pipeline=pipeline.upper()), model)
+        while fan_in and fan_in >= 2 and partials > fan_in:
+            groups = [min(fan_in, partials - start) for start in range(0, partials, fan_in)]
+            for size in groups:
+                if size > 1:
+                    per_call.append({"stage": "reduce", "frames": 0,
+                                     "prompt_tokens": merge_tokens + size * batch_output,
+                                     "completion_tokens": batch_output})
+            partials = len(groups)
+
+        # Prompt final: template (com o bloco de CNAEs recuperados para a consulta) + respostas restantes
+        if pipeline.upper() == "A":
+            final_text = prompt_manager.get_rewrite_prompt(query)
+        else:
+            final_text = prompt_manager.get_inspection_prompt(descriptions=query)
+        repeated_query = count_text_tokens(query, model)
+        per_call.append({
+            "stage": "final",
+            "frames": 0,
+            "prompt_tokens": count_text_tokens(final_text, model) - repeated_query + partials * batch_output,
+            "completion_tokens": answer_tokens
+        })
+
+    prompt_tokens = sum(call["prompt_tokens"] for call in per_call)
+    completion_tokens = sum(call["completion_tokens"] for call in per_call)
+    price = prices.get(model, {})
+    cost = None
+    if price:
+        cost = (prompt_tokens * price.get("input", 0) + completion_tokens * price.get("output", 0)) / 1e6
+    max_call_tokens = max(call["prompt_tokens"] for call in per_call)
+    context = MODEL_CONTEXT.get(model)
+
+    return {
+        "pipeline": pipeline.upper(),
+        "batch_size": batch_size if pipeline.upper() != "C" else None,
+        "calls": len(per_call),
+        "frames_sent": frames_sent,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost": cost,
+        "max_call_tokens": max_call_tokens,
+        "fits_context": context is None or max_call_tokens <= context,
+        "per_call": per_call
+    }
+
+
+def plan_from_frames(inspector, base64_frames, metadata, video_time_limit, pipeline="A", model=None, **options):
+    """
+    plan_inspection a partir da saída de extract_base64_frames (frames e metadata).
+    Com frame_indices nos metadados, os frames são cortados em video_time_limit pelo instante real de
+    cada um (índice / fps), como nos pipelines.
+    """
+    payload = metadata.get("payload") or {}
+    width = payload.get("encoded_width", metadata.get("width"))
+    height = payload.get("encoded_height", metadata.get("height"))
+    video_seconds = metadata.get("total_frames", 0) / metadata["fps"] if metadata.get("fps") else None
+    options.setdefault("video_seconds", video_seconds)
+    n_frames = len(base64_frames)
+    if has_frame_indices(metadata) and pipeline.upper() != "C":
+        n_frames = frame_count_before(metadata["frame_indices"][:n_frames], metadata["fps"], video_time_limit)
+        # Frames já cortados no limite: todos são enviados (um segundo por frame, sem seconds_per_frame)
+        options.pop("seconds_per_frame", None)
+        video_time_limit = max(1, n_frames)
+    elif metadata.get("fps") and metadata.get("frame_interval"):
+        options.setdefault("seconds_per_frame", metadata["frame_interval"] / metadata["fps"])
+    return plan_inspection(inspector, n_frames, width, height, video_time_limit,
+                           pipeline=pipeline, model=model, **options)
+
+
+def _fits(plan, budget_tokens, budget_cost, context_window):
+    if budget_tokens is not None and plan["total_tokens"] > budget_tokens:
+        return False
+    if budget_cost is not None and (plan["cost"] is None or plan["cost"] > budget_cost):
+        return False
+    if context_window is not None and plan["max_call_tokens"] > context_window:
+        return False
+    return plan["fits_context"]
+
+
+def fit_batch_size(inspector, n_frames, width, height, video_time_limit, pipeline="A", model=None,
+                   budget_tokens=None, budget_cost=None, context_window=None, max_batch_size=None, **options):
+    """
+    Maior batch_size cujo plano respeita o orçamento de tokens/custo e a janela de contexto por chamada.
+    Retorna o plano escolhido (com batch_size), ou None se nenhum tamanho couber.
+    """
+    for batch_size in range(max_batch_size or max(1, n_frames), 0, -1):
+        plan = plan_inspection(inspector, n_frames, width, height, video_time_limit, pipeline=pipeline,
+                               model=model, batch_size=batch_size, **options)
+        if _fits(plan, budget_tokens, budget_cost, context_window):
+            return plan
+    return None
+
+
+def fit_frame_count(inspector, n_frames, width, height, pipeline="A", model=None, batch_size=None,
+                    budget_tokens=None, budget_cost=None, context_window=None, **options):
+    """
+    Maior número de frames (a usar como max_frames na extração) cujo plano cabe no orçamento,
+    com o batch_size do inspector (ou o informado). Busca binária, pois o custo cresce com os frames.
+    Retorna o plano escolhido (frames_sent = número de frames), ou None se nem 1 frame couber.
+    """
+    best = None
+    low, high = 1, n_frames
+    while low <= high:
+        middle = (low + high) // 2
+        # Sem limite de tempo efetivo: todos os frames candidatos são enviados
+        time_limit = middle * (options.get("seconds_per_frame") or 1)
+        plan = plan_inspection(inspector, middle, width, height, time_limit, pipeline=pipeline, model=model,
+                               batch_size=batch_size, **options)
+        if _fits(plan, budget_tokens, budget_cost, context_window):
+            best = plan
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best
@@ -1,17 +1,66 @@
+from .tracing import traced
+
+# Prompts das etapas intermediárias da consolidação em árvore (VideoInspector com reduce_fan_in).
+# Não incluem a lista de CNAEs: só a consolidação final usa rewrite_prompt/inspection_prompt.
+MERGE_PROMPTS = {
+    "A": (
+        "Você recebeu respostas parciais (em JSON) sobre o CNAE de um mesmo empreendimento, cada uma "
+        "baseada em um trecho diferente do vídeo:\n{inspections}\n\n"
+        "Consolide-as em um único JSON com os mesmos campos, escolhendo o CNAE mais bem sustentado pelas "
+        "respostas. Em \"images\", mantenha exatamente os pares [frame_index, batch_sequence] das respostas "
+        "que justificam o CNAE escolhido (no máximo 10). Responda apenas com o JSON, sem delimitadores de bloco de código."
+    ),
+    "B": (
+        "Você recebeu descrições de trechos consecutivos de um mesmo vídeo:\n{inspections}\n\n"
+        "Resuma-as em uma única descrição, preservando os elementos visuais relevantes para identificar "
+        "a atividade econômica e citando, para cada elemento, os pares [frame_index, batch_sequence] das "
+        "imagens em que ele aparece."
+    )
+}
+
+
+def _messages_span_attributes(span, args, kwargs, messages):
+    images = [part["image"] for part in messages[-1]["content"] if isinstance(part, dict) and "image" in part]
+    span.set(frames=len(images), bytes=sum(len(image) for image in images))
+
 class PromptManager:
-    def __init__(self, dense_prompt, answer_prompt, inspection_prompt, rewrite_prompt, few_shot_cnaes=""):
+    def __init__(self, dense_prompt, answer_prompt, inspection_prompt, rewrite_prompt, few_shot_cnaes="",
+                 cnae_index=None, few_shot_top_k=20, merge_prompt=None, prefix_cache=False):
         """
         :param dense_prompt: Template para gerar descrições de frames.
         :param answer_prompt: Template para prompt de resposta final.
         :param inspection_prompt: Template para o prompt final de inspeção.
         :param rewrite_prompt: Template para reescrever a inspeção (Pipeline B ou pós-batch).
         :param few_shot_cnaes: Texto contendo a lista dos CNAES 2.0 (com descrições e observações) a ser incluído como few shot.
+        :param cnae_index: Instância opcional de CNAEIndex. Se informada, o few shot passa a conter apenas
+                           as top-k subclasses recuperadas a partir das descrições/palpites, em vez da tabela completa.
+        :param few_shot_top_k: Número de subclasses candidatas incluídas quando cnae_index é usado.
+        :param merge_prompt: Template ({inspections}) das consolidações intermediárias; None = MERGE_PROMPTS do pipeline.
+        :param prefix_cache: Se True, os prompts que levam a lista de CNAEs começam por um prefixo estático
+                             byte a byte idêntico em todas as chamadas (get_static_prefix), em uma mensagem
+                             própria, seguido dos dados do batch/vídeo. Assim o prefixo é reaproveitado pelo
+                             cache de prompt automático da OpenAI e pode ir para o cache explícito do Gemini.
         """
         self.dense_prompt = dense_prompt
         self.answer_prompt = answer_prompt
         self.inspection_prompt = inspection_prompt
         self.rewrite_prompt = rewrite_prompt
         self.few_shot_cnaes = few_shot_cnaes
+        self.cnae_index = cnae_index
+        self.few_shot_top_k = few_shot_top_k
+        self.merge_prompt = merge_prompt
+        self.prefix_cache = prefix_cache
+
+    def get_few_shot_context(self, query=None):
+        """
+        Retorna o bloco de CNAEs a ser incluído no prompt.
+        Sem cnae_index, retorna a tabela completa (few_shot_cnaes).
+        Com cnae_index, retorna as subclasses candidatas para a consulta; sem consulta (ex.: o primeiro
+        batch do Pipeline A, cuja resposta serve de consulta para os demais), volta para a tabela completa.
+        """
+        if self.cnae_index is None or not query:
+            return self.few_shot_cnaes
+        return self.cnae_index.format_candidates(query, top_k=self.few_shot_top_k)
 
     def get_dense_prompt(self, frame_base64, frame_seq):
         """
@@ -22,27 +71,88 @@ class PromptManager:
     def get_answer_prompt(self, descriptions):
         return self.answer_prompt.format(descriptions=descriptions)
 
+    def _uses_candidates(self, query):
+        return self.cnae_index is not None and bool(query)
+
+    def get_static_prefix(self, query=None):
+        """
+        Prefixo estático dos prompts no modo prefix_cache: lista de CNAEs e instruções com a máscara JSON
+        (inspection_prompt). Quando há candidatos do cnae_index para a consulta, eles dependem da chamada
+        e ficam fora do prefixo; sem consulta, a tabela completa continua no prefixo (e no cache).
+        """
+        if self._uses_candidates(query):
+            return self.inspection_prompt
+        return f"Lista de CNAES 2.0:\n{self.few_shot_cnaes}\n\n{self.inspection_prompt}"
+
+    def _dynamic_few_shot(self, query):
+        """
+        Parte do few shot que varia por chamada no modo prefix_cache (só os candidatos do cnae_index).
+        """
+        if not self._uses_candidates(query):
+            return []
+        candidates = self.get_few_shot_context(query)
+        return [f"Lista de CNAES 2.0 candidatos:\n{candidates}"] if candidates else []
+
     def get_inspection_prompt(self, descriptions):
         """
         Retorna o prompt de inspeção combinando as descrições dos frames e o few shot dos CNAES.
         Essa função é utilizada no Pipeline B para enviar o prompt consolidado.
         """
         message_parts = [
-            f"Lista de CNAES 2.0:\n{self.few_shot_cnaes}",
+            f"Lista de CNAES 2.0:\n{self.get_few_shot_context(descriptions)}",
             f"Descrições das imagens:\n{descriptions}",
             self.inspection_prompt
         ]
         message_content = "\n\n".join(message_parts)
         return message_content
 
-    def get_inspection_messages(self, base64_frames, batch_sequence, pipeline="A"):
+    def get_rewrite_prompt(self, inspections):
+        """
+        Retorna o prompt de reescrita (consolidação) das respostas parciais.
+        Não inclui lista de CNAEs: os batches já levaram a tabela ou os candidatos.
+        """
+        return self.rewrite_prompt.format(inspections=inspections)
+
+    def get_merge_prompt(self, inspections, pipeline="A"):
+        """
+        Retorna o prompt que funde um grupo de respostas parciais em uma só (consolidação em árvore).
+        """
+        template = self.merge_prompt or MERGE_PROMPTS["A" if pipeline == "A" else "B"]
+        return template.format(inspections=inspections)
+
+    def get_final_inspection_messages(self, descriptions):
+        """
+        Mensagens do prompt final do Pipeline B. No modo prefix_cache, o prefixo estático vem primeiro,
+        em uma mensagem de sistema, e as descrições depois.
+        """
+        if not self.prefix_cache:
+            return [{"role": "user", "content": self.get_inspection_prompt(descriptions=descriptions)}]
+        parts = self._dynamic_few_shot(descriptions) + [f"Descrições das imagens:\n{descriptions}"]
+        return [
+            {"role": "system", "content": self.get_static_prefix(descriptions)},
+            {"role": "user", "content": "\n\n".join(parts)}
+        ]
+
+    @traced("prompt.build", annotate=_messages_span_attributes)
+    def get_inspection_messages(self, base64_frames, batch_sequence, pipeline="A", few_shot_query=None):
         """
         Monta o prompt final para inspeção conforme o manual da OpenAI.
         Retorna lista de mensagens no formato Chat (OpenAI).
+        :param few_shot_query: Texto (descrições ou resposta do primeiro batch) usado para recuperar os
+                               CNAEs candidatos quando cnae_index é usado; sem ele, vai a tabela completa.
         """
+        if self.prefix_cache:
+            # Prefixo estático (idêntico em todos os batches) em uma mensagem própria; depois, os dados do batch
+            instruction = self.get_static_prefix(few_shot_query) if pipeline == 'A' else self.dense_prompt
+            message_content = self._dynamic_few_shot(few_shot_query) if pipeline == 'A' else []
+            message_content.append(f"batch_sequence = {batch_sequence}")
+            message_content += [{"image": frame, "resize": 768} for frame in base64_frames]
+            return [{"role": "system", "content": instruction}, {"role": "user", "content": message_content}]
+
         # Para o Pipeline A, incluímos o few shot dos CNAES no instruction
         if pipeline == 'A':
-            instruction = f"{self.few_shot_cnaes}\n\n{self.inspection_prompt}"
+            few_shot = self.get_few_shot_context(few_shot_query)
+            instruction = f"{few_shot}\n\n{self.inspection_prompt}" if few_shot else self.inspection_prompt
         else:
             # No Pipeline B, o instruction pode ser o dense_prompt
             instruction = self.dense_prompt
@@ -0,0 +1,302 @@
+import os
+import csv
+import time
+import sqlite3
+import threading
+import pandas as pd
+from .analysis import coerce_final_inspection, few_shot_savings_report
+from .evaluation import evaluate_runs
+
+# Esquema das execuções: colunas de experimentos_v2.csv + tempos e divisão de tokens
+RUN_COLUMNS = [
+    ("youtube_url", "TEXT"),
+    ("CNPJ", "TEXT"),
+    ("gt_CNAE", "TEXT"),
+    ("experiment_run", "INTEGER"),
+    ("llmModel", "TEXT"),
+    ("batch_size", "INTEGER"),
+    ("pipeline", "TEXT"),
+    ("runs", "INTEGER"),
+    ("total_tokens", "INTEGER"),
+    ("total_time", "REAL"),
+    ("experiment_time", "REAL"),
+    ("cnae", "TEXT"),
+    ("cnae_divisao", "TEXT"),
+    ("cnae_divisao_descricao", "TEXT"),
+    ("cnae_grupo", "TEXT"),
+    ("cnae_grupo_descricao", "TEXT"),
+    ("cnae_classe", "TEXT"),
+    ("cnae_classe_descricao", "TEXT"),
+    ("cnae_subclasse", "TEXT"),
+    ("cnae_subclasse_descricao", "TEXT"),
+    ("reasoning", "TEXT"),
+    ("useFewshot", "TEXT"),
+    ("wall_time", "REAL"),
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("n_calls", "INTEGER"),
+    ("created_at", "REAL"),
+    ("parse_failures", "INTEGER"),
+    ("repairs", "INTEGER"),
+    ("early_stopped", "INTEGER"),
+    ("batches_sent", "INTEGER"),
+    ("calls_saved", "INTEGER"),
+    ("tokens_saved", "INTEGER"),
+]
+
+CALL_COLUMNS = [
+    ("run_id", "INTEGER"),
+    ("stage", "TEXT"),
+    ("batch_sequence", "INTEGER"),
+    ("processing_time", "REAL"),
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("total_tokens", "INTEGER"),
+    ("retries", "INTEGER"),
+    ("cached", "INTEGER"),
+    ("time_to_first_token", "REAL"),
+    ("tokens_per_second", "REAL"),
+    ("cached_tokens", "INTEGER"),
+]
+
+STAGE_COLUMNS = [
+    ("run_id", "INTEGER"),
+    ("stage", "TEXT"),
+    ("calls", "INTEGER"),
+    ("duration", "REAL"),
+    ("bytes", "INTEGER"),
+    ("tokens", "INTEGER"),
+]
+
+INSPECTION_FIELDS = [
+    "cnae", "cnae_divisao", "cnae_divisao_descricao", "cnae_grupo", "cnae_grupo_descricao",
+    "cnae_classe", "cnae_classe_descricao", "cnae_subclasse", "cnae_subclasse_descricao", "reasoning"
+]
+
+# Expressão SQL que mantém apenas os dígitos de um código CNAE ("47.11-3/01" -> "4711301")
+_DIGITS = "REPLACE(REPLACE(REPLACE(REPLACE(COALESCE({column}, ''), '.', ''), '-', ''), '/', ''), ' ', '')"
+
+
+def _call_tokens(stats):
+    """
+    Divisão de tokens de uma chamada, nos nomes da OpenAI ou do Gemini.
+    """
+    prompt = stats.get("prompt_tokens", stats.get("prompt_token_count"))
+    completion = stats.get("completion_tokens", stats.get("candidates_token_count"))
+    total = stats.get("total_tokens", stats.get("total_token_count"))
+    return prompt, completion, total
+
+
+def _to_float(value):
+    if value in (None, ""):
+        return None
+    return float(str(value).replace(",", "."))
+
+
+class ResultStore:
+    def __init__(self, path="./results/experiments.sqlite"):
+        """
+        Armazena as estatísticas dos experimentos em SQLite, com inserção incremental
+        (sem reler o histórico) e consultas agregadas rápidas.
+
+        Tabelas: runs (uma linha por execução, colunas de experimentos_v2.csv + tempos e tokens),
+        calls (uma linha por chamada à LLM: batches e consolidação final) e stages
+        (detalhamento por etapa de cada execução, a partir dos spans de tracing).
+
+        :param path: Caminho do arquivo SQLite.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in RUN_COLUMNS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in CALL_COLUMNS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS calls ({columns})")
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in STAGE_COLUMNS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS stages ({columns})")
+        # Bancos criados por versões anteriores: acrescenta as colunas novas
+        for table, table_columns in (("runs", RUN_COLUMNS), ("calls", CALL_COLUMNS)):
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, sql_type in table_columns:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS runs_config ON runs (llmModel, pipeline, useFewshot)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS calls_run ON calls (run_id)")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _insert_run(self, row):
+        names = [name for name, _ in RUN_COLUMNS if name in row]
+        placeholders = ", ".join("?" for _ in names)
+        cursor = self._conn.execute(
+            f"INSERT INTO runs ({', '.join(names)}) VALUES ({placeholders})",
+            [row[name] for name in names]
+        )
+        return cursor.lastrowid
+
+    def append(self, experiments_results, llm_model, batch_size, pipeline, runs, youtube_url,
+               useFewshot=False, cnpj=None, gt_cnae=None):
+        """
+        Acrescenta as execuções de run_experiments / run_experimentsGemini, com os tempos
+        e tokens de cada chamada (batch_stats e final_stats, quando disponíveis).
+        Mesmos parâmetros de save_experiment_statistics, mais CNPJ e CNAE correto.
+        Retorna a lista de ids das execuções inseridas.
+        """
+        run_ids = []
+        with self._lock:
+            for run in experiments_results.get("runs", []):
+                final_inspection = coerce_final_inspection(
+                    run.get("final_inspection", "{}"), run.get("experiment_run")
+                )
+                calls = [("batch", stats) for stats in run.get("batch_stats", [])]
+                calls += [("reduce", stats) for stats in run.get("reduce_stats", [])]
+                if run.get("final_stats"):
+                    calls.append(("final", run["final_stats"]))
+                if run.get("repair_stats"):
+                    calls.append(("repair", run["repair_stats"]))
+                tokens = [_call_tokens(stats) for _, stats in calls]
+
+                row = {
+                    "youtube_url": youtube_url,
+                    "CNPJ": None if cnpj is None else str(cnpj),
+                    "gt_CNAE": gt_cnae,
+                    "experiment_run": run.get("experiment_run"),
+                    "llmModel": llm_model,
+                    "batch_size": batch_size,
+                    "pipeline": pipeline,
+                    "runs": runs,
+                    "total_tokens": run.get("total_tokens"),
+                    "total_time": run.get("total_time"),
+                    "experiment_time": run.get("experiment_time"),
+                    "useFewshot": str(useFewshot),
+                    "wall_time": run.get("wall_time"),
+                    "prompt_tokens": sum(t[0] or 0 for t in tokens) if calls else None,
+                    "completion_tokens": sum(t[1] or 0 for t in tokens) if calls else None,
+                    "n_calls": len(calls) if calls else None,
+                    "created_at": time.time(),
+                    "parse_failures": run.get("parse_failures"),
+                    "repairs": run.get("repairs"),
+                    "early_stopped": None if run.get("early_stopped") is None else int(run["early_stopped"]),
+                    "batches_sent": run.get("batches_sent"),
+                    "calls_saved": run.get("calls_saved"),
+                    "tokens_saved": run.get("tokens_saved")
+                }
+                for field in INSPECTION_FIELDS:
+                    value = final_inspection.get(field)
+                    row[field] = None if value is None else str(value)
+                run_id = self._insert_run(row)
+                run_ids.append(run_id)
+
+                names = ", ".join(name for name, _ in CALL_COLUMNS)
+                placeholders = ", ".join("?" for _ in CALL_COLUMNS)
+                self._conn.executemany(
+                    f"INSERT INTO calls ({names}) VALUES ({placeholders})",
+                    [
+                        (run_id, stage, stats.get("batch_sequence"), stats.get("processing_time"),
+                         prompt, completion, total, stats.get("retries"),
+                         None if stats.get("cached") is None else int(bool(stats.get("cached"))),
+                         stats.get("time_to_first_token"), stats.get("tokens_per_second"),
+                         stats.get("cached_tokens"))
+                        for (stage, stats), (prompt, completion, total) in zip(calls, tokens)
+                    ]
+                )
+                self._conn.executemany(
+                    "INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (run_id, stage["stage"], stage["calls"], stage["duration"], stage["bytes"], stage["tokens"])
+                        for stage in run.get("stage_breakdown", [])
+                    ]
+                )
+            self._conn.commit()
+        return run_ids
+
+    def import_csv(self, csv_filename):
+        """
+        Importa um CSV de experimentos já existente (ex.: experimentos_v2.csv, separado por ';'
+        e com vírgula decimal) para o banco. Retorna o número de linhas importadas.
+        """
+        with open(csv_filename, "r", encoding="utf-8-sig", newline="") as f:
+            sample = f.read(4096)
+            f.seek(0)
+            delimiter = ";" if sample.count(";") > sample.count(",") else ","
+            rows = list(csv.DictReader(f, delimiter=delimiter))
+
+        types = dict(RUN_COLUMNS)
+        with self._lock:
+            for row in rows:
+                record = {"created_at": time.time()}
+                for name, value in row.items():
+                    if name not in types or name == "created_at":
+                        continue
+                    if types[name] == "REAL":
+                        value = _to_float(value)
+                    elif types[name] == "INTEGER":
+                        value = None if value in (None, "") else int(_to_float(value))
+                    record[name] = value
+                self._insert_run(record)
+            self._conn.commit()
+        return len(rows)
+
+    def query(self, sql, params=()):
+        """
+        Executa uma consulta SQL e retorna um DataFrame.
+        """
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def to_dataframe(self):
+        return self.query("SELECT * FROM runs ORDER BY id")
+
+    def calls_dataframe(self):
+        return self.query("SELECT * FROM calls ORDER BY run_id, stage, batch_sequence")
+
+    def stages_dataframe(self):
+        return self.query("SELECT * FROM stages ORDER BY run_id")
+
+    def performance_metrics(self):
+        """
+        Agregados por llmModel/pipeline/useFewshot, no formato de performance_metrics.csv:
+        taxas de acerto (completo, divisão, grupo, classe), tempo e tokens médios e totais.
+        """
+        predicted = _DIGITS.format(column="cnae")
+        expected = _DIGITS.format(column="gt_CNAE")
+
+        def hit_rate(length):
+            if length is None:
+                return f"100.0 * AVG({predicted} = {expected})"
+            return f"100.0 * AVG(SUBSTR({predicted}, 1, {length}) = SUBSTR({expected}, 1, {length}))"
+
+        return self.query(f"""
+            SELECT llmModel, pipeline, useFewshot,
+                   COUNT(*) AS n_experimentos,
+                   {hit_rate(None)} AS acerto_full_rate,
+                   {hit_rate(2)} AS acerto_divisao_rate,
+                   {hit_rate(3)} AS acerto_grupo_rate,
+                   {hit_rate(5)} AS acerto_classe_rate,
+                   AVG(total_time) AS tempo_medio,
+                   AVG(total_tokens) AS tokens_medios,
+                   SUM(total_time) AS tempo_total,
+                   SUM(total_tokens) AS tokens_totais
+            FROM runs
+            GROUP BY llmModel, pipeline, useFewshot
+            ORDER BY llmModel, pipeline, useFewshot
+        """)
+
+    def few_shot_savings(self, baseline="True"):
+        """
+        Economia de tokens e variação de acerto de cada modo de few shot (ex.: "retrieval") em relação
+        ao baseline (analysis.few_shot_savings_report), sobre todas as execuções.
+        """
+        return few_shot_savings_report(self.to_dataframe(), baseline=baseline)
+
+    def evaluation(self, prices=None, group_by=("llmModel", "pipeline", "useFewshot")):
+        """
+        Métricas hierárquicas vetorizadas (evaluation.evaluate_runs) sobre todas as execuções:
+        acertos por nível, percentis de latência e tokens/custo por resposta correta.
+        """
+        return evaluate_runs(self.to_dataframe(), group_by=group_by, prices=prices)
@@ -0,0 +1,247 @@
+import os
+import csv
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .download import download_video_yt_dlp
+from .inspector import VideoProcessor, VideoInspector, VideoInspectorGemini
+from .analysis import run_experiments, run_experimentsGemini
+from .utils import save_experiment_statistics
+
+# Campos numéricos/booleanos do manifesto de jobs
+INT_FIELDS = ("batch_size", "runs", "video_time_limit", "frame_interval", "early_stop_window", "reduce_fan_in")
+BOOL_FIELDS = ("useFewshot", "structured_output", "prefix_cache")
+
+# Modos de few shot além de True/False (useFewshot="retrieval": CNAEs candidatos recuperados pelo CNAEIndex)
+FEW_SHOT_MODES = ("retrieval",)
+
+
+def _coerce_job(job):
+    """
+    Converte os campos lidos do manifesto (texto) para os tipos esperados.
+    """
+    job = {key: value for key, value in job.items() if value not in (None, "")}
+    for field in INT_FIELDS:
+        if field in job:
+            job[field] = int(float(job[field]))
+    for field in BOOL_FIELDS:
+        if field in job and isinstance(job[field], str):
+            value = job[field].strip().lower()
+            if field == "useFewshot" and value in FEW_SHOT_MODES:
+                job[field] = value
+            else:
+                job[field] = value in ("true", "1", "sim", "yes")
+    return job
+
+
+def load_job_manifest(path):
+    """
+    Lê o manifesto de jobs em CSV (separado por ';' ou ',') ou JSONL.
+    Cada job tem youtube_url, CNPJ, gt_CNAE e as configurações (llmModel, batch_size, pipeline,
+    runs, useFewshot, video_time_limit, frame_interval, early_stop_level, early_stop_window,
+    reduce_fan_in, prefix_cache...).
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [_coerce_job(json.loads(line)) for line in f if line.strip()]
+
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = ";" if sample.count(";") > sample.count(",") else ","
+        return [_coerce_job(row) for row in csv.DictReader(f, delimiter=delimiter)]
+
+
+def job_id(job):
+    """
+    Identificador estável de um job, a partir de todas as suas configurações.
+    """
+    return hashlib.sha1(json.dumps(job, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def video_filename(youtube_url):
+    return hashlib.sha1(youtube_url.encode("utf-8")).hexdigest()[:16] + ".mp4"
+
+
+class ExperimentRunner:
+    def __init__(self, llm_factory, prompt_manager_factory, download_dir="./downloads",
+                 results_csv="experiment_statistics.csv", state_path="./cache/runner_state.jsonl",
+                 max_workers=4, video_time_limit=30, upload_manager=None, result_store=None,
+                 cnae_hierarchy=None, download_options=None):
+        """
+        Executa um manifesto de jobs (vídeos x modelos x configurações) com concorrência limitada.
+        O download e a extração de frames de um mesmo vídeo são compartilhados entre os jobs,
+        e cada job concluído é registrado em state_path para que uma varredura interrompida
+        possa ser retomada sem refazer chamadas já pagas.
+
+        :param llm_factory: Função job -> instância de LLMBase.
+        :param prompt_manager_factory: Função job -> instância de PromptManager.
+        :param download_dir: Diretório dos vídeos baixados.
+        :param results_csv: CSV onde as estatísticas são salvas (save_experiment_statistics).
+        :param state_path: Arquivo JSONL com os jobs concluídos.
+        :param max_workers: Número máximo de jobs executados simultaneamente.
+        :param video_time_limit: Limite de tempo padrão, se o job não informar.
+        :param upload_manager: GeminiUploadManager usado nos jobs do pipeline 'C' (vídeo completo no Gemini).
+        :param result_store: ResultStore opcional; se informado, as estatísticas (com CNPJ, gt_CNAE e
+                             tempos/tokens por chamada) são gravadas nele em vez de results_csv.
+        :param cnae_hierarchy: CNAEHierarchy opcional para validar/reparar o CNAE das respostas.
+        :param download_options: Opções repassadas a download_video_yt_dlp (ex.: {"max_duration": 60,
+                                 "max_height": 720}) para baixar só o trecho e a resolução usados.
+        """
+        self.llm_factory = llm_factory
+        self.prompt_manager_factory = prompt_manager_factory
+        self.download_dir = download_dir
+        self.results_csv = results_csv
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.video_time_limit = video_time_limit
+        self.upload_manager = upload_manager
+        self.result_store = result_store
+        self.cnae_hierarchy = cnae_hierarchy
+        self.download_options = download_options or {}
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._videos = {}
+        self._frames = {}
+        self._uploads = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _shared(self, cache, key, producer):
+        """
+        Produz o recurso uma única vez por chave, mesmo com vários jobs pedindo ao mesmo tempo.
+        """
+        with self._key_lock(key):
+            if key not in cache:
+                cache[key] = producer()
+            return cache[key]
+
+    def get_video(self, youtube_url):
+        return self._shared(
+            self._videos, ("video", youtube_url, tuple(sorted(self.download_options.items()))),
+            lambda: download_video_yt_dlp(youtube_url, self.download_dir, filename=video_filename(youtube_url),
+                                          **self.download_options)
+        )
+
+    def get_frames(self, youtube_url, frame_interval=None):
+        video_path = self.get_video(youtube_url)
+        return self._shared(
+            self._frames, ("frames", youtube_url, frame_interval),
+            lambda: VideoProcessor(video_path).process_video(frame_interval=frame_interval)
+        )
+
+    def get_upload(self, youtube_url):
+        if self.upload_manager is None:
+            raise ValueError("Jobs do pipeline 'C' exigem um upload_manager (GeminiUploadManager) no ExperimentRunner.")
+        video_path = self.get_video(youtube_url)
+        return self._shared(
+            self._uploads, ("upload", youtube_url),
+            lambda: self.upload_manager.upload_and_wait([video_path])[0]
+        )
+
+    def completed_jobs(self):
+        """
+        Retorna o conjunto de ids dos jobs já concluídos (lidos de state_path).
+        """
+        if not os.path.exists(self.state_path):
+            return set()
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return {json.loads(line)["job_id"] for line in f if line.strip()}
+
+    def _mark_completed(self, job, experiments_results):
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        record = {
+            "job_id": job_id(job),
+            "job": job,
+            "avg_time": experiments_results["avg_time"],
+            "runs": [
+                {key: run.get(key) for key in ("experiment_run", "total_tokens", "total_time", "experiment_time",
+                                               "final_inspection", "parse_failures", "repairs",
+                                               "early_stopped", "calls_saved", "tokens_saved")}
+                for run in experiments_results["runs"]
+            ]
+        }
+        with self._lock:
+            with open(self.state_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def run_job(self, job):
+        """
+        Executa um job: prepara o vídeo (compartilhado), roda as repetições e salva as estatísticas.
+        """
+        pipeline = job.get("pipeline", "A").upper()
+        runs = job.get("runs", 1)
+        llm = self.llm_factory(job)
+        prompt_manager = self.prompt_manager_factory(job)
+
+        if pipeline == "C":
+            arquivo = self.get_upload(job["youtube_url"])
+            inspector = VideoInspectorGemini(llm, arquivo, prompt_manager,
+                                             structured_output=job.get("structured_output", False))
+            if job.get("gt_CNAE"):
+                inspector.register_correct_cnae(job["gt_CNAE"])
+            experiments_results = run_experimentsGemini(inspector, runs=runs, cnae_hierarchy=self.cnae_hierarchy)
+        else:
+            frames, metadata = self.get_frames(job["youtube_url"], job.get("frame_interval"))
+            inspector = VideoInspector(llm, prompt_manager, batch_size=job.get("batch_size", 20),
+                                       structured_output=job.get("structured_output", False),
+                                       early_stop_level=job.get("early_stop_level"),
+                                       early_stop_window=job.get("early_stop_window", 2),
+                                       reduce_fan_in=job.get("reduce_fan_in"))
+            if job.get("gt_CNAE"):
+                inspector.register_correct_cnae(job["gt_CNAE"])
+            experiments_results = run_experiments(
+                inspector, frames, job.get("video_time_limit", self.video_time_limit),
+                pipeline=pipeline, runs=runs, cnae_hierarchy=self.cnae_hierarchy, metadata=metadata
+            )
+
+        if self.result_store is not None:
+            self.result_store.append(
+                experiments_results, job.get("llmModel"), job.get("batch_size"), pipeline, runs,
+                job["youtube_url"], useFewshot=job.get("useFewshot", False),
+                cnpj=job.get("CNPJ"), gt_cnae=job.get("gt_CNAE")
+            )
+        else:
+            with self._lock:
+                save_experiment_statistics(
+                    experiments_results, self.results_csv, job.get("llmModel"), job.get("batch_size"),
+                    pipeline, runs, job["youtube_url"], useFewshot=job.get("useFewshot", False),
+                    return_dataframe=False
+                )
+        self._mark_completed(job, experiments_results)
+        return experiments_results
+
+    def run(self, jobs):
+        """
+        Executa os jobs ainda não concluídos, com no máximo max_workers em paralelo.
+        Falhas em um job não interrompem os demais; são retornadas ao final.
+
+        :param jobs: Lista de jobs ou caminho de um manifesto (CSV/JSONL).
+        :return: Dict com os resultados por job_id e os erros por job_id.
+        """
+        if isinstance(jobs, str):
+            jobs = load_job_manifest(jobs)
+
+        done = self.completed_jobs()
+        pending = [job for job in jobs if job_id(job) not in done]
+        print(f"{len(jobs)} jobs no manifesto, {len(jobs) - len(pending)} já concluídos, {len(pending)} a executar.")
+
+        results, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.run_job, job): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    results[job_id(job)] = future.result()
+                    print(f"Job {job_id(job)} concluído ({job['youtube_url']}, {job.get('llmModel')}, pipeline {job.get('pipeline', 'A')}).")
+                except Exception as e:
+                    errors[job_id(job)] = e
+                    print(f"Job {job_id(job)} falhou: {e}")
+
+        return {"results": results, "errors": errors}
@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+
+
+def decode_thumbnails(jpeg_frames, size=(64, 36)):
+    """
+    Decodifica os JPEGs em resolução reduzida (1/8) e redimensiona para miniaturas BGR de mesmo tamanho.
+    Retorna array (N, altura, largura, 3).
+    """
+    thumbnails = []
+    for jpeg_bytes in jpeg_frames:
+        image = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_REDUCED_COLOR_8)
+        if image is None:
+            image = np.zeros((size[1], size[0], 3), np.uint8)
+        elif image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        thumbnails.append(cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+    return np.stack(thumbnails) if thumbnails else np.zeros((0, size[1], size[0], 3), np.uint8)
+
+
+def difference_hashes(thumbnails):
+    """
+    Hash perceptual (dHash de 64 bits) de cada miniatura, como array booleano (N, 64).
+    """
+    gray = thumbnails.astype(np.float32) @ np.array([0.114, 0.587, 0.299], np.float32)
+    n = gray.shape[0]
+    # Reduz para 9x8 por média de blocos (vetorizado sobre todos os frames)
+    rows = np.array_split(np.arange(gray.shape[1]), 8)
+    cols = np.array_split(np.arange(gray.shape[2]), 9)
+    small = np.empty((n, 8, 9), np.float32)
+    for r, row_idx in enumerate(rows):
+        band = gray[:, row_idx, :].mean(axis=1)
+        for c, col_idx in enumerate(cols):
+            small[:, r, c] = band[:, col_idx].mean(axis=1)
+    return (small[:, :, 1:] > small[:, :, :-1]).reshape(n, 64)
+
+
+def color_histograms(thumbnails, bins=(8, 4, 4)):
+    """
+    Histograma HSV normalizado de cada miniatura, como array (N, bins_h * bins_s * bins_v).
+    """
+    n = thumbnails.shape[0]
+    n_bins = bins[0] * bins[1] * bins[2]
+    if n == 0:
+        return np.zeros((0, n_bins), np.float32)
+    hsv = cv2.cvtColor(thumbnails.reshape(-1, thumbnails.shape[2], 3), cv2.COLOR_BGR2HSV)
+    hsv = hsv.reshape(n, -1, 3).astype(np.int32)
+    h = hsv[..., 0] * bins[0] // 180
+    s = hsv[..., 1] * bins[1] // 256
+    v = hsv[..., 2] * bins[2] // 256
+    codes = (h * bins[1] + s) * bins[2] + v + np.arange(n)[:, None] * n_bins
+    counts = np.bincount(codes.ravel(), minlength=n * n_bins).reshape(n, n_bins).astype(np.float32)
+    return counts / counts.sum(axis=1, keepdims=True)
+
+
+class FrameSelector:
+    def __init__(self, hash_threshold=6, hist_threshold=0.25, max_frames=None):
+        """
+        Seleciona frames descartando quase-duplicatas e priorizando mudanças de cena.
+
+        Um frame é mantido se diferir do último frame mantido em mais de hash_threshold bits do dHash
+        ou em mais de hist_threshold na distância entre histogramas de cor (0 a 1).
+        Se sobrarem mais de max_frames, ficam os de maior mudança de cena em relação ao frame anterior.
+
+        :param hash_threshold: Distância de Hamming mínima (0 a 64) para considerar o frame diferente.
+        :param hist_threshold: Distância de histograma mínima (0 a 1) para considerar o frame diferente.
+        :param max_frames: Orçamento máximo de frames mantidos (None = sem limite).
+        """
+        self.hash_threshold = hash_threshold
+        self.hist_threshold = hist_threshold
+        self.max_frames = max_frames
+
+    def settings(self):
+        return {
+            "hash_threshold": self.hash_threshold,
+            "hist_threshold": self.hist_threshold,
+            "max_frames": self.max_frames
+        }
+
+    def select_positions(self, jpeg_frames):
+        """
+        Retorna as posições (na lista recebida) dos frames mantidos, em ordem.
+        """
+        n = len(jpeg_frames)
+        if n == 0:
+            return []
+
+        thumbnails = decode_thumbnails(jpeg_frames)
+        hashes = difference_hashes(thumbnails)
+        histograms = color_histograms(thumbnails)
+
+        # Mudança de cena de cada frame em relação ao frame amostrado anterior
+        scene_scores = np.empty(n, np.float32)
+        scene_scores[0] = np.inf
+        scene_scores[1:] = 0.5 * np.abs(histograms[1:] - histograms[:-1]).sum(axis=1)
+
+        kept = [0]
+        last = 0
+        for i in range(1, n):
+            hamming = np.count_nonzero(hashes[i] != hashes[last])
+            hist_distance = 0.5 * np.abs(histograms[i] - histograms[last]).sum()
+            if hamming > self.hash_threshold or hist_distance > self.hist_threshold:
+                kept.append(i)
+                last = i
+
+        if self.max_frames is not None and len(kept) > self.max_frames:
+            kept = np.array(kept)
+            order = np.argsort(-scene_scores[kept], kind="stable")[:self.max_frames]
+            kept = sorted(kept[order].tolist())
+
+        return kept
+
+    def select(self, encoded_frames):
+        """
+        Filtra uma sequência de (frame_index, jpeg_bytes), mantendo o índice original de cada frame.
+        """
+        encoded_frames = list(encoded_frames)
+        positions = self.select_positions([jpeg_bytes for _, jpeg_bytes in encoded_frames])
+        return [encoded_frames[position] for position in positions]
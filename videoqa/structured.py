@@ -0,0 +1,123 @@
+import re
+import json
+from .tracing import current_span, traced
+
+# Esquema JSON da resposta final (modo de saída estruturada da OpenAI)
+CNAE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cnae": {"type": "string"},
+        "cnae_divisao": {"type": "string"},
+        "cnae_divisao_descricao": {"type": "string"},
+        "cnae_grupo": {"type": "string"},
+        "cnae_grupo_descricao": {"type": "string"},
+        "cnae_classe": {"type": "string"},
+        "cnae_classe_descricao": {"type": "string"},
+        "cnae_subclasse": {"type": "string"},
+        "cnae_subclasse_descricao": {"type": "string"},
+        "reasoning": {"type": "string"},
+        "images": {"type": "array", "items": {"type": "array", "items": {"type": "integer"}}}
+    },
+    "required": ["cnae", "reasoning"]
+}
+
+REPAIR_PROMPT = (
+    "O texto abaixo deveria ser um único objeto JSON com o CNAE (campos cnae, cnae_divisao, "
+    "cnae_divisao_descricao, cnae_grupo, cnae_grupo_descricao, cnae_classe, cnae_classe_descricao, "
+    "cnae_subclasse, cnae_subclasse_descricao, reasoning e images), mas não pôde ser interpretado. "
+    "Reescreva-o como JSON válido, sem delimitadores de bloco de código e sem alterar o conteúdo.\n\n"
+    "Texto:\n{text}"
+)
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def strip_code_fences(text):
+    return _FENCE.sub("", text or "").strip()
+
+
+def _balanced_objects(text):
+    """
+    Gera os trechos de text que formam objetos {...} balanceados, ignorando chaves dentro de strings.
+    """
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = position
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield text[start:position + 1]
+
+
+def extract_json_object(text):
+    """
+    Extrai o primeiro objeto JSON de uma resposta da LLM: aceita delimitadores de bloco de código,
+    texto antes/depois do objeto e vírgulas sobrando antes de '}' ou ']'.
+    Retorna um dict, ou None se nenhum objeto válido for encontrado.
+    """
+    if isinstance(text, dict):
+        return text
+    text = strip_code_fences(text)
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data
+        if isinstance(data, list) and data and isinstance(data[0], dict):
+            return data[0]
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    for candidate in _balanced_objects(text):
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                data = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return data
+    return None
+
+
+@traced("parse")
+def parse_structured_output(llm, result):
+    """
+    Interpreta a resposta final (result de run_prompt) como JSON. Se falhar, faz uma única chamada
+    de reparo, só com texto (sem imagens), pedindo que a LLM reescreva a resposta como JSON válido.
+
+    :param llm: Instância de LLMBase usada no reparo.
+    :param result: Dict retornado por run_prompt.
+    :return: (dict interpretado ou {}, estatísticas com parse_failures, repairs e repair_result).
+    """
+    stats = {"parse_failures": 0, "repairs": 0, "repair_result": None}
+    current_span().set(bytes=len(result["output"].encode("utf-8")))
+    data = extract_json_object(result["output"])
+    if data is not None:
+        return data, stats
+
+    stats["parse_failures"] += 1
+    print("Resposta final não é um JSON válido; solicitando reparo...")
+    repair_result = llm.run_prompt(llm.text_prompt(REPAIR_PROMPT.format(text=result["output"])), json_output=True)
+    stats["repair_result"] = repair_result
+    data = extract_json_object(repair_result["output"])
+    if data is None:
+        stats["parse_failures"] += 1
+        return {}, stats
+    stats["repairs"] += 1
+    return data, stats
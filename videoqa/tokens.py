@@ -0,0 +1,59 @@
+import math
+
+# Providers suportados na estimativa de tokens de imagem
+IMAGE_TOKEN_PROVIDERS = ("openai", "openai-mini", "gemini")
+
+
+def resized_dimensions(width, height, max_side=None):
+    """
+    Dimensões do frame após o redimensionamento pelo maior lado (sem ampliar).
+    """
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def _openai_tiles(width, height):
+    """
+    Regra de tiles da OpenAI (detail=high): cabe em 2048x2048, lado menor reduzido
+    para 768 e contagem de blocos de 512x512.
+    """
+    if max(width, height) > 2048:
+        scale = 2048 / max(width, height)
+        width, height = width * scale, height * scale
+    if min(width, height) > 768:
+        scale = 768 / min(width, height)
+        width, height = width * scale, height * scale
+    return math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_image_tokens(width, height, provider="openai", detail="high"):
+    """
+    Estima os tokens cobrados por uma imagem de width x height pixels.
+
+    :param provider: 'openai' (gpt-4o), 'openai-mini' (gpt-4o-mini) ou 'gemini'.
+    :param detail: 'high' ou 'low' (apenas OpenAI).
+    """
+    if provider == "openai":
+        base, per_tile = 85, 170
+    elif provider == "openai-mini":
+        base, per_tile = 2833, 5667
+    elif provider == "gemini":
+        # Imagens pequenas custam 258 tokens; maiores são divididas em blocos de 768x768
+        if max(width, height) <= 384:
+            return 258
+        return math.ceil(width / 768) * math.ceil(height / 768) * 258
+    else:
+        raise ValueError(f"provider deve ser um de {IMAGE_TOKEN_PROVIDERS}")
+
+    if detail == "low":
+        return base
+    return base + per_tile * _openai_tiles(width, height)
+
+
+def image_token_estimates(width, height):
+    """
+    Estimativa de tokens por imagem para cada provider suportado.
+    """
+    return {provider: estimate_image_tokens(width, height, provider) for provider in IMAGE_TOKEN_PROVIDERS}
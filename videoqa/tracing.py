@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Span ativo na thread/tarefa atual (spans aninhados formam uma árvore por trace)
+_current = contextvars.ContextVar("videoqa_current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes=None):
+        """
+        Intervalo de tempo de uma etapa (download, extração, prompt, chamada à LLM...),
+        com atributos como bytes e tokens.
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def add(self, **amounts):
+        """
+        Soma valores aos atributos (ex.: bytes, tempo de decodificação acumulado por frame).
+        """
+        with self._lock:
+            for key, value in amounts.items():
+                if value is not None:
+                    self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "attributes": self.attributes
+        }
+
+
+class _NullSpan(Span):
+    def __init__(self):
+        super().__init__("", None, None)
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, **amounts):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self, path=None, max_spans=100000, enabled=True):
+        """
+        Coleta os spans finalizados em memória e, opcionalmente, grava cada um em um arquivo JSON lines.
+
+        :param path: Arquivo JSONL onde cada span é acrescentado ao terminar (None = só em memória).
+        :param max_spans: Número máximo de spans mantidos em memória (os mais antigos são descartados).
+        :param enabled: Se False, nenhum span é registrado.
+        """
+        self.path = path
+        self.enabled = enabled
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def trace_spans(self, trace_id):
+        with self._lock:
+            return [span for span in self.spans if span.trace_id == trace_id]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def export_jsonl(self, path, spans=None):
+        spans = list(self.spans) if spans is None else spans
+        with open(path, "w", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def export_otlp(self, path, spans=None, service_name="videoqa"):
+        """
+        Exporta os spans no formato OTLP/JSON do OpenTelemetry (importável por coletores e Jaeger).
+        """
+        spans = list(self.spans) if spans is None else spans
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(otlp_payload(spans, service_name), f, ensure_ascii=False)
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+    Substitui o tracer global (ex.: Tracer(path="./traces/spans.jsonl") para gravar os spans em disco).
+    """
+    global _tracer
+    _tracer = tracer
+    return tracer
+
+
+def current_span():
+    """
+    Span ativo no contexto atual, ou um span nulo (que ignora atributos) se não houver.
+    """
+    return _current.get() or NULL_SPAN
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Abre um span filho do span ativo (ou a raiz de um novo trace):
+
+        with span("download", url=url) as s:
+            ...
+            s.set(bytes=tamanho)
+    """
+    tracer = get_tracer()
+    if not tracer.enabled:
+        yield NULL_SPAN
+        return
+    parent = _current.get()
+    current = Span(name, parent.trace_id if parent else os.urandom(16).hex(),
+                   parent.span_id if parent else None, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        current.finish()
+        tracer.record(current)
+
+
+def traced(name, annotate=None):
+    """
+    Decorador que executa a função dentro de um span.
+    :param annotate: Função opcional (span, args, kwargs, resultado) que acrescenta atributos ao span.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = function(*args, **kwargs)
+                if annotate is not None:
+                    annotate(current, args, kwargs, result)
+                return result
+        return wrapper
+    return decorator
+
+
+def bind_context(function):
+    """
+    Associa function ao span ativo no momento da chamada de bind_context, para que os spans
+    criados por ela em outra thread (ex.: ThreadPoolExecutor) fiquem aninhados no trace atual.
+    """
+    parent = _current.get()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans, service_name="videoqa"):
+    """
+    Converte spans para o payload OTLP/JSON (resourceSpans > scopeSpans > spans).
+    """
+    otlp_spans = []
+    for item in spans:
+        start = int(item.start_time * 1e9)
+        otlp_span = {
+            "traceId": item.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int((item.duration or 0) * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in item.attributes.items()]
+        }
+        if item.parent_id:
+            otlp_span["parentSpanId"] = item.parent_id
+        if "error" in item.attributes:
+            otlp_span["status"] = {"code": 2, "message": item.attributes["error"]}
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "videoqa"}, "spans": otlp_spans}]
+        }]
+    }
+
+
+def stage_breakdown(spans):
+    """
+    Resume os spans de um trace por etapa: número de ocorrências, tempo total (s),
+    bytes, tokens e tempos parciais (*_time) somados. Retorna uma lista de dicts, na ordem em que as etapas começaram.
+    """
+    stages = {}
+    for item in sorted(spans, key=lambda s: s.start_time):
+        stage = stages.setdefault(item.name, {"stage": item.name, "calls": 0, "duration": 0.0, "bytes": 0, "tokens": 0})
+        stage["calls"] += 1
+        stage["duration"] += item.duration or 0.0
+        stage["bytes"] += item.attributes.get("bytes", 0) or 0
+        stage["tokens"] += item.attributes.get("tokens", 0) or 0
+        # Tempos parciais acumulados no span (ex.: decode_time, encode_time, base64_time)
+        for key, value in item.attributes.items():
+            if key.endswith("_time") and isinstance(value, (int, float)):
+                stage[key] = stage.get(key, 0.0) + value
+    return list(stages.values())
@@ -11,10 +11,12 @@ def format_text(text, width=80):
     """
     return textwrap.fill(text, width=width)
 
-def show_inspection_images(llm_response, video_frames, frames_per_batch):
+def show_inspection_images(llm_response, video_frames, frames_per_batch, frame_indices=None):
     """
     Exibe as imagens relevantes indicadas na resposta da LLM.
     Formato esperado em llm_response["images"]: [[frame_index, batch_sequence], ...]
+    :param frame_indices: Índices originais dos frames no vídeo (metadata["frame_indices"]), opcional.
+                          Útil quando frames foram descartados pela seleção de frames.
     """
     imagens = llm_response.get("images", [])
     if not imagens:
@@ -26,6 +28,8 @@ def show_inspection_images(llm_response, video_frames, frames_per_batch):
             frame_index, batch_sequence = pair
             global_index = batch_sequence * frames_per_batch + frame_index
             if 0 <= global_index < len(video_frames):
+                if frame_indices is not None:
+                    print(f"Frame {frame_indices[global_index]} do vídeo (batch {batch_sequence}, posição {frame_index})")
                 frame_base64 = video_frames[global_index]
                 img_bytes = base64.b64decode(frame_base64)
                 display(Image(data=img_bytes))
@@ -36,14 +40,17 @@ def show_inspection_images(llm_response, video_frames, frames_per_batch):
 
 import os
 import csv
-import json
 import pandas as pd
+from .analysis import coerce_final_inspection
 
 def save_experiment_statistics(experiments_results, csv_filename, 
-                               llm_model, batch_size, pipeline, runs, youtube_url, useFewshot = False ):
+                               llm_model, batch_size, pipeline, runs, youtube_url, useFewshot = False,
+                               return_dataframe=True):
     """
     Salva (ou acrescenta) as estatísticas dos experimentos em um arquivo CSV.
     Retorna um DataFrame com as estatísticas consolidadas.
+    :param return_dataframe: Se False, não relê o CSV inteiro e retorna None
+                             (para históricos grandes, prefira ResultStore).
     """
     fieldnames = [
         "youtube_url",
@@ -77,33 +84,9 @@ def save_experiment_statistics(experiments_results, csv_filename,
 
         # Itera sobre cada execução (run)
         for run in experiments_results.get("runs", []):
-            final_inspection_data = run.get("final_inspection", "{}")
-
-            # Se for uma string, tenta converter usando json.loads()
-            if isinstance(final_inspection_data, str):
-                try:
-                    final_inspection = json.loads(final_inspection_data)
-                except json.JSONDecodeError:
-                    print(f"Erro ao decodificar JSON na execução {run.get('experiment_run')}")
-                    final_inspection = {}
-            # Se for uma lista, tenta pegar o primeiro elemento (convertendo-o se necessário)
-            elif isinstance(final_inspection_data, list):
-                try:
-                    elem = final_inspection_data[0]
-                    if isinstance(elem, str):
-                        final_inspection = json.loads(elem)
-                    else:
-                        final_inspection = elem
-                except (IndexError, json.JSONDecodeError):
-                    print(f"Erro ao processar `final_inspection` na execução {run.get('experiment_run')}")
-                    final_inspection = {}
-            else:
-                final_inspection = final_inspection_data
-
-            # Se, após o processamento, final_inspection ainda for uma lista,
-            # pega o primeiro elemento (ou usa {} se estiver vazia)
-            if isinstance(final_inspection, list):
-                final_inspection = final_inspection[0] if final_inspection else {}
+            final_inspection = coerce_final_inspection(
+                run.get("final_inspection", "{}"), run.get("experiment_run")
+            )
 
             writer.writerow({
                 "youtube_url": youtube_url,
@@ -129,5 +112,7 @@ def save_experiment_statistics(experiments_results, csv_filename,
             })
 
     print(f"\nEstatísticas dos experimentos foram salvas (ou atualizadas) no arquivo '{csv_filename}'.")
+    if not return_dataframe:
+        return None
     df = pd.read_csv(csv_filename)
     return df